@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: latin-1
+###############################################################################
+
+###############################################################################
+## Title:                   batch_inspect.py                                  #
+## Brief description:       Inspect the brain volumes of several subjects.    #
+## Language version:        Python 2.7.12                                     #
+###############################################################################
+
+###############################################################################
+## Large description:                                                         #
+##      This file runs the inspection of 'brain_inspect.py' (steps 1 to 3)    #
+##      over every subject of a manifest. Subjects are processed in separate  #
+##      processes, the largest ones first, keeping at most '-jobs' of them    #
+##      running and their estimated memory under '-mem_cap'. Each subject     #
+##      writes its log and summary to its own output directory, and a failing#
+##      subject does not stop the others. '-batched' can not be combined      #
+##      with several '-workers'.                                              #
+##                                                                            #
+## Usage:                                                                     #
+##      python batch_inspect.py manifest.json [-out DIR] [-jobs N]            #
+##          [-mem_cap GB] [-workers N] [-cache DIR] [-packed] [-labels3d]     #
+##          [-batched] [-roi MARGIN]                                          #
+##                                                                            #
+## Manifest:                                                                  #
+##      JSON list of subjects. Files default to the names used by            #
+##      'brain_inspect.py', ordered as WM, GM, CSF and I3T:                   #
+##      [{"name": "s01", "path": "/data/s01/",                                #
+##        "files": ["I3TWM.hdr", "I3TGM.hdr", "I3TCSF.hdr", "I3T.hdr"]}]       #
+###############################################################################
+
+import multiprocessing as mp
+import traceback
+import json
+import time
+import sys
+import os
+import lib.logger_lib as logger         # Log creation
+import lib.MRI_inspector as mri         # 3D objects management
+
+default_files = ['I3TWM.hdr','I3TGM.hdr','I3TCSF.hdr','I3T.hdr']
+
+# Peak memory of a subject estimated as this many times the size of its files
+memory_factor = 12
+
+def subject_files(subject):
+    '''
+    Returns the paths of the header and voxels files of a subject.
+
+    Parameters:
+                subject:        <dict>
+                                Entry of the manifest.
+
+    Returns:
+                paths:          <list>
+                                Paths of the existing files.
+    '''
+    paths = []
+    for name in subject.get('files', default_files):
+        header = os.path.join(subject['path'], name)
+        voxels = header[:header.rfind('.')]+'.img'
+        for path in (header, voxels):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+
+    return paths
+
+def subject_size(subject):
+    '''
+    Returns the size in bytes of the files of a subject.
+    '''
+    return sum([os.path.getsize(path) for path in subject_files(subject)])
+
+def run_subject(subject, out_dir, options):
+    '''
+    Inspects the volumes of a subject and writes 'summary.json' and 'log.txt'
+    to 'out_dir'. Runs in its own process; exits with code 1 if the subject
+    fails.
+
+    Parameters:
+                subject:        <dict>
+                                Entry of the manifest.
+                out_dir:        <str>
+                                Output directory of the subject.
+                options:        <dict>
+                                'workers', 'cache', 'packed', 'labels3d',
+                                'batched' and 'roi'.
+    '''
+    log = logger.Logger(os.path.join(out_dir, 'log.txt'))
+    summary = {'name': subject['name'], 'status': 'ok'}
+    start_time = time.time()
+    try:
+        inspector = mri.MRI_inspect(log)
+        inspector.set_files_path(os.path.join(subject['path'], ''))
+        inspector.set_files_names(subject.get('files', default_files))
+        inspector.set_workers(options['workers'])
+        if options['cache'] is not None:
+            inspector.set_cache(options['cache'])
+        if options['roi'] is not None:
+            inspector.set_type3_roi(options['roi'])
+        summary.update(inspector.inspect_volumes(packed=options['packed'], \
+            labels3d=options['labels3d'], batched=options['batched']))
+    except Exception:
+        summary['status'] = 'failed'
+        summary['error'] = traceback.format_exc()
+        log.write_log('critical', 'File: batch_inspect.py Class: None Method: '\
+            'run_subject ::: '+summary['error'])
+    summary['seconds'] = time.time() - start_time
+    log.close()
+
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    if summary['status'] != 'ok':
+        sys.exit(1)
+
+def run_batch(subjects, out_root, jobs=1, mem_cap=None, options=None):
+    '''
+    Runs 'run_subject' for every subject, the largest first. A subject starts
+    when there are less than 'jobs' running and its estimated memory fits
+    under 'mem_cap' together with the running ones. A subject is always
+    started when none is running.
+
+    Parameters:
+                subjects:       <list>
+                                Entries of the manifest.
+                out_root:       <str>
+                                Directory of the output directories.
+                jobs:           <int>
+                                Maximum number of subjects running at once.
+                mem_cap:        <int>
+                                Maximum estimated memory in bytes. No limit if
+                                None.
+                options:        <dict>
+                                Options of 'run_subject'.
+
+    Returns:
+                results:        <list>
+                                Name, status, exit code and seconds of each
+                                subject.
+    '''
+    queue = sorted(subjects, key=subject_size, reverse=True)
+    running = []
+    results = []
+    while queue or running:
+        # Collect the finished subjects
+        for entry in list(running):
+            subject, process, memory, start_time = entry
+            if not process.is_alive():
+                process.join()
+                status = 'ok' if process.exitcode == 0 else 'failed'
+                results.append({'name': subject['name'], 'status': status, \
+                    'exitcode': process.exitcode, \
+                    'seconds': time.time() - start_time})
+                print ('Subject {} {} ({} left)'.format(subject['name'], \
+                    status, len(queue) + len(running) - 1))
+                running.remove(entry)
+
+        # Start the next subjects that fit
+        used = sum([entry[2] for entry in running])
+        while queue and len(running) < jobs:
+            memory = subject_size(queue[0]) * memory_factor
+            if running and mem_cap is not None and used + memory > mem_cap:
+                break
+            subject = queue.pop(0)
+            out_dir = os.path.join(out_root, subject['name'])
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            process = mp.Process(target=run_subject, args=(subject, out_dir, \
+                options))
+            process.start()
+            running.append((subject, process, memory, time.time()))
+            used += memory
+
+        if running:
+            time.sleep(0.5)
+
+    return results
+
+if __name__ == '__main__':
+    source_dir = sys.path[0]
+    manifest_file = sys.argv[1]
+    with open(manifest_file) as f:
+        subjects = json.load(f)
+
+    out_root = source_dir+'/evaluation/batch/'
+    if '-out' in sys.argv:
+        out_root = sys.argv[sys.argv.index('-out')+1]
+    jobs = 1
+    if '-jobs' in sys.argv:
+        jobs = max(1, int(sys.argv[sys.argv.index('-jobs')+1]))
+    mem_cap = None
+    if '-mem_cap' in sys.argv:
+        mem_cap = float(sys.argv[sys.argv.index('-mem_cap')+1]) * 1024**3
+    options = {'workers': 1, 'cache': None, 'packed': '-packed' in sys.argv, \
+        'labels3d': '-labels3d' in sys.argv, 'batched': '-batched' in sys.argv, \
+        'roi': None}
+    if '-workers' in sys.argv:
+        options['workers'] = int(sys.argv[sys.argv.index('-workers')+1])
+    if '-cache' in sys.argv:
+        options['cache'] = sys.argv[sys.argv.index('-cache')+1]
+    if '-roi' in sys.argv:
+        options['roi'] = int(sys.argv[sys.argv.index('-roi')+1])
+    # The workers find the candidate regions of type 3 slice by slice
+    if options['batched'] and options['workers'] > 1:
+        print ('-batched can not be used with several -workers')
+        sys.exit(1)
+
+    if not os.path.isdir(out_root):
+        os.makedirs(out_root)
+
+    print ('Inspecting {} subjects with {} jobs...'.format(len(subjects), jobs))
+    results = run_batch(subjects, out_root, jobs, mem_cap, options)
+    with open(os.path.join(out_root, 'batch.json'), 'w') as f:
+        json.dump(results, f, indent=1)
+    failed = [result['name'] for result in results if result['status'] != 'ok']
+    print ('Done. {} subjects failed: {}'.format(len(failed), failed))
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+# -*- coding: latin-1
+###############################################################################
+## Title:                   bench_pipeline.py                                 #
+## Brief description:       Time the inspection stages on synthetic phantoms. #
+## Language version:        Python 2.7.12                                     #
+###############################################################################
+
+###############################################################################
+## Large description:                                                         #
+##      Generates phantoms of increasing slice size (see 'phantoms.py') and  #
+##      runs over them the stages of 'brain_inspect.py', timing each one.    #
+##      Every size runs in its own process, so the peak memory reported is   #
+##      the one of that size alone. With '-export' the plots are written by  #
+##      'Overlay_exporter' instead of matplotlib. Results are written as JSON #
+##      to compare runs. Sizes whose process fails or runs over '-timeout'   #
+##      seconds are recorded as failed.                                      #
+##                                                                            #
+## Usage:                                                                     #
+##      python benchmarks/bench_pipeline.py [-sizes 128,256] [-slices 32]     #
+##          [-blobs 40] [-noise 0.01] [-holes 0.3] [-plot_slices 4]           #
+##          [-export] [-timeout 3600] [-out benchmarks/results.json]          #
+###############################################################################
+
+import multiprocessing as mp
+import tempfile
+import resource
+import shutil
+import json
+import time
+import sys
+import os
+try:
+    import Queue as queue               # Python 2
+except ImportError:
+    import queue
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+import lib.logger_lib as logger         # Log creation
+import lib.MRI_inspector as mri         # 3D objects management
+import phantoms
+
+# Stages of the separate preprocessing and binarization, timed to compare them
+# with 'preprocess_binarize'. The pipeline only runs the latter, so they are
+# not counted in the throughput.
+reference_stages = ['preprocess_serie', 'binarize_serie']
+
+class Stage_clock(object):
+    '''
+    Accumulates the time spent in each stage, in order of first use.
+    '''
+
+    def __init__(self):
+        self.stages = []
+        self.seconds = {}
+        self.start = None
+
+    def tick(self):
+        self.start = time.time()
+
+    def tock(self, stage):
+        if stage not in self.seconds:
+            self.stages.append(stage)
+            self.seconds[stage] = 0.0
+        self.seconds[stage] += time.time() - self.start
+        self.start = time.time()
+
+    def split(self, stage, parts):
+        '''
+        Moves part of the time of 'stage' to other stages, given as pairs of
+        stage name and seconds.
+        '''
+        for part, seconds in parts:
+            self.seconds[stage] -= seconds
+            if part not in self.seconds:
+                self.stages.append(part)
+                self.seconds[part] = 0.0
+            self.seconds[part] += seconds
+
+def bench_size(params, work_dir):
+    '''
+    Returns the timings of every stage over a phantom generated with
+    'params'.
+
+    Parameters:
+                params:         <dict>
+                                'shape', 'slices', 'blobs', 'noise', 'holes'
+                                'plot_slices' and 'export'.
+                work_dir:       <str>
+                                Directory for the phantom files and plots.
+
+    Returns:
+                result:         <dict>
+                                Parameters, seconds per stage, seconds and
+                                throughput of the pipeline stages (all but
+                                'reference_stages'), peak memory, counts of
+                                blobs and objects and counters of 'Run_timer'.
+    '''
+    volumes = phantoms.make_phantom(tuple(params['shape']), params['slices'], \
+        params['blobs'], params['noise'], params['holes'])
+    files = phantoms.write_phantom(work_dir, volumes)
+    del volumes
+
+    log = logger.Logger(os.path.join(work_dir, 'log.txt'))
+    clock = Stage_clock()
+    inspector = mri.MRI_inspect(log)
+    inspector.set_timer()
+    inspector.set_files_path(os.path.join(work_dir, ''))
+    inspector.set_files_names(files)
+    inspector.make_matter_objs()
+    if params.get('export'):
+        inspector.set_plot_exporter()
+
+    clock.tick()
+    for matter_obj in inspector.matter_obj_list:
+        matter_obj.read_file()
+    clock.tock('read_input')
+    for matter_obj in inspector.matter_obj_list:
+        matter_obj.preprocess()
+    clock.tock('preprocess_serie')
+    for matter_obj in inspector.matter_obj_list:
+        matter_obj.binarize(threshold=80)
+    clock.tock('binarize_serie')
+    for matter_obj in inspector.matter_obj_list:
+        matter_obj.preprocess_binarize(threshold=80)
+    clock.tock('preprocess_binarize')
+    for matter_obj in inspector.matter_obj_list:
+        matter_obj.make_slice_objs()
+    clock.tock('make_slice_objs')
+
+    n_blobs = 0
+    for matter_obj in inspector.matter_obj_list[:-2]:
+        for slice_obj in matter_obj.slices_obj_list:
+            slice_obj.find_slice_labels()
+        clock.tock('find_labels')
+        for slice_obj in matter_obj.slices_obj_list:
+            slice_obj.make_blob_objs()
+            n_blobs += len(slice_obj.blobs_obj_list)
+        clock.tock('create_blob_objs')
+        for slice_obj in matter_obj.slices_obj_list:
+            for blob_obj in slice_obj.blobs_obj_list:
+                blob_obj.find_blob_centroid()
+            slice_obj.find_blobs_inner_regions()
+        clock.tock('find_inner_region')
+
+    inspector.make_imobj_slice_objects()
+    clock.tock('make_imobj_slice_objects')
+    # Types are found slice by slice, as in the pipeline, so the context of
+    # each slice is released before the next one. Their seconds are taken 
+    # from the stages of the timer, the rest is making the image objects.
+    counts = [0, 0, 0]
+    for imobj_slice in inspector.imobj_slice_obj_list:
+        imobj_slice.find_imobjs_type1()
+        imobj_slice.make_imobj_objects_type1()
+        counts[0] += len(imobj_slice.type1_imobjs_list)
+        imobj_slice.find_imobjs_type2()
+        imobj_slice.make_imobj_objects_type2()
+        counts[1] += len(imobj_slice.type2_imobjs_list)
+        imobj_slice.find_imobjs_type3()
+        imobj_slice.make_imobj_objects_type3()
+        counts[2] += len(imobj_slice.type3_imobjs_list)
+    clock.tock('make_imobj_objects')
+    clock.split('make_imobj_objects', [(stage, \
+        inspector.timer.stage_seconds.get(stage, 0.0)) for stage in \
+        ['type1', 'type2', 'type3']])
+
+    plot_slices = inspector.imobj_slice_obj_list[:params['plot_slices']]
+    for imobj_slice in plot_slices:
+        imobj_slice.plot_imslice_labels(os.path.join(work_dir, 'plot{}'.format(\
+            imobj_slice.imslice_num)), f_ext='.png', \
+            shape=imobj_slice.wm_slice_obj.slc_arr.shape)
+    inspector.wait_plots()
+    clock.tock('plotting')
+    log.close()
+
+    total = sum([seconds for stage, seconds in clock.seconds.items() if \
+        stage not in reference_stages])
+    n_slices = len(inspector.imobj_slice_obj_list)
+    # 'ru_maxrss' is given in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return {'params': params,
+        'stages': [[stage, clock.seconds[stage]] for stage in clock.stages],
+        'seconds': total,
+        'slices_per_second': n_slices / total if total > 0 else None,
+        'voxels_per_second': n_slices * params['shape'][0] * \
+            params['shape'][1] / total if total > 0 else None,
+        'peak_memory_bytes': peak,
+        'blobs': n_blobs,
+        'objects': counts,
+        'counters': inspector.timer.report()['counters']}
+
+def run_in_process(params, work_dir, results):
+    results.put(bench_size(params, work_dir))
+
+def wait_result(process, results, timeout=None):
+    '''
+    Returns the result put in 'results' by 'process', or None if the process
+    ends without it or runs over 'timeout' seconds, in which case it is 
+    terminated.
+
+    Parameters:
+                process:        <multiprocessing.Process>
+                                Started process running 'run_in_process'.
+                results:        <multiprocessing.Queue>
+                                Queue the process puts its result in.
+                timeout:        <float>
+                                Maximum seconds to wait. No limit if None.
+
+    Returns:
+                result:         <dict>
+                                Result of 'bench_size', or None.
+    '''
+    start = time.time()
+    while timeout is None or time.time() - start < timeout:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may arrive after the process exits
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+    process.terminate()
+
+    return None
+
+def run_benchmarks(sizes, base_params, timeout=None):
+    '''
+    Returns the result of 'bench_size' for each slice size, each one run in a
+    new process. Sizes whose process fails or runs over 'timeout' seconds get
+    a result with 'failed' set and the exit code of the process.
+
+    Parameters:
+                sizes:          <list>
+                                Slice sizes, as square side lengths.
+                base_params:    <dict>
+                                Parameters shared by all the sizes.
+                timeout:        <float>
+                                Maximum seconds of each size. No limit if None.
+
+    Returns:
+                results:        <list>
+                                Results of 'bench_size'.
+    '''
+    results = []
+    for size in sizes:
+        params = dict(base_params)
+        params['shape'] = [size, size]
+        work_dir = tempfile.mkdtemp(prefix='brain_bench_')
+        try:
+            result_queue = mp.Queue()
+            process = mp.Process(target=run_in_process, args=(params, \
+                work_dir, result_queue))
+            process.start()
+            result = wait_result(process, result_queue, timeout)
+            process.join()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if result is None:
+            result = {'params': params, 'failed': True, \
+                'exitcode': process.exitcode}
+            print ('size {}: failed, exit code {}'.format(size, \
+                process.exitcode))
+        else:
+            print ('size {}: {:.2f} s, {:.1f} slices/s, peak {:.0f} MB'\
+                .format(size, result['seconds'], result['slices_per_second'], \
+                result['peak_memory_bytes'] / 1024.0**2))
+        results.append(result)
+
+    return results
+
+if __name__ == '__main__':
+    sizes = [128, 256]
+    if '-sizes' in sys.argv:
+        sizes = [int(size) for size in \
+            sys.argv[sys.argv.index('-sizes')+1].split(',')]
+    base_params = {'slices': 32, 'blobs': 40, 'noise': 0.01, 'holes': 0.3, \
+        'plot_slices': 4, 'export': '-export' in sys.argv}
+    for flag, key, kind in [('-slices', 'slices', int), \
+            ('-blobs', 'blobs', int), ('-noise', 'noise', float), \
+            ('-holes', 'holes', float), ('-plot_slices', 'plot_slices', int)]:
+        if flag in sys.argv:
+            base_params[key] = kind(sys.argv[sys.argv.index(flag)+1])
+    out_file = os.path.join(bench_dir, 'results.json')
+    if '-out' in sys.argv:
+        out_file = sys.argv[sys.argv.index('-out')+1]
+    timeout = None
+    if '-timeout' in sys.argv:
+        timeout = float(sys.argv[sys.argv.index('-timeout')+1])
+
+    results = run_benchmarks(sizes, base_params, timeout)
+    with open(out_file, 'w') as f:
+        json.dump({'date': time.strftime('%d/%m/%Y-%H:%M:%S'), \
+            'results': results}, f, indent=1)
+    print ('Results stored at \'{}\'.'.format(out_file))
+    if any([result.get('failed') for result in results]):
+        sys.exit(1)
@@ -0,0 +1,122 @@
+# -*- coding: latin-1
+###############################################################################
+## Title:                   phantoms.py                                       #
+## Brief description:       Synthetic brain phantoms for the benchmarks.      #
+## Language version:        Python 2.7.12                                     #
+###############################################################################
+
+###############################################################################
+## Large description:                                                         #
+##      Generates white matter, gray matter, cerebrospinal fluid and T1       #
+##      volumes with the structures the inspection looks for: white matter   #
+##      blobs surrounded by gray matter rings, some of them with holes, and  #
+##      isolated gray matter blobs, plus salt noise. Volumes are written as  #
+##      Analyze files with the names read by 'brain_inspect.py', so they     #
+##      replace the real scans of 'datos/'.                                   #
+###############################################################################
+
+import SimpleITK as sitk
+import numpy as np
+import os
+
+phantom_files = ['I3TWM.hdr','I3TGM.hdr','I3TCSF.hdr','I3T.hdr']
+
+def make_phantom(shape=(256, 256), n_slices=32, n_blobs=40, noise=0.01, \
+        hole_density=0.3, seed=0):
+    '''
+    Returns the binary volumes of a synthetic brain. Each slice has 'n_blobs'
+    structures at random positions: white matter disks inside gray matter
+    rings, a fraction 'hole_density' of them with a hole, and gray matter
+    disks alone. Structures drift slowly between slices, so they are
+    connected in 3d.
+
+    Parameters:
+                shape:          <tuple>
+                                Dimensions of the slices.
+                n_slices:       <int>
+                                Number of slices.
+                n_blobs:        <int>
+                                Number of structures per slice.
+                noise:          <float>
+                                Fraction of pixels flipped at random.
+                hole_density:   <float>
+                                Fraction of structures with a hole.
+                seed:           <int>
+                                Seed of the random generator.
+
+    Returns:
+                volumes:        <list>
+                                Boolean volumes of WM, GM and CSF, with shape
+                                'shape' + (n_slices,), slices along the last
+                                axis as in 'Matter.img3d'.
+    '''
+    rng = np.random.RandomState(seed)
+    rows, cols = shape
+    wm = np.zeros(shape+(n_slices,), dtype=np.bool_)
+    gm = np.zeros(shape+(n_slices,), dtype=np.bool_)
+    csf = np.zeros(shape+(n_slices,), dtype=np.bool_)
+
+    max_radius = max(4, min(rows, cols) // 20)
+    centers = np.column_stack([rng.uniform(0, rows, n_blobs), \
+        rng.uniform(0, cols, n_blobs)])
+    radii = rng.randint(3, max_radius + 1, n_blobs)
+    kinds = rng.uniform(0, 1, n_blobs)
+    holes = rng.uniform(0, 1, n_blobs) < hole_density
+    yy, xx = np.ogrid[:rows, :cols]
+    for k in range(n_slices):
+        centers += rng.normal(0, 0.5, centers.shape)
+        for (r, c), radius, kind, hole in zip(centers, radii, kinds, holes):
+            distance = np.hypot(yy - r, xx - c)
+            if kind < 0.7:
+                # White matter surrounded by gray matter
+                gm[..., k] |= distance <= radius + 2
+                wm[..., k] |= distance <= radius
+                if hole:
+                    wm[..., k] &= ~(distance <= radius / 2.0)
+            else:
+                gm[..., k] |= distance <= radius
+        gm[..., k] &= ~wm[..., k]
+        csf[..., k] = ~(wm[..., k] | gm[..., k]) & (rng.uniform(0, 1, shape) \
+            < 0.05)
+
+    for volume in (wm, gm, csf):
+        volume ^= rng.uniform(0, 1, volume.shape) < noise
+
+    return [wm, gm, csf]
+
+def write_phantom(out_dir, volumes, seed=0):
+    '''
+    Writes the phantom volumes as Analyze files, oriented so that
+    'Input_process' gives back the volumes. The T1 volume is made of the
+    intensities of each matter plus noise.
+
+    Parameters:
+                out_dir:        <str>
+                                Output directory.
+                volumes:        <list>
+                                Boolean volumes of WM, GM and CSF.
+                seed:           <int>
+                                Seed of the random generator.
+
+    Returns:
+                files:          <list>
+                                Names of the files written, as
+                                'phantom_files'.
+    '''
+    rng = np.random.RandomState(seed)
+    wm, gm, csf = volumes
+    t1 = 800*wm + 500*gm + 200*csf + rng.normal(0, 20, wm.shape)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    for volume, name in zip([wm, gm, csf, t1], phantom_files):
+        if volume.dtype == np.bool_:
+            # Matter volumes are probability maps in the real scans
+            volume = volume * 1000 + rng.uniform(0, 50, volume.shape)
+        # Inverse of the orientation of 'Input_process.preprocess_serie'
+        raw = np.transpose(volume[::-1, :, ::-1], (0, 2, 1))
+        image = sitk.GetImageFromArray(np.ascontiguousarray(raw)\
+            .astype(np.int16))
+        sitk.WriteImage(image, os.path.join(out_dir, name))
+
+    return list(phantom_files)
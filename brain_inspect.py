@@ -110,8 +110,12 @@ import sys                              # Used to locate file in disk
 source_dir = sys.path[0]
 plt.rcParams["image.cmap"] = "gray"
 
-# Start log
-log = logger.Logger(source_dir+'/evaluation/logs/log.txt')
+# Start log. Messages under the level given as i.e. '-log_level warn' are
+# discarded.
+log_level = 'log'
+if '-log_level' in sys.argv:
+    log_level = sys.argv[sys.argv.index('-log_level')+1]
+log = logger.Logger(source_dir+'/evaluation/logs/log.txt', level=log_level)
 start_time = time.clock()
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 log_class_heading = log_file_heading+'Class: None '
@@ -136,29 +140,90 @@ log.write_log('log',log_method_heading+'Start time: '+str(start_time)\
 inspector = mri.MRI_inspect(log)
 inspector.set_files_path(source_dir+'/datos/')
 inspector.set_files_names(['I3TWM.hdr','I3TGM.hdr','I3TCSF.hdr','I3T.hdr'])
-
-## Step 1.B: Make matter objects with the file names and path.
-inspector.make_matter_objs()
-
-for matter_obj in inspector.matter_obj_list:
-    print ('Files processing initialization:')
-    ## Step 1.C: Read image into matter_objects.
-    print ('Reading file {}...'.format(matter_obj.file_MRI_name))
-    matter_obj.read_file()
-
-    ## Step 1.D: Preprocess image.
-    print ('Preprocessing 3D image...')
-    matter_obj.preprocess()
-
-    print ('Binarizing 3D image...')
-    matter_obj.binarize(threshold=80)
-
-    ## Step 1.E: Make slices objects respect to each matter.
-    print ('Making slice objects of 3D image...')
-    matter_obj.make_slice_objs()
+# Number of processes to find image objects, i.e. '-workers 4'
+if '-workers' in sys.argv:
+    inspector.set_workers(sys.argv[sys.argv.index('-workers')+1])
+# The workers find the candidate regions of type 3 slice by slice, so they
+# can not be combined with '-batched'
+if '-batched' in sys.argv and inspector.workers > 1:
+    print ('-batched can not be used with several -workers')
+    sys.exit(1)
+# Number of processes rendering the plots in the background, i.e. 
+# '-plot_workers 2'. With '-export' plots are written without matplotlib, and
+# with '-montage' also tiled in a sheet and an animated strip per directory.
+if '-export' in sys.argv:
+    inspector.set_plot_exporter(montage='-montage' in sys.argv)
+elif '-plot_workers' in sys.argv:
+    inspector.set_plot_workers(sys.argv[sys.argv.index('-plot_workers')+1])
+# Directory to keep the results of the stages between runs, i.e. 
+# '-cache /tmp/brain_cache'. Stages whose inputs did not change are skipped.
+if '-cache' in sys.argv:
+    inspector.set_cache(sys.argv[sys.argv.index('-cache')+1])
+# Look for the candidate regions of type 3 only around the main blob of each
+# slice, i.e. '-roi 20' pixels of margin.
+if '-roi' in sys.argv:
+    inspector.set_type3_roi(int(sys.argv[sys.argv.index('-roi')+1]))
+# Time the stages and slices, i.e. '-timing evaluation/timing.json'. The report
+# is written there and the slowest stages and slices are printed at the end.
+timing_file = None
+if '-timing' in sys.argv:
+    timing_file = sys.argv[sys.argv.index('-timing')+1]
+    inspector.set_timer()
+
+## Streaming mode: with '-stream' steps 1 to 3 are performed one slice at a 
+## time over the mapped files. Only the records of the image objects found are
+## kept, so memory does not grow with the number of slices. With '-labels3d'
+## blobs are also related to their 3d connected component while streaming.
+if '-stream' in sys.argv:
+    print ('Streaming slices of the 3D images...')
+    inspector.make_matter_objs(lazy=True)
+    imobj_records = []
+    counts = [0, 0, 0]
+    out_plot_dir = source_dir+'/datos/labelled_objs/'
+    for imobj_slice in inspector.iter_imobj_slices(threshold=80, \
+            labels3d='-labels3d' in sys.argv):
+        imobj_records.append(imobj_slice.slice_record())
+        imobj_lists = [imobj_slice.type1_imobjs_list, \
+            imobj_slice.type2_imobjs_list, imobj_slice.type3_imobjs_list]
+        for obj_type, imobjs_list in enumerate(imobj_lists):
+            if len(imobjs_list) > 0:
+                counts[obj_type] += 1
+        if '-plot_objs' in sys.argv:
+            fill = 4 - len(list(str(imobj_slice.imslice_num)))
+            slice_name = 'imslice'+'0'*fill+str(imobj_slice.imslice_num)
+            imobj_slice.plot_imslice_labels(out_plot_dir+slice_name, \
+                f_ext='.png', shape=imobj_slice.wm_slice_obj.slc_arr.shape)
+    for obj_type, count in enumerate(counts):
+        print ('{} imslices have objects of type \'imobj_type{}\''.format(count,\
+            obj_type+1))
+    if inspector.labels_3d_streams is not None:
+        for name, stream in zip(['WM', 'GM'], inspector.labels_3d_streams):
+            print ('{} 3d connected components of matter {}'.format(\
+                stream.global_ids().max(), name))
     print ('Done.\n')
-
-
+    inspector.wait_plots()
+    inspector.report_timing(timing_file)
+    log.close()
+    sys.exit(0)
+
+## Steps 1.B to 1.E, 2.A to 2.C and 3.B to 3.H are performed by 
+## 'MRI_inspect.inspect_volumes', the same pipeline 'batch_inspect.py' runs.
+##   1.B: Make matter objects with the file names and path. With '-lazy' only
+##        file headers are read and voxels are mapped from disk.
+##   1.C: Read image into matter_objects. With '-cache' the file is only read
+##        if step 1.D is not cached.
+##   1.D: Preprocess and binarize image in a single stage. With '-packed'
+##        masks are stored 8 voxels per byte.
+##   1.E: Make slices objects respect to each matter.
+print ('Files processing, blobs processing and image objects identification...')
+summary = inspector.inspect_volumes(threshold=80, packed='-packed' in sys.argv,\
+    labels3d='-labels3d' in sys.argv, batched='-batched' in sys.argv, \
+    lazy='-lazy' in sys.argv)
+print ('{} slices inspected.'.format(summary['slices']))
+for obj_type, count in enumerate(summary['imslices']):
+    print ('{} imslices have objects of type \'imobj_type{}\''.format(count,\
+        obj_type+1))
+print ('Done.\n')
 
 ## Step 1.F: Save each slice matrix in a common image format. (PNG)
 if '-save' in sys.argv:
@@ -176,35 +241,13 @@ if '-save' in sys.argv:
 ###############################################################################
 
 # Step 2: Locate blobs in 2D
-#   A: Segment slices into different blobs by differently labelling them.
+#   A: Segment slices into different blobs by differently labelling them. With
+#      '-cache' steps 2.A and 2.B are loaded if cached, and with '-labels3d'
+#      blobs are also related to the 3d connected component they belong to.
 #   B: Make blob objects respect to each slice.
 #   C: Locate centroids and inner regions for future processing.
 #   D: Plot blobs labelled with centroids as label position.
 
-# It is performed blob localization and objects creation for WM, GM and CSF:
-print ('Blobs processing:')
-for matter_obj in inspector.matter_obj_list[:-2]: 
-    print ('Finding blobs of slices of matter {}...'.format(matter_obj.name))
-    for slice_obj in matter_obj.slices_obj_list:
-        ## Step 2.A: Segment slices into different blobs.
-        slice_obj.find_slice_labels()
-        ## Step 2.B: Make blob objects respect to each slice
-        slice_obj.make_blob_objs()
-    print ('Blob objects of each slice are created.')
-print ('Done.\n')
-
-## Step 2.C: Locate centroids and inner regions for future processing.
-for matter_obj in inspector.matter_obj_list[:-2]:
-    print ('Locating centroids and inner regions of blobs of slices of matter '\
-        '{}...'.format(matter_obj.name))
-    for slice_obj in matter_obj.slices_obj_list:
-        for blob_obj in slice_obj.blobs_obj_list:
-            blob_obj.find_blob_centroid()
-            blob_obj.find_inner_region()
-    print ('Centroids and inner regions located.'\
-        '{}...'.format(matter_obj.name))
-print ('Done.\n')
-
 ## Step 2.D: Plot blobs labelled with centroids as label position.
 if '-plot' in sys.argv:
     for matter_obj in inspector.matter_obj_list[:-1]:
@@ -230,87 +273,12 @@ if '-plot' in sys.argv:
 ##   G: Find objects type 3 (GM+WM, global) by checking the relation between
 ##       themselves and performing blob erosion
 ##   H: Make Image Objects type 3 class instances for each found matching blob.
+## With several workers, steps 3.C, 3.E and 3.G are performed at once in 
+## parallel over all the slices. With '-batched' the candidate regions of type
+## 3 of several slices are found at once.
 #
 ### Step 3.A: Explicitly name matter objects to ease management
 #i3twm, i3tgm, i3tcsf, i3t = inspector.essay_matter_access(inspector.matter_obj_list)
-#
-### Step 3.B: Make Image Object slices.
-print ('Structure image objects information in a classes family')
-print ('Making objects \'imobj_slice\' to store in a unique object the slices of '\
-    'different matters...')
-inspector.make_imobj_slice_objects(inspector.matter_obj_list)
-print ('Done.\n')
-
-
-print ('Finding objects of type \'imobj_type1\' for each \'imobj_slice\'. Each '\
-    'object stores a blob that satisfices the type 1 object constraints...')
-count=0
-for imobj_slice in inspector.imobj_slice_obj_list:
-    ## Step 3.C: Find objects type 1 (GM)
-    imobj_slice.find_imobjs_type1()
-    ## Step 3.D: Make Image Objects type 1
-    imobj_slice.make_imobj_objects_type1()
-    if len(imobj_slice.type1_imobjs_list) > 0:
-        count += 1
-print ('{} imslices have objects of type \'imobj_type1\''.format(count))
-
-print ('Finding objects of type \'imobj_type2\' for each \'imobj_slice\'. Each '\
-    'object stores a blob pair that satisfices the type 2 object constraints...')
-count=0
-for imobj_slice in inspector.imobj_slice_obj_list:
-    ## Step 3.E: Find objects type 2 (GM+WM)
-    imobj_slice.find_imobjs_type2()
-    ## Step 3.F: Make Image Objects type 2
-    imobj_slice.make_imobj_objects_type2()
-    if len(imobj_slice.type2_imobjs_list) > 0:
-        count += 1
-print ('{} imslices have objects of type \'imobj_type2\''.format(count))
-print ('Done.\n')
-
-###############
-##########
-#####
-#slice_proof = inspector.imobj_slice_obj_list[125]
-#slice_proof.find_imobjs_type3()
-#slice_proof.make_imobj_objects_type3()
-
-#if len(slice_proof.type3_imobjs_list) > 0:
- #   for imobj3 in slice_proof.type3_imobjs_list:
- #       print ('in imslice {} there are a imobj of type {} at position {}'\
- #           .format(imobj3.imslice_number, imobj3.obj_type, imobj3.imobj_position))
-
-#    fig, ax0 = plt.subplots()
-#    ax0.imshow(slice_proof.type3_imobjs_list[0].imobj_lbl, cmap='nipy_spectral')
-#    ax0.set_title('imobj3-{}_slc{}.imobj_lbl'\
-#        .format(slice_proof.type3_imobjs_list[0].imobj_position,\
-#        slice_proof.type3_imobjs_list[0].imslice_number))
-
-#if len(slice_proof.type3_imobjs_list) == 2:
-#    fig, ax1 = plt.subplots()
-#    ax1.imshow(slice_proof.type3_imobjs_list[1].imobj_lbl, cmap='nipy_spectral')
-#    ax1.set_title('imobj3-{}_slc{}.imobj_lbl'\
-#        .format(slice_proof.type3_imobjs_list[1].imobj_position,\
-#        slice_proof.type3_imobjs_list[1].imslice_number))
-
-#plt.show()
-
-#slice_proof.plot_imslice_labels(source_dir+'/datos/labelled_objs/imslice0.png', f_ext='.png')
-
-#####
-##########
-###############
-print ('Finding objects of type \'imobj_type3\' for each \'imslice\'. Each '\
-    'object stores a blob pair that satisfices the type 3 object constraints...')
-count=0
-for imobj_slice in inspector.imobj_slice_obj_list:
-    ## Step 3.G: Find objects type 3 (GM+WM, global)
-    imobj_slice.find_imobjs_type3()
-    ## Step 3.H: Make Image Objects type 3
-    imobj_slice.make_imobj_objects_type3()
-    if len(imobj_slice.type3_imobjs_list) > 0:
-        count += 1
-print ('{} imslices have objects of type \'imobj_type3\''.format(count))
-print ('Done.\n')
 
 ################################################################################
 ###---------------------------------------------------------------------------##
@@ -343,7 +311,8 @@ if '-plot_objs' in sys.argv:
 ##########
 ###############
 
-
-
-
-
+# Wait for the plots rendered in the background, report the timing and write
+# the pending log messages
+inspector.wait_plots()
+inspector.report_timing(timing_file)
+log.close()
@@ -1,24 +1,32 @@
-from inspect import stack                   # To write log
 import matter_lib as matt
+import label3d_lib as lb3           # Streaming 3d labelling
 import structure as sct             # Structure objects hierarchy
+import parallel_lib as par          # Slice-parallel classification
+import cache_lib as cch             # Stage results cache
+import render_lib as rnd            # Background rendering of plots
+import export_lib as exp            # Plots without matplotlib
+import timing_lib as tmg            # Timers and counters of the run
 
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class MRI_inspect(object):
+    log_class_heading = log_file_heading+"Class: MRI_inspect"
     files_MRI_path = ''
     files_MRI_names = []
     matter_obj_list = []
     related_blob_list = []
     imobj_slice_obj_list = []
+    workers = 1
+    cache = None
+    renderer = None
+    timer = tmg.null_timer
+    labels_3d_streams = None
 
     def __init__(self, log):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
         self.struct = sct.Structure(self.log)
 
     def set_files_path(self, files_path):
@@ -52,10 +60,149 @@ class MRI_inspect(object):
         '''
         self.files_MRI_names = files_names
 
-    def make_matter_objs(self, filespath=None, filesnames=None):
+    def set_workers(self, workers):
+        '''
+        Stores as an attribute the number of processes used to find the image
+        objects of the slices. With a single one, slices are processed 
+        serially.
+
+        Input parameters:
+                    workers:        <int>
+                                    Number of worker processes.
+
+        Updates object atributes:
+                    workers:        <int>
+                                    Number of worker processes.
+        '''
+        self.workers = max(1, int(workers))
+
+    def set_type3_roi(self, margin=20):
+        '''
+        Crops each slice around the main blob of its mixed mask, plus 'margin'
+        pixels at each side, when looking for the candidate regions of type 3.
+        Only the blobs over the main blob can be of type 3, but the distance
+        threshold is taken over the window and seeds outside it are not seen,
+        so the regions are not only split differently than over the whole 
+        slice: objects of type 3 not found over the whole slice may be added.
+        Batched and parallel findings crop each slice to its own window and 
+        give the same objects as the serial one.
+
+        Input parameters:
+                    margin:         <int>
+                                    Pixels around the bounding box of the main
+                                    blob. The whole slices are used if None.
+
+        Updates object atributes of 'struct.loc':
+                    roi_margin:     <int>
+        '''
+        self.struct.loc.roi_margin = margin
+
+    def set_plot_workers(self, workers):
+        '''
+        Stores as an attribute a pool of 'workers' processes that render the
+        plots in the background. Plots of the objects created by 'struct' are
+        queued to it instead of being rendered one after the other.
+
+        Input parameters:
+                    workers:        <int>
+                                    Number of render processes.
+
+        Updates object atributes:
+                    renderer:       <lib.render_lib.Render_pool>
+                                    Pool of render processes.
+        '''
+        self.renderer = rnd.Render_pool(self.log, max(1, int(workers)))
+        self.struct.loc.renderer = self.renderer
+
+    def set_plot_exporter(self, montage=False):
+        '''
+        Stores as an attribute an exporter that writes the plots of the
+        objects created by 'struct' without matplotlib. With 'montage', the
+        plots of each directory are also tiled in a sheet and an animated
+        strip.
+
+        Input parameters:
+                    montage:        <bool>
+                                    Also write the montages.
+
+        Updates object atributes:
+                    renderer:       <lib.export_lib.Overlay_exporter>
+                                    Exporter of the plots.
+        '''
+        self.renderer = exp.Overlay_exporter(self.log, montage=montage)
+        self.struct.loc.renderer = self.renderer
+
+    def wait_plots(self):
+        '''
+        Waits until every queued plot is written and stops the render
+        processes, or writes the montages of the exporter. Plots are rendered
+        in the foreground afterwards. The wait is timed as stage 'plotting'.
+        '''
+        if self.renderer is not None:
+            with self.timer.stage('plotting'):
+                self.renderer.close()
+            self.renderer = None
+            self.struct.loc.renderer = None
+
+    def set_timer(self):
+        '''
+        Stores as an attribute a timer that records the time of each stage and
+        slice and the counters of the run, shared with the objects created by
+        'struct'. Without it, a timer that records nothing is used. Stages run
+        by worker processes are only timed as a whole.
+
+        Updates object atributes:
+                    timer:          <lib.timing_lib.Run_timer>
+                                    Timer of the run.
+        '''
+        self.timer = tmg.Run_timer(self.log)
+        self.struct.timer = self.timer
+        self.struct.loc.timer = self.timer
+
+    def report_timing(self, out_f_path=None, top=5):
+        '''
+        Prints a summary of the 'top' slowest stages and slices and, if
+        'out_f_path' is given, writes the full report of the timer as JSON.
+        Does nothing without a timer.
+
+        Input parameters:
+                    out_f_path:     <str>
+                                    Path of the JSON report.
+                    top:            <int>
+                                    Number of stages and slices summarized.
+        '''
+        if not self.timer.enabled:
+            return
+
+        if out_f_path is not None:
+            self.timer.write_report(out_f_path)
+        print (self.timer.summary(top))
+
+    def set_cache(self, cache_dir, max_bytes=2*1024**3):
+        '''
+        Stores as an attribute a cache of the results of the stages in 
+        'cache_dir', so stages whose inputs did not change are skipped in the
+        following runs. Must be called before 'make_matter_objs'.
+
+        Input parameters:
+                    cache_dir:      <str>
+                                    Path to the cache directory.
+                                    /path/to/directory/
+                    max_bytes:      <int>
+                                    Maximum size of the cache in bytes.
+
+        Updates object atributes:
+                    cache:          <lib.cache_lib.Stage_cache>
+                                    Cache of the stages.
+        '''
+        self.cache = cch.Stage_cache(self.log, cache_dir, max_bytes)
+
+    def make_matter_objs(self, filespath=None, filesnames=None, lazy=False):
         '''
         Stores as an attribute the list resulting of using the files pointed by
         'filespath' and 'filesnames' to create objects of class 'Matter'.
+        With 'lazy', only the headers of the files are read and the voxels of
+        each matter are mapped from disk (see 'Matter.map_file').
         By default takes self object attributes.
 
         Input parameters:
@@ -65,6 +212,8 @@ class MRI_inspect(object):
                     filesnames:     <list>
                                     List with the names of files. 
                                     ['filename.extension',...] 
+                    lazy:           <bool>
+                                    Map the voxels instead of reading them.
 
         Updates object atributes:
                     matter_obj_list: <list>
@@ -76,6 +225,11 @@ class MRI_inspect(object):
             filesnames = self.files_MRI_names
 
         self.matter_obj_list = self.struct.create_matter_objs(filespath, filesnames)
+        for matter_obj in self.matter_obj_list:
+            matter_obj.set_cache(self.cache)
+        if lazy:
+            for matter_obj in self.matter_obj_list:
+                matter_obj.map_file()
 
 #    def essay_matter_access(self, matters_to_name):
 #        '''
@@ -128,4 +282,256 @@ class MRI_inspect(object):
         if matter_objs is None:
             matter_objs = self.matter_obj_list
 
-        self.imobj_slice_obj_list = self.struct.create_imobj_slice_objs(matter_objs)
+        with self.timer.stage('make_imobj_slice_objects'):
+            self.imobj_slice_obj_list = self.struct.create_imobj_slice_objs(\
+                matter_objs)
+
+    def find_imobjs_parallel(self, matter_objs=None, imobj_slices=None, \
+            workers=None):
+        '''
+        Finds the candidate blobs of image objects of types 1, 2 and 3 of all
+        the image object slices, distributing the slices among 'workers' 
+        processes. The result is the same as calling 'find_imobjs_type1',
+        'find_imobjs_type2' and 'find_imobjs_type3' of each slice.
+        By default takes self object attributes.
+
+        Parameters:
+                    matter_objs:    <list>
+                                    List of objects of class 'Matter'
+                    imobj_slices:   <list>
+                                    List of objects of class 'ImageObjectSlice'
+                    workers:        <int>
+                                    Number of worker processes.
+
+        Updates object atributes of each image object slice:
+                    type1_blobs, type2_blobs_wm, type2_blobs_gm, type3_blobs_wm,
+                    type3_blobs_gm
+        '''
+        if matter_objs is None:
+            matter_objs = self.matter_obj_list
+        if imobj_slices is None:
+            imobj_slices = self.imobj_slice_obj_list
+        if workers is None:
+            workers = self.workers
+
+        classifier = par.Parallel_classifier(self.log, workers, \
+            self.struct.loc.roi_margin)
+        with self.timer.stage('find_imobjs_parallel'):
+            records = classifier.classify_slices(matter_objs, len(imobj_slices))
+        for imobj_slice, record in zip(imobj_slices, records):
+            imobj_slice.load_slice_record(record)
+
+    def iter_type3_regions(self, imobj_slices=None, batch=32):
+        '''
+        Generator that finds the candidate regions of type 3 of the image 
+        object slices 'batch' slices at a time, with 
+        'Locate_blobs.find_candidate_regions_type3_stack', and yields each 
+        image object slice of the batch in order. Regions are kept by each
+        image object slice until 'find_imobjs_type3' uses them, which is to be
+        called before the next slice is requested, so only the regions of one
+        batch are kept at a time.
+        By default takes self object attributes.
+
+        Parameters:
+                    imobj_slices:   <list>
+                                    List of objects of class 'ImageObjectSlice'
+                    batch:          <int>
+                                    Number of slices processed at once.
+
+        Updates object atributes of each image object slice with blobs of gray
+        matter:
+                    type3_regions
+
+        Yields:
+                    imobj_slice:    <lib.imobj_lib.ImageObjectSlice>
+                                    Image object slice with its regions found.
+        '''
+        if imobj_slices is None:
+            imobj_slices = self.imobj_slice_obj_list
+
+        for first in range(0, len(imobj_slices), batch):
+            chunk = imobj_slices[first:first+batch]
+            with_blobs = [imobj_slice for imobj_slice in chunk if \
+                len(imobj_slice.gm_slice_obj.blobs_obj_list) > 0]
+            with self.timer.stage('find_type3_regions'):
+                regions = self.struct.loc.find_candidate_regions_type3_stack(\
+                    [imobj_slice.wm_slice_obj for imobj_slice in with_blobs], \
+                    [imobj_slice.gm_slice_obj for imobj_slice in with_blobs], \
+                    [imobj_slice.slice_context() for imobj_slice in with_blobs])
+            for imobj_slice, slice_regions in zip(with_blobs, regions):
+                imobj_slice.type3_regions = slice_regions
+            del regions
+            for imobj_slice in chunk:
+                yield imobj_slice
+
+    def iter_imobj_slices(self, matter_objs=None, threshold=80, \
+            labels3d=False):
+        '''
+        Generator that processes the matters one slice at a time. For each
+        slice number reads and binarizes the aligned slices of all matters,
+        labels them, creates their blobs and finds the image objects of types
+        1, 2 and 3. Yields the resulting 'ImageObjectSlice', which can be 
+        discarded after use, so memory does not grow with the number of
+        slices. Matters whose voxels are not loaded yet are mapped from disk.
+        With 'labels3d' the blobs of WM and GM are related to their 3d 
+        connected component as 'Matter.find_labels_3d' does, but their 
+        'blob_3d_id' is a provisional id: once the generator is exhausted, 
+        'labels_3d_streams[k].global_ids()' maps it to the final id.
+        By default takes self object attributes.
+
+        Parameters:
+                    matter_objs:    <list>
+                                    List of objects of class 'Matter', ordered
+                                    as WM, GM, CSF and I3T.
+                    threshold:      <int>
+                                    percent value over which pixels are going 
+                                    to be selected when binarizing.
+                    labels3d:       <bool>
+                                    Label the slices with a 3d labelling
+                                    stream per matter.
+
+        Updates object atributes:
+                    labels_3d_streams: <list>
+                                    Labelling streams of WM and GM, None 
+                                    without 'labels3d'.
+
+        Yields:
+                    imobj_slice:    <lib.imobj_lib.ImageObjectSlice>
+                                    Image object slice with its image objects
+                                    of types 1, 2 and 3 made.
+        '''
+        if matter_objs is None:
+            matter_objs = self.matter_obj_list
+
+        for matter_obj in matter_objs:
+            if matter_obj.npa_img is None:
+                matter_obj.map_file()
+            matter_obj.find_threshold(threshold=threshold)
+        self.labels_3d_streams = None
+        if labels3d:
+            self.labels_3d_streams = [lb3.Labels_3d_stream(self.log) for \
+                matter_obj in matter_objs[:2]]
+
+        for i in range(matter_objs[0].npa_img.shape[2]):
+            slices = []
+            for matter_obj in matter_objs:
+                slice_2d = matter_obj.binarize_slice(i)
+                slices.append(self.struct.create_slice_objs(slice_2d[..., None],\
+                    matter_obj.name, first_slice=i)[0])
+
+            # Blobs are only needed for white and gray matter
+            for k, slice_obj in enumerate(slices[:2]):
+                if labels3d:
+                    slice_obj.find_slice_labels_3d(self.labels_3d_streams[k])
+                else:
+                    slice_obj.find_slice_labels()
+                slice_obj.make_blob_objs()
+                for blob_obj in slice_obj.blobs_obj_list:
+                    blob_obj.find_blob_centroid()
+                slice_obj.find_blobs_inner_regions()
+
+            imobj_slice = self.struct.create_imobj_slice_obj(slices)
+            imobj_slice.find_imobjs_type1()
+            imobj_slice.make_imobj_objects_type1()
+            imobj_slice.find_imobjs_type2()
+            imobj_slice.make_imobj_objects_type2()
+            imobj_slice.find_imobjs_type3()
+            imobj_slice.make_imobj_objects_type3()
+
+            yield imobj_slice
+
+    def inspect_volumes(self, threshold=80, packed=False, labels3d=False, \
+            batched=False, lazy=False):
+        '''
+        Performs steps 1 to 3 of 'brain_inspect.py' over the files set with
+        'set_files_path' and 'set_files_names': preprocessing, blobs location
+        and image objects identification. Uses the workers and cache set in the
+        object, and no plot is made. Both 'brain_inspect.py' and 
+        'batch_inspect.py' run the pipeline through this method.
+
+        Parameters:
+                    threshold:      <int>
+                                    percent value over which pixels are going 
+                                    to be selected when binarizing.
+                    packed:         <bool>
+                                    Store the masks packed 8 voxels per byte.
+                    labels3d:       <bool>
+                                    Relate blobs to their 3d components.
+                    batched:        <bool>
+                                    Find the candidate regions of type 3 of
+                                    several slices at once. Ignored, with a
+                                    warning, when several workers are set.
+                    lazy:           <bool>
+                                    Map the voxels of the files from disk 
+                                    instead of reading them.
+
+        Returns:
+                    summary:        <dict>
+                                    'slices': number of slices, 'imslices': 
+                                    number of image object slices with objects
+                                    of each type and 'objects': per slice, the
+                                    blob numbers of types 1 and 2 and the
+                                    positions of type 3.
+
+        Updates object atributes:
+                    matter_obj_list, imobj_slice_obj_list
+        '''
+        self.make_matter_objs(lazy=lazy)
+        for matter_obj in self.matter_obj_list:
+            matter_obj.preprocess_binarize(threshold=threshold, packed=packed)
+            matter_obj.make_slice_objs()
+
+        for matter_obj in self.matter_obj_list[:-2]:
+            if not matter_obj.load_blobs(labels3d=labels3d):
+                if labels3d:
+                    matter_obj.find_labels_3d()
+                for slice_obj in matter_obj.slices_obj_list:
+                    if not labels3d:
+                        slice_obj.find_slice_labels()
+                    slice_obj.make_blob_objs()
+                matter_obj.store_blobs(labels3d=labels3d)
+            for slice_obj in matter_obj.slices_obj_list:
+                for blob_obj in slice_obj.blobs_obj_list:
+                    blob_obj.find_blob_centroid()
+                slice_obj.find_blobs_inner_regions()
+                slice_obj.release_unpacked()
+
+        self.make_imobj_slice_objects()
+        imobj_slices = self.imobj_slice_obj_list
+        if self.workers > 1:
+            if batched:
+                self.log.write_ctx("warn", self.log_class_heading, \
+                    "inspect_volumes", "'batched' ignored: the workers find "\
+                    "the candidate regions of type 3 slice by slice")
+            self.find_imobjs_parallel()
+        elif batched:
+            # The regions of each batch are found before its slices are 
+            # processed
+            imobj_slices = self.iter_type3_regions()
+
+        counts = [0, 0, 0]
+        objects = []
+        for imobj_slice in imobj_slices:
+            if self.workers == 1:
+                imobj_slice.find_imobjs_type1()
+                imobj_slice.find_imobjs_type2()
+                imobj_slice.find_imobjs_type3()
+            imobj_slice.make_imobj_objects_type1()
+            imobj_slice.make_imobj_objects_type2()
+            imobj_slice.make_imobj_objects_type3()
+            imobj_lists = [imobj_slice.type1_imobjs_list, \
+                imobj_slice.type2_imobjs_list, imobj_slice.type3_imobjs_list]
+            for obj_type, imobjs_list in enumerate(imobj_lists):
+                if len(imobjs_list) > 0:
+                    counts[obj_type] += 1
+            objects.append({'imslice': imobj_slice.imslice_num,
+                'type1': [int(imobj.blob.blob_num) for imobj in \
+                    imobj_slice.type1_imobjs_list],
+                'type2': [[int(imobj.blob_wm.blob_num), \
+                    int(imobj.blob_gm.blob_num)] for imobj in \
+                    imobj_slice.type2_imobjs_list],
+                'type3': [imobj.imobj_position for imobj in \
+                    imobj_slice.type3_imobjs_list]})
+
+        return {'slices': len(self.imobj_slice_obj_list), 'imslices': counts, \
+            'objects': objects}
@@ -0,0 +1,254 @@
+import numpy as np
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# Number of bits set in each possible byte.
+popcount_table = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], \
+    axis=1).sum(axis=1).astype(np.intp)
+
+class Bit_volume(object):
+    '''
+    Binary volume packed 8 voxels per byte along the rows of each slice.
+    Slices are the last axis of the volume, as in 'Matter.img3d', and they are
+    stored one after the other, so a slice is a contiguous block of bytes.
+    Dense slices are only built when they are requested.
+    '''
+    log_class_heading = log_file_heading+"Class: Bit_volume"
+    bits = None
+    shape = None
+
+    def __init__(self, log, volume=None, bits=None, shape=None, chunk=16):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        if volume is not None:
+            self.bits, self.shape = pack_volume(volume, chunk)
+        else:
+            self.bits = bits
+            self.shape = tuple(shape)
+
+    @property
+    def nbytes(self):
+        '''
+        Number of bytes used by the packed voxels.
+        '''
+        return self.bits.nbytes
+
+    def __getitem__(self, key):
+        '''
+        Returns dense slices of the volume. Only indexing along the slices
+        axis is supported: 'volume[..., i]' gives a 2d slice and
+        'volume[..., i:j]' a 3d block.
+        '''
+        if not (isinstance(key, tuple) and len(key) == 2 and key[0] is Ellipsis):
+            raise IndexError('Bit_volume only supports [..., index] indexing')
+
+        index = key[1]
+        if isinstance(index, slice):
+            numbers = range(*index.indices(self.shape[2]))
+            block = np.zeros(self.shape[:2]+(len(numbers),), dtype=np.bool_)
+            for k, number in enumerate(numbers):
+                block[..., k] = self.packed(number).dense()
+            return block
+
+        return self.packed(index).dense()
+
+    def packed(self, slice_number):
+        '''
+        Returns the slice 'slice_number' still packed, without copying it.
+
+        Parameters:
+                    slice_number:   <int>
+                                    Number of the slice.
+
+        Returns:
+                    bit_slice:      <lib.bitvol_lib.Bit_slice>
+                                    Packed 2d slice.
+        '''
+        return Bit_slice(self.bits[slice_number], self.shape[1])
+
+    def dense(self):
+        '''
+        Returns the whole volume as a boolean array.
+
+        Returns:
+                    volume:         <numpy.ndarray>
+                                    3d boolean image.
+        '''
+        return self[..., :]
+
+    def count(self, slice_number=None):
+        '''
+        Returns the number of voxels set, in a slice or in the whole volume.
+
+        Parameters:
+                    slice_number:   <int>
+                                    Number of the slice. All of them if None.
+
+        Returns:
+                    count:          <int>
+                                    Number of voxels set.
+        '''
+        if slice_number is None:
+            return popcount(self.bits)
+
+        return popcount(self.bits[slice_number])
+
+    def overlap(self, other, slice_number=None):
+        '''
+        Returns the number of voxels set in both volumes, in a slice or in the
+        whole volume. Bytes are compared without unpacking them.
+
+        Parameters:
+                    other:          <lib.bitvol_lib.Bit_volume>
+                                    Volume with the same shape.
+                    slice_number:   <int>
+                                    Number of the slice. All of them if None.
+
+        Returns:
+                    count:          <int>
+                                    Number of voxels set in both volumes.
+        '''
+        if slice_number is None:
+            return popcount(self.bits & other.bits)
+
+        return popcount(self.bits[slice_number] & other.bits[slice_number])
+
+    def __and__(self, other):
+        return Bit_volume(self.log, bits=self.bits & other.bits, \
+            shape=self.shape)
+
+    def __or__(self, other):
+        return Bit_volume(self.log, bits=self.bits | other.bits, \
+            shape=self.shape)
+
+class Bit_slice(object):
+    '''
+    Binary 2d slice packed 8 pixels per byte along its rows.
+    '''
+    log_class_heading = log_file_heading+"Class: Bit_slice"
+    bits = None
+    shape = None
+
+    def __init__(self, bits, width):
+        self.bits = bits
+        self.shape = (bits.shape[0], width)
+
+    def dense(self):
+        '''
+        Returns the slice as a boolean array.
+
+        Returns:
+                    slice_2d:       <numpy.ndarray>
+                                    2d boolean image.
+        '''
+        return np.unpackbits(self.bits, axis=1)[:, :self.shape[1]]\
+            .astype(np.bool_)
+
+    def count(self):
+        '''
+        Returns the number of pixels set in the slice.
+        '''
+        return popcount(self.bits)
+
+    def overlap(self, other):
+        '''
+        Returns the number of pixels set in both slices.
+        '''
+        return popcount(self.bits & other.bits)
+
+    def overlap_crop(self, crop, bbox):
+        '''
+        Returns the number of pixels set both in the slice and in 'crop', a
+        binary image placed at the bounding box 'bbox' of the slice, as the
+        masks of the blobs are. Only the bytes of the rows and columns of the
+        box are compared.
+
+        Parameters:
+                    crop:           <numpy.ndarray>
+                                    2d binary image of the shape of 'bbox'.
+                    bbox:           <tuple>
+                                    Bounding box of 'crop' in the slice:
+                                    (min_row, min_col, max_row, max_col).
+
+        Returns:
+                    count:          <int>
+                                    Number of pixels set in both.
+        '''
+        # The crop is shifted to start at a byte of the rows of the slice
+        first_byte = bbox[1] // 8
+        shift = bbox[1] - first_byte*8
+        aligned = np.zeros((crop.shape[0], shift+crop.shape[1]), \
+            dtype=np.bool_)
+        aligned[:, shift:] = crop
+        crop_bits = np.packbits(aligned, axis=1)
+        window = self.bits[bbox[0]:bbox[2], \
+            first_byte:first_byte+crop_bits.shape[1]]
+
+        return popcount(window & crop_bits)
+
+    def __and__(self, other):
+        return Bit_slice(self.bits & other.bits, self.shape[1])
+
+    def __or__(self, other):
+        return Bit_slice(self.bits | other.bits, self.shape[1])
+
+def pack_volume(volume, chunk=16):
+    '''
+    Returns the voxels of a binary volume packed along the rows of each slice,
+    slices first. The volume is read 'chunk' slices at a time.
+
+    Parameters:
+                volume:         <numpy.ndarray>
+                                3d binary image. Slices are the last axis.
+                chunk:          <int>
+                                Number of slices packed at a time.
+
+    Returns:
+                bits:           <numpy.ndarray>
+                                Array of uint8 with shape (slices, rows,
+                                ceil(columns / 8)).
+                shape:          <tuple>
+                                Shape of the dense volume.
+    '''
+    shape = tuple(volume.shape)
+    bits = np.empty((shape[2], shape[0], (shape[1] + 7) // 8), dtype=np.uint8)
+    for first in range(0, shape[2], chunk):
+        block = np.asarray(volume[..., first:first+chunk]) != 0
+        bits[first:first+chunk] = np.packbits(np.transpose(block, (2, 0, 1)), \
+            axis=2)
+
+    return bits, shape
+
+def pack_slice(slice_2d):
+    '''
+    Returns a binary 2d image packed along its rows.
+
+    Parameters:
+                slice_2d:       <numpy.ndarray>
+                                2d binary image.
+
+    Returns:
+                bit_slice:      <lib.bitvol_lib.Bit_slice>
+                                Packed 2d slice.
+    '''
+    slice_2d = np.asarray(slice_2d) != 0
+
+    return Bit_slice(np.packbits(slice_2d, axis=1), slice_2d.shape[1])
+
+def popcount(bits):
+    '''
+    Returns the number of bits set in an array of bytes.
+
+    Parameters:
+                bits:           <numpy.ndarray>
+                                Array of uint8.
+
+    Returns:
+                count:          <int>
+                                Number of bits set.
+    '''
+    histogram = np.bincount(np.ravel(bits), minlength=256)
+
+    return int(np.dot(histogram, popcount_table))
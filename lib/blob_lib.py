@@ -1,32 +1,96 @@
-from inspect import stack                   # To write log
 import numpy as np
 import locate_blobs as loc          # Locate blobs functions
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class Blob(object):
+    log_class_heading = log_file_heading+"Class: Blob"
     blob_num = None
     blob_ctrd = None
-    blob_mask = None
-    inner_mask = None
+    blob_bbox = None
+    blob_crop = None
+    inner_crop = None
+    slc_shape = None
     slice_number = None
-    props = None    
+    blob_3d_id = None
+    props = None
     matter_kind = ''
 
-    def __init__(self, log, mask_arr, slc_numb, properties, mat_kind):
+    def __init__(self, log, slc_shape, slc_numb, properties, mat_kind, \
+            locator=None):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
+        # The blob is stored as the mask of its bounding box plus the box
+        # corners. Full-frame masks are only built when they are requested.
         self.blob_num = properties.label
-        self.blob_mask = mask_arr
+        self.blob_bbox = properties.bbox
+        self.blob_crop = properties.image
+        self.slc_shape = slc_shape
         self.slice_number = slc_numb
         self.matter_kind = mat_kind
         self.props = properties
-        self.loc = loc.Locate_blobs(self.log)
+        # Blobs share the locator of their structure when given
+        if locator is None:
+            locator = loc.Locate_blobs(self.log)
+        self.loc = locator
+
+    @property
+    def blob_mask(self):
+        '''
+        Full-frame mask of the blob, built on demand from its bounding box mask.
+
+        Returns:
+                    blob_mask:      <numpy.ndarray>
+                                    Image of the blob with the shape of the
+                                    slices.
+        '''
+        return self.to_frame(self.blob_crop).astype(np.int)
+
+    @property
+    def inner_mask(self):
+        '''
+        Full-frame mask of the inner region of the blob, built on demand from
+        its bounding box mask. It is None until 'find_inner_region' is called.
+
+        Returns:
+                    inner_mask:     <numpy.ndarray>
+                                    Inner region with the shape of the slices.
+        '''
+        if self.inner_crop is None:
+            return None
+
+        return self.to_frame(self.inner_crop).astype(np.float64)
+
+    def to_frame(self, crop, shape=None, bbox=None):
+        '''
+        Returns the image 'crop', given in bounding box coordinates, pasted in
+        an empty image with the shape of the slices.
+        By default takes self object attributes.
+
+        Parameters:
+                    crop:           <numpy.ndarray>
+                                    Image with the shape of the blob bbox.
+                    shape:          <tuple>
+                                    Output image dimensions.
+                    bbox:           <tuple>
+                                    Blob bounding box (min_row, min_col,
+                                    max_row, max_col).
+
+        Returns:
+                    frame:          <numpy.ndarray>
+                                    Boolean image with the shape of the slices.
+        '''
+        if shape is None:
+            shape = self.slc_shape
+        if bbox is None:
+            bbox = self.blob_bbox
+
+        frame = np.zeros(shape, dtype=np.bool_)
+        frame[bbox[0]:bbox[2], bbox[1]:bbox[3]] = crop
+
+        return frame
 
     def find_blob_centroid(self, blob_props=None):
         '''
@@ -35,41 +99,36 @@ class Blob(object):
         By default takes self object attributes.
 
         Parameters:
-                    blob_props:     <skimage.measure._regionprops._RegionProperties>
+                    blob_props:     <lib.locate_blobs.Blob_record>
                                     Blob properties, such as area, centroid, ...
 
         Updates object atributes:
                     blob_ctrd:      <numpy.ndarray>
-                                    Coords of the centroid as integers 
+                                    Coords of the centroid as integers
         '''
         if blob_props is None:
             blob_props = self.props
 
         self.blob_ctrd = np.round(blob_props.centroid)
 
-    def find_inner_region(self, b_mask=None, b_props=None):
+    def find_inner_region(self, b_props=None):
         '''
-        Stores as an attribute the result of creating a mask of the inner 
-        region of the blob.
+        Stores as an attribute the mask of the inner region of the blob, with
+        the shape of the blob bounding box.
         By default takes self object attributes.
 
         Parameters:
-                    b_mask:          <numpy.ndarray>
-                                    Image of the blob with the shape of the
-                                    slices.
-                    b_props:        <skimage.measure._regionprops._RegionProperties>
+                    b_props:        <lib.locate_blobs.Blob_record>
                                     Properties of the blob.
 
         Updates object atributes:
-                    inner_mask:     <numpy.ndarray>
-                                    Inner region with the shape of given mask. 
+                    inner_crop:     <numpy.ndarray>
+                                    Inner region with the shape of the blob
+                                    bounding box.
         '''
-        if b_mask is None:
-            b_mask = self.blob_mask
         if b_props is None:
             b_props = self.props
 
-        inner_region = self.loc.blob_inner_region(b_props)
-        self.inner_mask = self.loc.relocate_blob(b_mask.shape, inner_region, b_props)
+        self.inner_crop = self.loc.blob_inner_region(b_props) > 0
 
 
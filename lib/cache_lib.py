@@ -0,0 +1,224 @@
+import numpy as np
+import hashlib
+import shutil
+import os
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+class Stage_cache(object):
+    '''
+    On-disk cache of the results of the pipeline stages. Each entry is a
+    directory named after a key and holds one '.npy' file per array, so
+    arrays are memory-mapped when loaded. Keys are computed from the content
+    of the input files and the parameters of the stage, so an entry is reused
+    while neither of them changes. When the cache grows over 'max_bytes', the
+    least recently used entries are removed.
+    '''
+    log_class_heading = log_file_heading+"Class: Stage_cache"
+    cache_dir = ''
+    max_bytes = 0
+    file_keys = {}
+
+    def __init__(self, log, cache_dir, max_bytes=2*1024**3):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Hashes of the files already read, by (path, size, mtime)
+        self.file_keys = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def file_key(self, paths):
+        '''
+        Returns the hash of the content of the files pointed by 'paths'.
+
+        Parameters:
+                    paths:          <list>
+                                    Paths to the input files.
+
+        Returns:
+                    key:            <str>
+                                    Hexadecimal sha1 digest.
+        '''
+        digest = hashlib.sha1()
+        for path in paths:
+            status = os.stat(path)
+            file_id = (path, status.st_size, status.st_mtime)
+            if file_id not in self.file_keys:
+                file_digest = hashlib.sha1()
+                with open(path, 'rb') as f:
+                    block = f.read(1024**2)
+                    while block:
+                        file_digest.update(block)
+                        block = f.read(1024**2)
+                self.file_keys[file_id] = file_digest.hexdigest()
+            digest.update(self.file_keys[file_id].encode('ascii'))
+
+        return digest.hexdigest()
+
+    def stage_key(self, stage, input_key, params=None):
+        '''
+        Returns the key of the result of 'stage' run over the input identified
+        by 'input_key' with the parameters 'params'.
+
+        Parameters:
+                    stage:          <str>
+                                    Name of the stage.
+                    input_key:      <str>
+                                    Key of the input of the stage, either a
+                                    'file_key' or the key of a previous stage.
+                    params:         <dict>
+                                    Parameters of the stage.
+
+        Returns:
+                    key:            <str>
+                                    Hexadecimal sha1 digest.
+        '''
+        if params is None:
+            params = {}
+
+        description = stage+':'+input_key+':'+repr(sorted(params.items()))
+
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        '''
+        Returns the arrays stored under 'key', memory-mapped, or None if there
+        is no such entry. The entry is marked as recently used.
+
+        Parameters:
+                    key:            <str>
+                                    Key of the entry.
+
+        Returns:
+                    arrays:         <dict>
+                                    Arrays of the entry by name.
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return None
+
+        arrays = {}
+        for f_name in os.listdir(entry_dir):
+            if f_name.endswith('.npy'):
+                arrays[f_name[:-4]] = np.load(os.path.join(entry_dir, f_name),\
+                    mmap_mode='r')
+        os.utime(entry_dir, None)
+        self.log.write_ctx("log", self.log_class_heading, "load", \
+            "Cache hit: "+key)
+
+        return arrays
+
+    def store(self, key, arrays):
+        '''
+        Stores 'arrays' under 'key' and evicts the least recently used entries
+        if the cache exceeds its size. The entry is written aside and renamed,
+        so an interrupted run never leaves a partial entry.
+
+        Parameters:
+                    key:            <str>
+                                    Key of the entry.
+                    arrays:         <dict>
+                                    Arrays to store by name.
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = entry_dir+'.tmp'+str(os.getpid())
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name+'.npy'), np.asarray(array))
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.rename(tmp_dir, entry_dir)
+        self.log.write_ctx("log", self.log_class_heading, "store", \
+            "Cache store: "+key)
+
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        '''
+        Removes the least recently used entries until the cache size is under
+        'max_bytes'.
+        By default takes self object attributes.
+
+        Parameters:
+                    max_bytes:      <int>
+                                    Maximum size of the cache in bytes.
+        '''
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(entry_dir) or '.tmp' in name:
+                continue
+            size = sum([os.path.getsize(os.path.join(entry_dir, f_name)) for \
+                f_name in os.listdir(entry_dir)])
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            total += size
+
+        for mtime, size, entry_dir in sorted(entries):
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry_dir)
+            total -= size
+
+def pack_blob_tables(table, mask_store, rows_per_slice):
+    '''
+    Returns the feature table of the blobs of several slices as arrays to be
+    stored in a 'Stage_cache'.
+
+    Parameters:
+                table:          <numpy.ndarray>
+                                Feature table of the blobs of all the slices,
+                                ordered by slice, as given by 
+                                'Matter.feature_table'.
+                mask_store:     <numpy.ndarray>
+                                Masks of the blobs of the table.
+                rows_per_slice: <list>
+                                Number of rows of each slice.
+
+    Returns:
+                arrays:         <dict>
+                                Arrays 'blob_table', 'blob_masks' and 
+                                'table_offsets', the first row of each slice.
+    '''
+    arrays = {}
+    arrays['blob_table'] = table
+    arrays['blob_masks'] = mask_store
+    arrays['table_offsets'] = np.cumsum([0]+list(rows_per_slice))\
+        .astype(np.int64)
+
+    return arrays
+
+def unpack_blob_tables(arrays, n_slices):
+    '''
+    Returns the feature table and the mask store of each slice from the 
+    arrays built by 'pack_blob_tables'. Tables are copied, as their hole areas
+    are set later, and their masks stay in the store of all the slices.
+
+    Parameters:
+                arrays:         <dict>
+                                Arrays as returned by 'pack_blob_tables'.
+                n_slices:       <int>
+                                Number of slices.
+
+    Returns:
+                tables:         <list>
+                                Pair (table, mask_store) of each slice, as 
+                                given by 'Locate_blobs.feature_table'.
+    '''
+    offsets = arrays['table_offsets']
+    mask_store = arrays['blob_masks']
+    tables = []
+    for i in range(n_slices):
+        table = np.array(arrays['blob_table'][offsets[i]:offsets[i+1]])
+        tables.append((table, mask_store))
+
+    return tables
@@ -0,0 +1,220 @@
+from skimage import measure as msr
+import numpy as np
+import locate_blobs as loc          # Shared image and table functions
+import morph_lib as mrp             # Binary morphology by line segments
+import bitvol_lib as bvl            # Bit-packed binary images
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+class Slice_context(object):
+    '''
+    Intermediate images and tables of a pair of white and gray matter slices,
+    shared by the finding of image objects of types 1, 2 and 3. Each one is
+    computed the first time it is requested and kept until 'release' is
+    called, so stages that need the same mixed mask, labelling or overlaps
+    do not compute them again.
+    '''
+    log_class_heading = log_file_heading+"Class: Slice_context"
+    wm_slice = None
+    gm_slice = None
+    values = {}
+
+    def __init__(self, log, wm_slice, gm_slice, loc_obj):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.wm_slice = wm_slice
+        self.gm_slice = gm_slice
+        self.loc = loc_obj
+        self.values = {}
+
+    def memo(self, key, compute):
+        '''
+        Returns the value stored as 'key', computing it with 'compute' the
+        first time.
+
+        Parameters:
+                    key:            <object>
+                                    Hashable name of the value.
+                    compute:        <function>
+                                    Function without arguments that returns
+                                    the value.
+
+        Returns:
+                    value:          <object>
+        '''
+        if key in self.values:
+            self.loc.timer.count('context_hits')
+        else:
+            self.values[key] = compute()
+
+        return self.values[key]
+
+    def release(self):
+        '''
+        Frees every value computed.
+        '''
+        self.values = {}
+
+    @property
+    def image_wm(self):
+        '''
+        2d image of the white matter slice. It is not stored in the context: 
+        packed slices keep their image unpacked until 
+        'Slice.release_unpacked'.
+        '''
+        return self.wm_slice.slc_arr
+
+    @property
+    def image_gm(self):
+        '''
+        2d image of the gray matter slice. It is not stored in the context.
+        '''
+        return self.gm_slice.slc_arr
+
+    @property
+    def wm_lbl(self):
+        '''
+        Labelled slice of white matter, rebuilt from its blobs if the slice
+        does not keep it.
+        '''
+        return self.memo('wm_lbl', lambda: labelled_slice(self.wm_slice, \
+            self.image_wm.shape))
+
+    @property
+    def gm_lbl(self):
+        '''
+        Labelled slice of gray matter, rebuilt from its blobs if the slice
+        does not keep it.
+        '''
+        return self.memo('gm_lbl', lambda: labelled_slice(self.gm_slice, \
+            self.image_gm.shape))
+
+    @property
+    def gm_table(self):
+        '''
+        Feature table of the gray matter blobs, built from them if the slice
+        does not keep it.
+        '''
+        def compute():
+            if self.gm_slice.blob_features is not None:
+                return self.gm_slice.blob_features
+            return self.loc.blobs_features(self.gm_slice.blobs_obj_list)[0]
+
+        return self.memo('gm_table', compute)
+
+    @property
+    def image_mix(self):
+        '''
+        Mask mixing the white and gray matter slices.
+        '''
+        def compute():
+            image_mix = np.copy(self.image_gm)
+            image_mix[self.image_wm > 0] = 1
+            return image_mix
+
+        return self.memo('image_mix', compute)
+
+    @property
+    def mix_labels(self):
+        '''
+        Labelled blobs of 'image_mix'.
+        '''
+        return self.memo('mix_labels', lambda: msr.label(self.image_mix))
+
+    @property
+    def main_label(self):
+        '''
+        Label of the biggest blob of 'image_mix', the first one if several
+        have the same area. None if the mask is empty.
+        '''
+        return self.memo('main_label', lambda: loc.main_blob_label(\
+            self.mix_labels))
+
+    @property
+    def main_mask(self):
+        '''
+        Mask of the main blob of 'image_mix'.
+        '''
+        return self.memo('main_mask', lambda: self.mix_labels == \
+            self.main_label)
+
+    @property
+    def main_bits(self):
+        '''
+        Mask of the main blob of 'image_mix' packed as a 'Bit_slice', to
+        count overlaps with it by popcount.
+        '''
+        return self.memo('main_bits', lambda: bvl.pack_slice(self.main_mask))
+
+    def main_window(self, margin):
+        '''
+        Returns the window of the main blob of the slices enlarged by
+        'margin' pixels. See 'lib.locate_blobs.main_blob_window'.
+        '''
+        return self.memo(('main_window', margin), lambda: \
+            loc.main_blob_window(self.image_wm, self.image_gm, margin))
+
+    def wm_dilated(self, window=None):
+        '''
+        Returns the white matter slice, or its part inside 'window', dilated
+        with a 5x5 square as in 'Locate_blobs.find_candidate_regions_type3'.
+        '''
+        def compute():
+            image_wm = self.image_wm
+            if window is not None:
+                image_wm = image_wm[window]
+            return mrp.binary_dilation(image_wm, np.ones((5,5)))
+
+        return self.memo(('wm_dilated', window_key(window)), compute)
+
+    def inner_overlaps(self, matter, rows):
+        '''
+        Returns the rows 'rows' of 'lib.locate_blobs.overlap_matrix' of the
+        inner regions of the gray matter blobs against the labelled slice of
+        'matter'. Only the rows not requested before are computed.
+
+        Parameters:
+                    matter:         <str>
+                                    'wm' or 'gm'.
+                    rows:           <numpy.ndarray>
+                                    Indices of the gray matter blobs.
+
+        Returns:
+                    overlap:        <numpy.ndarray>
+                                    Matrix of shape (len(rows), max label + 1).
+        '''
+        lbl = self.wm_lbl if matter == 'wm' else self.gm_lbl
+        known = self.memo(('inner_overlaps', matter), dict)
+        blobs = self.gm_slice.blobs_obj_list
+        missing = [i for i in rows if i not in known]
+        if len(missing) > 0:
+            matrix = loc.overlap_matrix([blobs[i] for i in missing], lbl)
+            for i, row in zip(missing, matrix):
+                known[i] = row
+
+        if len(rows) == 0:
+            return np.zeros((0, int(np.max(lbl)) + 1 if lbl.size > 0 else 1), \
+                dtype=np.intp)
+
+        return np.array([known[i] for i in rows])
+
+def labelled_slice(slice_obj, shape):
+    '''
+    Returns the labelled image of 'slice_obj', or the one rebuilt from its
+    blobs if it is not kept.
+    '''
+    if slice_obj.slc_lbl is not None:
+        return slice_obj.slc_lbl
+
+    return loc.blobs_label_image(slice_obj.blobs_obj_list, shape)
+
+def window_key(window):
+    '''
+    Returns a hashable key of a window of slices, or None.
+    '''
+    if window is None:
+        return None
+
+    return tuple([(item.start, item.stop) for item in window])
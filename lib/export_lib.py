@@ -0,0 +1,306 @@
+import numpy as np
+import struct
+import zlib
+import os
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# Control points of matplotlib's 'nipy_spectral' colormap, at 0, 0.05, ..., 1.
+nipy_spectral_points = {
+    'red': [0.0, 0.4667, 0.5333, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, \
+        0.0, 0.7333, 0.9333, 1.0, 1.0, 1.0, 0.8667, 0.8, 0.8],
+    'green': [0.0, 0.0, 0.0, 0.0, 0.0, 0.4667, 0.6, 0.6667, 0.6667, 0.6, \
+        0.7333, 0.8667, 1.0, 1.0, 0.9333, 0.8, 0.6, 0.0, 0.0, 0.0, 0.8],
+    'blue': [0.0, 0.5333, 0.6, 0.6667, 0.8667, 0.8667, 0.8667, 0.6667, 0.5333, \
+        0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.8],
+    }
+
+# 3x5 bitmap glyphs of the characters used by the annotations. Other
+# characters are left blank.
+font_glyphs = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '001', '001', '001'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+    ':': ('000', '010', '000', '010', '000'),
+    '-': ('000', '000', '111', '000', '000'),
+    'e': ('111', '100', '111', '100', '111'),
+    'f': ('111', '100', '111', '100', '100'),
+    'g': ('111', '100', '101', '101', '111'),
+    'h': ('101', '101', '111', '101', '101'),
+    'i': ('111', '010', '010', '010', '111'),
+    'l': ('100', '100', '100', '100', '111'),
+    'r': ('110', '101', '110', '101', '101'),
+    't': ('111', '010', '010', '010', '010'),
+    }
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+class Overlay_exporter(object):
+    '''
+    Writes the labelled slices as PNG files without matplotlib. Labels are
+    coloured with a lookup table of the 'nipy_spectral' colormap and the
+    annotations are stamped with a bitmap font. It can be used as the renderer
+    of 'Locate_blobs.plot_labels'. With 'montage', the slices written to each
+    directory are also tiled into 'montage.png' and put in the animated
+    'strip.png' when the exporter is closed.
+    '''
+    log_class_heading = log_file_heading+"Class: Overlay_exporter"
+    lut = None
+    scale = 2
+    montage = False
+    frames = {}
+
+    def __init__(self, log, scale=2, montage=False):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.lut = colormap_lut(nipy_spectral_points)
+        self.scale = scale
+        self.montage = montage
+        # Coloured slices of each output directory, for the montages
+        self.frames = {}
+
+    def colorize(self, lbl_slice, vmin=None, vmax=None):
+        '''
+        Returns 'lbl_slice' coloured with the lookup table. Values are scaled
+        from [vmin, vmax] to the table, as 'imshow' does.
+
+        Parameters:
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image array to colour.
+                    vmin:           <float>
+                                    Value of the first colour. Image minimum if
+                                    not given.
+                    vmax:           <float>
+                                    Value of the last colour. Image maximum if
+                                    not given.
+
+        Returns:
+                    rgb:            <numpy.ndarray>
+                                    Array of uint8 with shape (rows, cols, 3).
+        '''
+        lbl_slice = np.asarray(lbl_slice, dtype=np.float64)
+        if vmin is None:
+            vmin = lbl_slice.min() if lbl_slice.size else 0
+        if vmax is None:
+            vmax = lbl_slice.max() if lbl_slice.size else 0
+
+        if vmax > vmin:
+            index = (lbl_slice - vmin) * (len(self.lut) / float(vmax - vmin))
+            index = np.clip(index, 0, len(self.lut) - 1).astype(np.intp)
+        else:
+            index = np.zeros(lbl_slice.shape, dtype=np.intp)
+
+        return self.lut[index]
+
+    def stamp(self, rgb, annotations, scale=None):
+        '''
+        Draws the texts of 'annotations' over 'rgb'. Texts start at their
+        position and grow rightwards and upwards, as the annotations of
+        matplotlib.
+        By default takes self object attributes.
+
+        Parameters:
+                    rgb:            <numpy.ndarray>
+                                    Image of uint8 with shape (rows, cols, 3).
+                                    Updated in place.
+                    annotations:    <list>
+                                    List of (text, (x, y), color), with (x, y)
+                                    in image coordinates and color as floats in
+                                    [0, 1].
+                    scale:          <int>
+                                    Size in pixels of each font dot.
+        '''
+        if scale is None:
+            scale = self.scale
+
+        rows, cols = rgb.shape[:2]
+        for text, (x, y), color in annotations:
+            color = np.round(np.asarray(color[:3]) * 255).astype(np.uint8)
+            top = int(round(y)) - 5 * scale
+            left = int(round(x))
+            for char in str(text):
+                glyph = font_glyphs.get(char)
+                if glyph is not None:
+                    dots = np.array([[bit == '1' for bit in row] for row in \
+                        glyph])
+                    dots = np.kron(dots, np.ones((scale, scale), \
+                        dtype=np.bool_)).astype(np.bool_)
+                    # Clip the glyph to the image
+                    r0, c0 = max(top, 0), max(left, 0)
+                    r1 = min(top + dots.shape[0], rows)
+                    c1 = min(left + dots.shape[1], cols)
+                    if r1 > r0 and c1 > c0:
+                        rgb[r0:r1, c0:c1][dots[r0-top:r1-top, c0-left:c1-left]]\
+                            = color
+                left += 4 * scale
+
+    def submit(self, out_f_path, lbl_slice, annotations):
+        '''
+        Writes 'lbl_slice' coloured and annotated to the PNG file
+        'out_f_path'. Same interface as 'Render_pool.submit'.
+
+        Parameters:
+                    out_f_path:     <str>
+                                    Output path of the image.
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image array to export.
+                    annotations:    <list>
+                                    List of (text, (x, y), color) as given by
+                                    'Locate_blobs.label_annotations'.
+        '''
+        rgb = self.colorize(lbl_slice)
+        self.stamp(rgb, annotations)
+        write_png(out_f_path, rgb)
+        if self.montage:
+            out_dir = os.path.dirname(out_f_path)
+            self.frames.setdefault(out_dir, []).append(rgb)
+
+    def wait(self):
+        pass
+
+    def close(self):
+        '''
+        Writes the montage sheet and the animated strip of each directory the
+        slices were written to.
+        '''
+        for out_dir, frames in self.frames.items():
+            write_png(os.path.join(out_dir, 'montage.png'), \
+                montage_sheet(frames))
+            write_apng(os.path.join(out_dir, 'strip.png'), frames)
+        self.frames = {}
+
+def colormap_lut(points, n_colors=256):
+    '''
+    Returns the lookup table of a colormap given by control points evenly
+    spaced in [0, 1].
+
+    Parameters:
+                points:         <dict>
+                                Values of 'red', 'green' and 'blue' at the
+                                control points.
+                n_colors:       <int>
+                                Number of colours of the table.
+
+    Returns:
+                lut:            <numpy.ndarray>
+                                Array of uint8 with shape (n_colors, 3).
+    '''
+    x = np.linspace(0, 1, n_colors)
+    lut = np.zeros((n_colors, 3), dtype=np.uint8)
+    for channel, name in enumerate(['red', 'green', 'blue']):
+        values = points[name]
+        xp = np.linspace(0, 1, len(values))
+        lut[:, channel] = np.round(np.interp(x, xp, values) * 255)
+
+    return lut
+
+def montage_sheet(frames, columns=None):
+    '''
+    Returns the frames tiled in a grid, row by row.
+
+    Parameters:
+                frames:         <list>
+                                Images of uint8 with shape (rows, cols, 3), all
+                                of the same shape.
+                columns:        <int>
+                                Number of frames per row. Square grid if not
+                                given.
+
+    Returns:
+                sheet:          <numpy.ndarray>
+                                Image of uint8 with all the frames.
+    '''
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(len(frames))))
+    grid_rows = int(np.ceil(len(frames) / float(columns)))
+    rows, cols = frames[0].shape[:2]
+    sheet = np.zeros((grid_rows * rows, columns * cols, 3), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        r, c = divmod(i, columns)
+        sheet[r*rows:(r+1)*rows, c*cols:(c+1)*cols] = frame
+
+    return sheet
+
+def png_chunk(kind, data):
+    '''
+    Returns a PNG chunk of type 'kind' with its length and CRC.
+    '''
+    crc = zlib.crc32(kind + data) & 0xffffffff
+
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', crc)
+
+def png_image_data(rgb, level=6):
+    '''
+    Returns the compressed scanlines of 'rgb', without filtering.
+    '''
+    rows, cols = rgb.shape[:2]
+    scanlines = np.zeros((rows, 1 + cols * 3), dtype=np.uint8)
+    scanlines[:, 1:] = np.ascontiguousarray(rgb).reshape(rows, cols * 3)
+
+    return zlib.compress(scanlines.tobytes(), level)
+
+def png_header(rgb):
+    '''
+    Returns the IHDR chunk of an 8-bit RGB image with the shape of 'rgb'.
+    '''
+    rows, cols = rgb.shape[:2]
+
+    return png_chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, 2, 0, 0,\
+        0))
+
+def write_png(out_f_path, rgb):
+    '''
+    Writes an RGB image to a PNG file.
+
+    Parameters:
+                out_f_path:     <str>
+                                Output path of the image.
+                rgb:            <numpy.ndarray>
+                                Image of uint8 with shape (rows, cols, 3).
+    '''
+    with open(out_f_path, 'wb') as f:
+        f.write(png_signature)
+        f.write(png_header(rgb))
+        f.write(png_chunk(b'IDAT', png_image_data(rgb)))
+        f.write(png_chunk(b'IEND', b''))
+
+def write_apng(out_f_path, frames, delay_ms=100):
+    '''
+    Writes the frames as an animated PNG that loops forever. Viewers without
+    animation support show the first frame.
+
+    Parameters:
+                out_f_path:     <str>
+                                Output path of the image.
+                frames:         <list>
+                                Images of uint8 with shape (rows, cols, 3), all
+                                of the same shape.
+                delay_ms:       <int>
+                                Time each frame is shown, in milliseconds.
+    '''
+    rows, cols = frames[0].shape[:2]
+    sequence = 0
+    with open(out_f_path, 'wb') as f:
+        f.write(png_signature)
+        f.write(png_header(frames[0]))
+        f.write(png_chunk(b'acTL', struct.pack('>II', len(frames), 0)))
+        for i, frame in enumerate(frames):
+            f.write(png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence, \
+                cols, rows, 0, 0, delay_ms, 1000, 0, 0)))
+            sequence += 1
+            data = png_image_data(frame)
+            if i == 0:
+                f.write(png_chunk(b'IDAT', data))
+            else:
+                f.write(png_chunk(b'fdAT', struct.pack('>I', sequence) + data))
+                sequence += 1
+        f.write(png_chunk(b'IEND', b''))
@@ -1,11 +1,11 @@
-from inspect import stack                   # To write log
-import locate_blobs as loc                  # Locate blobs functions
+import blob_lib as blb
 import numpy as np
 from matplotlib import pyplot as plt
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class ImageObject1(object):
+    log_class_heading = log_file_heading+"Class: ImageObject1"
     blob = None
     imobj_lbl = None
     obj_type = 0
@@ -14,11 +14,8 @@ class ImageObject1(object):
     
     def __init__(self, log, blob1, num):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
         self.obj_type = 1
         self.blob = blob1
@@ -27,6 +24,7 @@ class ImageObject1(object):
         self.imobj_lbl = self.blob.blob_mask
 
 class ImageObject2(object):
+    log_class_heading = log_file_heading+"Class: ImageObject2"
     blob_gm = None
     blob_wm = None
     imobj_lbl = None
@@ -36,23 +34,21 @@ class ImageObject2(object):
 
     def __init__(self, log, blob2, num):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
         self.obj_type = 2
         self.blob_wm = blob2[0]
         self.blob_gm = blob2[1]
         self.imslice_number = self.blob_wm.slice_number
         self.imobj_number = num
-        blobs2_lbl = np.zeros(blob2[0].blob_mask.shape)
-        blobs2_lbl[blob2[0].blob_mask > 0] = 2 # num*2+1  # Starts at 0
-        blobs2_lbl[blob2[1].blob_mask > 0] = 3 # num*2+2
+        blobs2_lbl = np.zeros(blob2[0].slc_shape)
+        blobs2_lbl[blob2[0].to_frame(blob2[0].blob_crop)] = 2 # num*2+1  # Starts at 0
+        blobs2_lbl[blob2[1].to_frame(blob2[1].blob_crop)] = 3 # num*2+2
         self.imobj_lbl = blobs2_lbl
 
 class ImageObject3(object):
+    log_class_heading = log_file_heading+"Class: ImageObject3"
     blobs_gm = None
     blobs_wm = None
     imobj_lbl = None
@@ -62,11 +58,8 @@ class ImageObject3(object):
 
     def __init__(self, log, blobs3, position):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
         self.obj_type = 3
         self.blobs_wm = blobs3[0]
@@ -74,18 +67,21 @@ class ImageObject3(object):
         self.imslice_number = self.blobs_gm[0].slice_number
         self.imobj_position = position
 
-        blobs3_lbl = np.zeros(self.blobs_gm[0].blob_mask.shape)
+        blobs3_lbl = np.zeros(self.blobs_gm[0].slc_shape)
 
         for blob in self.blobs_wm:
-            blobs3_lbl[blob.blob_mask > 0] = 2 # num*2+1  # Starts at 0
+            bbox = blob.blob_bbox
+            blobs3_lbl[bbox[0]:bbox[2], bbox[1]:bbox[3]][blob.blob_crop] = 2 # num*2+1  # Starts at 0
 
         for blob in self.blobs_gm:
-            blobs3_lbl[blob.blob_mask > 0] = 3 # num*2+2
+            bbox = blob.blob_bbox
+            blobs3_lbl[bbox[0]:bbox[2], bbox[1]:bbox[3]][blob.blob_crop] = 3 # num*2+2
 
         self.imobj_lbl = blobs3_lbl
 
 
 class ImageObjectSlice(object):
+    log_class_heading = log_file_heading+"Class: ImageObjectSlice"
     wm_slice_obj = None
     gm_slice_obj = None
     csf_slice_obj = None
@@ -98,23 +94,82 @@ class ImageObjectSlice(object):
     type1_imobjs_list = []
     type2_imobjs_list = []
     type3_imobjs_list = []
+    type3_regions = None
+    context = None
     imslice_num = 0
     
     def __init__(self, log, wm_slice, gm_slice, csf_slice, i3t_slice, stct):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
         self.wm_slice_obj = wm_slice
         self.gm_slice_obj = gm_slice
         self.csf_slice_obj = csf_slice
         self.i3t_slice_obj = i3t_slice
         self.imslice_num = wm_slice.slc_number
-        self.loc = loc.Locate_blobs(self.log)
+        self.loc = stct.loc
         self.stct = stct
 
+    def slice_context(self, wm_slice=None, gm_slice=None):
+        '''
+        Returns the 'Slice_context' of the slices of this image object slice,
+        created the first time it is requested, or None if other slices are 
+        given. It is shared by the findings of image objects of types 1, 2 and
+        3, and released by 'find_imobjs_type3' with 'release_context'. Drivers
+        find the three types slice by slice, so a single context is kept at a
+        time.
+
+        Parameters:
+                    wm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'wm'.
+                    gm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'gm'.
+
+        Returns:
+                    context:        <lib.context_lib.Slice_context>
+
+        Updates object atributes:
+                    context
+        '''
+        if wm_slice is not None and wm_slice is not self.wm_slice_obj:
+            return None
+        if gm_slice is not None and gm_slice is not self.gm_slice_obj:
+            return None
+        if self.context is None:
+            self.context = self.stct.create_slice_context(self.wm_slice_obj, \
+                self.gm_slice_obj)
+
+        return self.context
+
+    def release_context(self, wm_slice=None, gm_slice=None):
+        '''
+        Releases the context of this image object slice, unless other slices
+        are given, and drops the images unpacked from the packed slices. To be
+        called when no more image objects are going to be found in the slices
+        soon, as 'find_imobjs_type3' does.
+        By default takes self object attributes.
+
+        Parameters:
+                    wm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'wm'.
+                    gm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'gm'.
+
+        Updates object atributes:
+                    context:        Released and set to None.
+        '''
+        if wm_slice is None:
+            wm_slice = self.wm_slice_obj
+        if gm_slice is None:
+            gm_slice = self.gm_slice_obj
+
+        if self.context is not None and wm_slice is self.wm_slice_obj and \
+                gm_slice is self.gm_slice_obj:
+            self.context.release()
+            self.context = None
+        wm_slice.release_unpacked()
+        gm_slice.release_unpacked()
+
     def find_imobjs_type1(self, wm_slice=None, gm_slice=None):
         '''
         Stores as an attribute a list with the candidate blobs of type 1.
@@ -138,8 +193,10 @@ class ImageObjectSlice(object):
         if gm_slice is None:
             gm_slice = self.gm_slice_obj
 
-        blobs1 = self.loc.characterize_blobs_type1(wm_slice.blobs_obj_list,\
-                gm_slice.blobs_obj_list)
+        with self.stct.timer.stage('type1', self.imslice_num):
+            blobs1 = self.loc.characterize_blobs_type1(wm_slice.blobs_obj_list,\
+                gm_slice.blobs_obj_list, wm_slice.slc_lbl, gm_slice.slc_lbl, \
+                gm_slice.blob_features, self.slice_context(wm_slice, gm_slice))
         self.type1_blobs = blobs1
 
     def find_imobjs_type2(self, wm_slice=None, gm_slice=None):
@@ -165,8 +222,10 @@ class ImageObjectSlice(object):
         if gm_slice is None:
             gm_slice = self.gm_slice_obj
 
-        blobs2 = self.loc.characterize_blobs_type2(wm_slice.blobs_obj_list,\
-                gm_slice.blobs_obj_list)
+        with self.stct.timer.stage('type2', self.imslice_num):
+            blobs2 = self.loc.characterize_blobs_type2(wm_slice.blobs_obj_list,\
+                gm_slice.blobs_obj_list, wm_slice.slc_lbl, gm_slice.slc_lbl, \
+                gm_slice.blob_features, self.slice_context(wm_slice, gm_slice))
         if len(blobs2) > 0:
             self.type2_blobs_wm = blobs2[0]
             self.type2_blobs_gm = blobs2[1]
@@ -197,42 +256,70 @@ class ImageObjectSlice(object):
                     type3_blobs_gm:  <list>
                                     List of objects of class 'Blob' of gray 
                                     matter.
+                    context:         <lib.context_lib.Slice_context>
+                                    Released and set to None. Images unpacked
+                                    from packed slices are also dropped.
         '''
         if wm_slice is None:
             wm_slice = self.wm_slice_obj
         if gm_slice is None:
             gm_slice = self.gm_slice_obj
 
-        # If there is no blob of GM in this slice, there is no 
-        # imobject type 3, and 'type3_blobs_gm' and 'type3_blobs_wm' return a 
-        # empty list.
-        new_wm_lbls = []
-        new_gm_lbls = []
-        if len(gm_slice.blobs_obj_list) > 0:
-            # Estimate regions and extract the labelled images
-            new_wm_lbls, new_gm_lbls = \
-                self.loc.find_candidate_regions_type3(wm_slice, gm_slice)
-
-        region_wm_blobs = []
-        if len(new_wm_lbls) > 0:
-            # Create 'Blob' objects with the new blobs stored in the labelled images
-            region_wm_blobs = self.stct.create_blob_objs(new_wm_lbls, \
-                self.imslice_num, wm_slice.matter_kind)
-            for blob in region_wm_blobs:
-                blob.find_blob_centroid()
-
-        region_gm_blobs = []
-        if len(new_gm_lbls) > 0:
-            region_gm_blobs = self.stct.create_blob_objs(new_gm_lbls, \
-                self.imslice_num, gm_slice.matter_kind)
-            for blob in region_gm_blobs:
-                blob.find_blob_centroid()
-        
-        # Evaluate which blobs are of type 3.
-        blobs3 = []
-        if len(region_gm_blobs) > 0:
-            blobs3 = self.loc.characterize_blobs_type3(region_wm_blobs, \
-                region_gm_blobs, wm_slice, gm_slice)
+        context = self.slice_context(wm_slice, gm_slice)
+        with self.stct.timer.stage('type3', self.imslice_num):
+            # If there is no blob of GM in this slice, there is no
+            # imobject type 3, and 'type3_blobs_gm' and 'type3_blobs_wm' return a
+            # empty list.
+            new_wm_lbls = []
+            new_gm_lbls = []
+            if len(gm_slice.blobs_obj_list) > 0:
+                # Estimate regions and extract the labelled images, unless 
+                # they were found with the slices of other image object slices
+                if self.type3_regions is not None and wm_slice is \
+                        self.wm_slice_obj and gm_slice is self.gm_slice_obj:
+                    new_wm_lbls, new_gm_lbls = self.type3_regions
+                else:
+                    new_wm_lbls, new_gm_lbls = \
+                        self.loc.find_candidate_regions_type3(wm_slice, \
+                        gm_slice, context)
+            self.type3_regions = None
+
+            region_wm_blobs = []
+            wm_table = None
+            if len(new_wm_lbls) > 0:
+                # Create 'Blob' objects with the new blobs stored in the
+                # labelled images, from their feature table
+                wm_table, wm_masks = self.loc.feature_table(new_wm_lbls, \
+                    self.imslice_num, wm_slice.matter_kind)
+                region_wm_blobs = self.stct.create_blob_objs(new_wm_lbls, \
+                    self.imslice_num, wm_slice.matter_kind, \
+                    self.loc.table_records(wm_table, wm_masks))
+                for blob in region_wm_blobs:
+                    blob.find_blob_centroid()
+
+            region_gm_blobs = []
+            gm_table = None
+            if len(new_gm_lbls) > 0:
+                gm_table, gm_masks = self.loc.feature_table(new_gm_lbls, \
+                    self.imslice_num, gm_slice.matter_kind)
+                region_gm_blobs = self.stct.create_blob_objs(new_gm_lbls, \
+                    self.imslice_num, gm_slice.matter_kind, \
+                    self.loc.table_records(gm_table, gm_masks))
+                for blob in region_gm_blobs:
+                    blob.find_blob_centroid()
+            self.stct.timer.count('type3_regions', len(region_wm_blobs) + \
+                len(region_gm_blobs))
+
+            # Evaluate which blobs are of type 3.
+            blobs3 = []
+            if len(region_gm_blobs) > 0:
+                blobs3 = self.loc.characterize_blobs_type3(region_wm_blobs, \
+                    region_gm_blobs, wm_slice, gm_slice, wm_table, gm_table, \
+                    context)
+
+        # Type 3 is the last finding that uses the context and the images of
+        # the slices
+        self.release_context(wm_slice, gm_slice)
 
         if len(blobs3) > 0:
             
@@ -246,6 +333,71 @@ class ImageObjectSlice(object):
             self.type3_blobs_wm = []
             self.type3_blobs_gm = []
 
+    def slice_record(self):
+        '''
+        Returns a compact record of the candidate blobs of types 1, 2 and 3 
+        found in this image object slice. Blobs of types 1 and 2 are referred
+        by their blob number in the matter slices. Blobs of type 3 are stored
+        as blob table records, as they come from the candidate regions.
+
+        Returns:
+                    record:         <dict>
+                                    Keys: 'imslice_num', 'type1' (GM blob 
+                                    numbers), 'type2' (pairs of WM and GM blob
+                                    numbers), 'type3_wm' and 'type3_gm' (lists
+                                    of 'Blob_record').
+        '''
+        record = {}
+        record['imslice_num'] = self.imslice_num
+        record['type1'] = [blob.blob_num for blob in self.type1_blobs]
+        record['type2'] = [(blob_wm.blob_num, blob_gm.blob_num) for blob_wm, \
+            blob_gm in zip(self.type2_blobs_wm, self.type2_blobs_gm)]
+        record['type3_wm'] = [blob.props for blob in self.type3_blobs_wm]
+        record['type3_gm'] = [blob.props for blob in self.type3_blobs_gm]
+
+        return record
+
+    def load_slice_record(self, record, wm_slice=None, gm_slice=None):
+        '''
+        Stores as attributes the candidate blobs of types 1, 2 and 3 described
+        by 'record', as if they were found by 'find_imobjs_type1', 
+        'find_imobjs_type2' and 'find_imobjs_type3'.
+        By default takes self object attributes.
+
+        Parameters:
+                    record:         <dict>
+                                    Record returned by 'slice_record'.
+                    wm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'wm'.
+                    gm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'gm'.
+
+        Updates object atributes:
+                    type1_blobs, type2_blobs_wm, type2_blobs_gm, type3_blobs_wm,
+                    type3_blobs_gm
+        '''
+        if wm_slice is None:
+            wm_slice = self.wm_slice_obj
+        if gm_slice is None:
+            gm_slice = self.gm_slice_obj
+
+        wm_blobs = dict((blob.blob_num, blob) for blob in wm_slice.blobs_obj_list)
+        gm_blobs = dict((blob.blob_num, blob) for blob in gm_slice.blobs_obj_list)
+        self.type1_blobs = [gm_blobs[num] for num in record['type1']]
+        self.type2_blobs_wm = [wm_blobs[num] for num, _ in record['type2']]
+        self.type2_blobs_gm = [gm_blobs[num] for _, num in record['type2']]
+
+        type3_blobs = ([], [])
+        for records, matter_slice, blobs in zip((record['type3_wm'], \
+                record['type3_gm']), (wm_slice, gm_slice), type3_blobs):
+            for blob_record in records:
+                blob = blb.Blob(self.log, matter_slice.slc_arr.shape, \
+                    self.imslice_num, blob_record, matter_slice.matter_kind, \
+                    self.loc)
+                blob.find_blob_centroid()
+                blobs.append(blob)
+        self.type3_blobs_wm, self.type3_blobs_gm = type3_blobs
+
     def make_imobj_objects_type1(self, blobs_type1=None):
         '''
         Stores as an attribute a list of the objects created of class 
@@ -399,6 +551,10 @@ class ImageObjectSlice(object):
         for imobj3 in t3_imobjs:
             blobs3.append((imobj3.blobs_wm, imobj3.blobs_gm, imobj3.imobj_position))
 
-        self.loc.plot_labels(o_path+f_ext, all_blobs_lbls, blobs1, blobs2, blobs3)
+        # With plots rendered in the background only queueing them is timed
+        # here, the rendering is timed by 'MRI_inspect.wait_plots'
+        with self.stct.timer.stage('plotting', self.imslice_num):
+            self.loc.plot_labels(o_path+f_ext, all_blobs_lbls, blobs1, blobs2, \
+                blobs3)
 
 
@@ -1,19 +1,21 @@
-from inspect import stack                   # To write log
 import SimpleITK as sitk
 import numpy as np
 import sys                                  # To manage input arguments
+import struct                               # To read file headers
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
+# Numpy types of the Analyze/NIfTI data type codes
+analyze_dtypes = {2: np.uint8, 4: np.int16, 8: np.int32, 16: np.float32, \
+    64: np.float64, 256: np.int8, 512: np.uint16, 768: np.uint32}
+
 class Input_process(object):
+    log_class_heading = log_file_heading+"Class: Input_process"
     
     def __init__(self, log):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
     def read_input(self, i_path, i_fname):
         '''
@@ -40,6 +42,88 @@ class Input_process(object):
 
         return image
 
+    def read_header(self, i_path, i_fname):
+        '''
+        Reads only the header of the Analyze 7.5 or NIfTI-1 file pointed by the
+        inputs. Returns the fields needed to map its voxels.
+
+        Parameters:
+                    i_path:     <str>
+                                Path to 3D files directory.
+                                i.e. /path/to/directory/
+
+                    i_fname:    <str>
+                                Name of 3D file, either the header of a pair
+                                '.hdr' + '.img' or a single '.nii' file.
+                                i.e. 'filename.extension'
+
+        Returns:
+                    header:     <dict>
+                                Keys: 'img_file' (path to the voxels file),
+                                'shape' (as numpy array, i.e. (z, y, x)),
+                                'dtype' (<numpy.dtype>), 'offset' (bytes
+                                before the first voxel) and 'spacing'.
+        '''
+        hdr_file = i_path+i_fname
+        with open(hdr_file, 'rb') as container:
+            raw = container.read(348)
+
+        # The header size field is 348 in the byte order of the file
+        if struct.unpack('<i', raw[:4])[0] == 348:
+            endian = '<'
+        elif struct.unpack('>i', raw[:4])[0] == 348:
+            endian = '>'
+        else:
+            raise ValueError('{} is not an Analyze/NIfTI header'.format(hdr_file))
+
+        dims = struct.unpack(endian+'8h', raw[40:56])
+        datatype = struct.unpack(endian+'h', raw[70:72])[0]
+        pixdims = struct.unpack(endian+'8f', raw[76:108])
+        vox_offset = struct.unpack(endian+'f', raw[108:112])[0]
+        if datatype not in analyze_dtypes:
+            raise ValueError('Unsupported data type {} in {}'.format(datatype, \
+                hdr_file))
+
+        if raw[344:347] == b'n+1':
+            img_file = hdr_file
+        else:
+            img_file = hdr_file[:hdr_file.rfind('.')]+'.img'
+            vox_offset = 0
+
+        header = {}
+        header['img_file'] = img_file
+        header['shape'] = tuple(dims[3:0:-1])
+        header['dtype'] = np.dtype(analyze_dtypes[datatype]).newbyteorder(endian)
+        header['offset'] = int(vox_offset)
+        header['spacing'] = tuple(pixdims[1:4])
+
+        return header
+
+    def map_input(self, header):
+        '''
+        Maps the voxels of the file described by 'header' as a numpy memmap, 
+        with the same orientation given by 'preprocess_serie'. No voxel is read
+        until it is accessed, so slices are paged in when a stage touches them.
+        Voxels keep their stored values, as no normalization is performed. 
+        Normalization is affine, so thresholding a percentage of the values 
+        range gives the same mask.
+
+        Parameters:
+                    header:     <dict>
+                                Header fields returned by 'read_header'.
+
+        Returns:
+                    turn:       <numpy.memmap>
+                                3-dimensional read-only view of the image. 
+        '''
+        npa = np.memmap(header['img_file'], dtype=header['dtype'], mode='r', \
+            offset=header['offset'], shape=header['shape'])
+        trans = np.transpose(npa, (0,2,1))
+        rot = trans[::-1,:,:]
+        turn = rot[:,:,::-1]
+
+        return turn
+
     def preprocess_serie(self, input_serie):
         '''
         Perform normalization over input 3-dimensional image with SimpleITK 
@@ -63,6 +147,97 @@ class Input_process(object):
 
         return turn
 
+    def preprocess_binarize_serie(self, input_serie, thres_percent, \
+            normalize=False, out=None, chunk=16):
+        '''
+        Fused version of 'preprocess_serie' and 'binarize_serie'. The voxels
+        are accessed as a view of the SimpleITK image, well-oriented as a view 
+        too. A single pass finds the range, mean and standard deviation of the
+        values, and a second one writes either the normalized image, in
+        float32, or the mask of the values over the 'thres_percent' percentage
+        of the values range. Normalization is affine, so the mask over the
+        stored values is the same as over the normalized ones. Slices are 
+        processed 'chunk' at a time and written into 'out', so there is at most
+        one copy of the volume.
+
+        Parameters:
+                    input_serie:    <SimpleITK.SimpleITK.Image>
+                                    3-dimensional image. A numpy array, such as
+                                    the one given by 'map_input', is also 
+                                    accepted, already well-oriented.
+                    thres_percent:  <int>
+                                    percent value over which pixels are going 
+                                    to be selected.
+                    normalize:      <bool>
+                                    Output the normalized image instead of the
+                                    mask.
+                    out:            <numpy.ndarray>
+                                    Preallocated output with the shape of the
+                                    well-oriented image. Created if not given.
+                    chunk:          <int>
+                                    Number of slices processed at a time.
+
+        Returns:
+                    turn:           <numpy.ndarray>
+                                    3-dimensional view of the image values,
+                                    well-oriented and not normalized.
+                    result:         <numpy.ndarray>
+                                    Either the normalized image (float32) or 
+                                    the binarized one (bool).
+        '''
+        if isinstance(input_serie, np.ndarray):
+            turn = input_serie
+        else:
+            npa = sitk.GetArrayViewFromImage(input_serie)
+            trans = np.transpose(npa, (0,2,1))
+            rot = trans[::-1,:,:]
+            turn = rot[:,:,::-1]
+
+        # Single pass for the statistics
+        max_ = None
+        min_ = None
+        total = 0.0
+        total_sq = 0.0
+        for first in range(0, turn.shape[0], chunk):
+            block = np.asarray(turn[first:first+chunk], dtype=np.float32)
+            block_max = np.max(block)
+            block_min = np.min(block)
+            if max_ is None or block_max > max_:
+                max_ = block_max
+            if min_ is None or block_min < min_:
+                min_ = block_min
+            total += np.sum(block, dtype=np.float64)
+            total_sq += np.sum(np.square(block, dtype=np.float64))
+        threshold = ((max_ - min_) / 100.0 ) * thres_percent + min_
+        n_voxels = turn.size
+        mean = total / n_voxels
+        # Unbiased deviation, as the one used by 'sitk.Normalize'
+        sigma = np.sqrt(max(total_sq - total * mean, 0.0) / max(n_voxels - 1, 1))
+        if sigma == 0:
+            sigma = 1.0
+
+        if '-debug' in sys.argv:
+            print ('binarizing:: max_: {} min_: {} threshold: {}'.format(max_,\
+                min_, threshold))
+
+        if out is None:
+            if normalize:
+                out = np.empty(turn.shape, dtype=np.float32)
+            else:
+                out = np.empty(turn.shape, dtype=np.bool_)
+
+        # Second pass writes the output chunk by chunk
+        for first in range(0, turn.shape[0], chunk):
+            block = turn[first:first+chunk]
+            if normalize:
+                np.subtract(block, np.float32(mean), out=out[first:first+chunk],\
+                    casting='unsafe')
+                out[first:first+chunk] /= np.float32(sigma)
+            else:
+                np.greater(block, threshold, out=out[first:first+chunk])
+
+        return turn, out
+
     def binarize_serie(self, input_s, thres_percent):
         '''
         Perform thresholding over the 'input_s'. Get the mask of the values over
@@ -81,13 +256,43 @@ class Input_process(object):
                                     threshold. 
         '''
 
-        max_ = np.max(input_s)
-        min_ = np.min(input_s)
-        threshold = ((max_ - min_) / 100.0 ) * thres_percent + min_
+        threshold = self.serie_threshold(input_s, thres_percent)
         thres_serie = input_s > threshold
 
+        return thres_serie
+
+    def serie_threshold(self, input_s, thres_percent, chunk=16):
+        '''
+        Returns the value of the 'thres_percent' percentage of the 'input_s' 
+        values range. The range is found reading 'chunk' slices at a time, so
+        mapped volumes are not loaded at once.
+
+        Parameters:
+                    input_s:        <numpy.ndarray>
+                                    3d array of the image.
+                    thres_percent:  <int>
+                                    percent value of the values range.
+                    chunk:          <int>
+                                    Number of slices read at a time.
+
+        Returns:
+                    threshold:      <numpy.float64>
+                                    Value of the percentage of the range.
+        '''
+        max_ = None
+        min_ = None
+        for first in range(0, input_s.shape[0], chunk):
+            block = input_s[first:first+chunk]
+            block_max = np.max(block)
+            block_min = np.min(block)
+            if max_ is None or block_max > max_:
+                max_ = block_max
+            if min_ is None or block_min < min_:
+                min_ = block_min
+        threshold = ((max_ - min_) / 100.0 ) * thres_percent + min_
+
         if '-debug' in sys.argv:
             print ('binarizing:: max_: {} min_: {} threshold: {}'.format(max_,\
                 min_, threshold))
 
-        return thres_serie
+        return threshold
@@ -0,0 +1,123 @@
+from skimage import measure as msr
+import numpy as np
+import locate_blobs as loc          # Union-find functions
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+class Labels_3d_stream(object):
+    '''
+    Labels the connected components of a volume slice by slice. Only the
+    previous labelled slice and an equivalence table between the labels of all
+    the slices are kept, so memory stays near one slice.
+    Each slice is labelled in 2d and each 2d label gets a provisional global
+    id. Labels overlapping between consecutive slices are joined in the
+    equivalence table, which gives the final 3d component ids after the last
+    slice.
+    '''
+    log_class_heading = log_file_heading+"Class: Labels_3d_stream"
+    parents = []
+    prev_lbl = None
+    prev_ids = None
+    z_connectivity = 1
+
+    def __init__(self, log, z_connectivity=1):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        # Provisional id 0 is the background
+        self.parents = [0]
+        self.prev_lbl = None
+        self.prev_ids = None
+        self.z_connectivity = z_connectivity
+
+    def push(self, im2d):
+        '''
+        Returns the labels of the next slice of the volume and the provisional
+        global id of each of them. Pixels of consecutive slices are connected
+        when they are at the same position or, with 'z_connectivity' 2, also
+        when they are diagonal neighbours.
+
+        Parameters:
+                    im2d:           <numpy.ndarray>
+                                    2d array image of the next slice.
+
+        Returns:
+                    labelled_arr:   <numpy.ndarray>
+                                    Array differently labelled for each blob of
+                                    the slice, as 'Locate_blobs.find_labels'.
+                    labels_number:  <int>
+                                    Number of different blobs found.
+                    ids:            <numpy.ndarray>
+                                    Provisional global id of each label. Item 0
+                                    is the background.
+        '''
+        labelled_arr, labels_number = msr.label(im2d, connectivity=2, \
+            return_num=True)
+        first_id = len(self.parents)
+        ids = np.zeros(labels_number + 1, dtype=np.intp)
+        ids[1:] = np.arange(first_id, first_id + labels_number)
+        self.parents.extend(range(first_id, first_id + labels_number))
+
+        if self.prev_lbl is not None:
+            for prev_label, label in self.overlapping_pairs(self.prev_lbl, \
+                    labelled_arr):
+                loc.join_roots(self.parents, self.prev_ids[prev_label], \
+                    ids[label])
+
+        self.prev_lbl = labelled_arr
+        self.prev_ids = ids
+
+        return labelled_arr, labels_number, ids
+
+    def overlapping_pairs(self, prev_lbl, lbl):
+        '''
+        Returns the distinct pairs of labels of two consecutive slices that are
+        connected.
+
+        Parameters:
+                    prev_lbl:       <numpy.ndarray>
+                                    Labelled previous slice.
+                    lbl:            <numpy.ndarray>
+                                    Labelled current slice.
+
+        Returns:
+                    pairs:          <numpy.ndarray>
+                                    Array of shape (n, 2) with the pairs
+                                    (previous label, current label).
+        '''
+        if self.z_connectivity == 1:
+            shifts = [(0, 0)]
+        else:
+            shifts = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+        rows, cols = lbl.shape
+        base = int(lbl.max()) + 1
+        keys = []
+        for dr, dc in shifts:
+            prev_part = prev_lbl[max(dr, 0):rows+min(dr, 0), \
+                max(dc, 0):cols+min(dc, 0)]
+            part = lbl[max(-dr, 0):rows+min(-dr, 0), max(-dc, 0):cols+min(-dc, 0)]
+            both = (prev_part > 0) & (part > 0)
+            keys.append(prev_part[both].astype(np.int64) * base + part[both])
+        keys = np.unique(np.concatenate(keys))
+        pairs = np.column_stack(np.divmod(keys, base))
+
+        return pairs
+
+    def global_ids(self):
+        '''
+        Returns the lookup table from provisional global ids to the final 3d
+        component ids, numbered consecutively from 1. To be called after the
+        last slice has been pushed.
+
+        Returns:
+                    lookup:         <numpy.ndarray>
+                                    Final 3d component id of each provisional
+                                    id. Item 0 is the background.
+        '''
+        roots = np.array([loc.find_root(self.parents, i) for i in \
+            range(len(self.parents))], dtype=np.intp)
+        unique_roots, lookup = np.unique(roots, return_inverse=True)
+
+        return lookup
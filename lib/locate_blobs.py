@@ -4,21 +4,63 @@ from skimage import morphology as mph
 from skimage import draw
 from scipy import ndimage as ndi
 from scipy import spatial as spt
-from inspect import stack                   # To write log
+from collections import namedtuple
 import numpy as np
 import sys
+import render_lib as rnd            # Rendering of the plots
+import timing_lib as tmg            # Counters of the run
+import rules_lib as rls             # Acceptance rules of the blobs
+import morph_lib as mrp             # Binary morphology by line segments
+import bitvol_lib as bvl            # Bit-packed binary images
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
+# Row of a blob table. Exposes the same attributes as the region properties
+# used by 'Blob' objects: label, bbox (min_row, min_col, max_row, max_col),
+# image (mask of the bbox), area and centroid (in slice coordinates).
+Blob_record = namedtuple('Blob_record', ['label', 'bbox', 'image', 'area', \
+    'centroid'])
+
+# Row of a blob feature table, the columnar form of the blob records of a slice
+# or a volume. 'mask_offset' is the position in the mask store of the table of
+# the flattened bbox mask of the blob, and 'hole_area' the area of its inner
+# region, -1 while it is not known.
+blob_feature_dtype = np.dtype([('label', np.int32), ('slice', np.int32), \
+    ('matter', 'S8'), ('area', np.int64), ('centroid', np.float64, (2,)), \
+    ('bbox', np.int32, (4,)), ('hole_area', np.int64), \
+    ('mask_offset', np.int64)])
+
+# Structure elements to differently erode and dilate the mixed mask when 
+# looking for candidate regions of type 3
+struct_elem_A = np.array([[1,0,0,0,0,0,0,0,0,0,1],
+                          [1,1,0,0,0,0,0,0,0,1,1],
+                          [1,1,1,1,1,1,1,1,1,1,1],
+                          [1,1,0,0,0,0,0,0,0,1,1],
+                          [1,0,0,0,0,0,0,0,0,0,1]])
+
+struct_elem_B = np.array([[1,0,0,0,0,0,0,0,1],
+                          [1,1,1,1,1,1,1,1,1],
+                          [1,0,0,0,0,0,0,0,1]])
+
 class Locate_blobs(object):
+    log_class_heading = log_file_heading+"Class: Locate_blobs"
+    renderer = None
+    timer = tmg.null_timer
+    rules = {}
+    roi_margin = None
     
     def __init__(self, log):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+        self.rules = {
+            'type1': rls.Blob_rules(self.log, 'type1', rls.type1_rules),
+            'type2': rls.Blob_rules(self.log, 'type2', rls.type2_rules),
+            'type3_wm': rls.Blob_rules(self.log, 'type3_wm', \
+                rls.type3_wm_rules),
+            'type3_gm': rls.Blob_rules(self.log, 'type3_gm', \
+                rls.type3_gm_rules),
+            }
 
     def find_labels(self, im2d):
         '''
@@ -42,11 +84,177 @@ class Locate_blobs(object):
 
         return labelled_arr, labels_number
 
+    def blob_table(self, lbl_slice):
+        '''
+        Returns the records of all the blobs of the labelled image 'lbl_slice',
+        as given by 'table_records' over its 'feature_table'.
+
+        Parameters:
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image differently labelled for each blob.
+
+        Returns:
+                    blob_records:   <list>
+                                    List of 'Blob_record', sorted by label.
+        '''
+        return self.table_records(*self.feature_table(lbl_slice))
+
+    def feature_table(self, lbl_slice, slice_num=0, matter=''):
+        '''
+        Returns the feature table of the blobs of the labelled image 
+        'lbl_slice' and the store of their masks. Bounding boxes are found at
+        once, and areas and centroids are counted by label in a single pass
+        over the slice. The mask of each bounding box is flattened into the 
+        store.
+
+        Parameters:
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image differently labelled for each blob.
+                    slice_num:      <int>
+                                    Number of the slice.
+                    matter:         <str>
+                                    Matter kind of the slice.
+
+        Returns:
+                    table:          <numpy.ndarray>
+                                    Structured array of 'blob_feature_dtype',
+                                    one row per blob sorted by label.
+                    mask_store:     <numpy.ndarray>
+                                    Boolean array with the masks of the blobs.
+        '''
+        bbox_slcs = ndi.find_objects(lbl_slice)
+        labels = np.array([i + 1 for i, bbox_slc in enumerate(bbox_slcs) if \
+            bbox_slc is not None], dtype=np.intp)
+        table = np.zeros(len(labels), dtype=blob_feature_dtype)
+        if len(labels) == 0:
+            return table, np.zeros(0, dtype=np.bool_)
+
+        # Areas and centroids of all the labels in a single pass
+        flat = lbl_slice.ravel()
+        n_bins = len(bbox_slcs) + 1
+        rows, cols = np.indices(lbl_slice.shape)
+        area = np.bincount(flat, minlength=n_bins)[labels]
+        row_sum = np.bincount(flat, weights=rows.ravel(), minlength=n_bins)
+        col_sum = np.bincount(flat, weights=cols.ravel(), minlength=n_bins)
+        table['label'] = labels
+        table['slice'] = slice_num
+        table['matter'] = matter
+        table['area'] = area
+        table['centroid'][:, 0] = row_sum[labels] / area
+        table['centroid'][:, 1] = col_sum[labels] / area
+        table['hole_area'] = -1
+
+        bbox_slcs = [bbox_slcs[label - 1] for label in labels]
+        table['bbox'] = [(bbox_slc[0].start, bbox_slc[1].start, \
+            bbox_slc[0].stop, bbox_slc[1].stop) for bbox_slc in bbox_slcs]
+        sizes = (table['bbox'][:, 2] - table['bbox'][:, 0]) * \
+            (table['bbox'][:, 3] - table['bbox'][:, 1])
+        table['mask_offset'][1:] = np.cumsum(sizes)[:-1]
+        mask_store = np.zeros(int(np.sum(sizes)), dtype=np.bool_)
+        for k, bbox_slc in enumerate(bbox_slcs):
+            offset = table['mask_offset'][k]
+            mask_store[offset:offset+sizes[k]] = \
+                (lbl_slice[bbox_slc] == labels[k]).ravel()
+
+        return table, mask_store
+
+    def table_records(self, table, mask_store):
+        '''
+        Returns the rows of a feature table as 'Blob_record', whose images are
+        views of 'mask_store'.
+
+        Parameters:
+                    table:          <numpy.ndarray>
+                                    Structured array of 'blob_feature_dtype'.
+                    mask_store:     <numpy.ndarray>
+                                    Boolean array with the masks of the blobs.
+
+        Returns:
+                    blob_records:   <list>
+                                    List of 'Blob_record'.
+        '''
+        blob_records = []
+        for row in table:
+            bbox = tuple(int(coord) for coord in row['bbox'])
+            shape = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+            offset = int(row['mask_offset'])
+            image = mask_store[offset:offset+shape[0]*shape[1]].reshape(shape)
+            blob_records.append(Blob_record(int(row['label']), bbox, image, \
+                int(row['area']), tuple(row['centroid'])))
+
+        return blob_records
+
+    def blobs_features(self, blobs):
+        '''
+        Returns the feature table and the mask store of a list of 'Blob'
+        objects, for the blobs that were not made from a table.
+
+        Parameters:
+                    blobs:          <list>
+                                    List of objects of class 'Blob'.
+
+        Returns:
+                    table:          <numpy.ndarray>
+                                    Structured array of 'blob_feature_dtype',
+                                    one row per blob in the order of 'blobs'.
+                    mask_store:     <numpy.ndarray>
+                                    Boolean array with the masks of the blobs.
+        '''
+        table = np.zeros(len(blobs), dtype=blob_feature_dtype)
+        sizes = np.array([blob.blob_crop.size for blob in blobs], \
+            dtype=np.int64)
+        if len(blobs) > 1:
+            table['mask_offset'][1:] = np.cumsum(sizes)[:-1]
+        mask_store = np.zeros(int(np.sum(sizes)), dtype=np.bool_)
+        for k, blob in enumerate(blobs):
+            table['label'][k] = blob.blob_num
+            table['slice'][k] = blob.slice_number
+            table['matter'][k] = blob.matter_kind
+            table['area'][k] = blob.props.area
+            table['centroid'][k] = blob.props.centroid
+            table['bbox'][k] = blob.blob_bbox
+            table['hole_area'][k] = -1 if blob.inner_crop is None else \
+                np.sum(blob.inner_crop)
+            offset = table['mask_offset'][k]
+            mask_store[offset:offset+sizes[k]] = blob.blob_crop.ravel()
+
+        return table, mask_store
+
     def plot_labels(self, out_f_path, lbl_slice, blobs, blobs2=None, blobs3=None):
         '''
         Plots the blobs of the three types found in the slices in a file in 
-        'o_path' with extension 'f_ext'.
-        For each type annotates its reference:
+        'o_path' with extension 'f_ext'. The annotations are given by
+        'label_annotations'. With a renderer set, the plot is queued to it and
+        written in the background.
+
+        Parameters:
+                    out_f_path:     <str>
+                                    Output path of the plots.
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image array to display.
+                    blobs:          <list>
+                                    List of blobs of the objects of class 
+                                    'ImageObject1'. 
+                    blobs2:          <list>
+                                    List of blobs of the objects of class 
+                                    'ImageObject2'.
+                    blobs3:          <list>
+                                    List of blobs of the objects of class 
+                                    'ImageObject3'.
+
+        Returns:
+                    None 
+        '''
+        annotations = self.label_annotations(lbl_slice, blobs, blobs2, blobs3)
+        if self.renderer is None:
+            rnd.render_labels(out_f_path, lbl_slice, annotations)
+        else:
+            self.renderer.submit(out_f_path, lbl_slice, annotations)
+
+    def label_annotations(self, lbl_slice, blobs, blobs2=None, blobs3=None):
+        '''
+        Returns the annotations of the blobs of the three types found in the
+        slices. For each type annotates its reference:
             - White color for single number are for objects of type 1. The 
                 number is the slice's blob number that corresponds to that
                 object.
@@ -58,8 +266,6 @@ class Locate_blobs(object):
                 is the position of the type 3 object, either 'left' or 'right'.
 
         Parameters:
-                    out_f_path:     <str>
-                                    Output path of the plots.
                     lbl_slice:      <numpy.ndarray>
                                     2d image array to display.
                     blobs:          <list>
@@ -73,71 +279,60 @@ class Locate_blobs(object):
                                     'ImageObject3'.
 
         Returns:
-                    None 
+                    annotations:    <list>
+                                    List of (text, (x, y), color), with (x, y)
+                                    in image coordinates.
         '''
-        # Plot image
-        fig=plt.figure()
-        plt.imshow(lbl_slice, cmap='nipy_spectral')
-        plt.axis('on')
-
-        # Annotate different labels
+        annotations = []
         # If in 'blobs' there is a single-dimension array, iterate over them
         if np.asarray(blobs).ndim == 1:
             for blob in blobs:
                 # Annotate blob number in centroid location
-                plt.annotate( s=str(blob.blob_num), xycoords='data', \
-                    xy=tuple(np.array(blob.blob_ctrd)[::-1]), color=(0.9, 0.9, 0.9))
+                annotations.append((str(blob.blob_num), \
+                    tuple(np.array(blob.blob_ctrd)[::-1]), (0.9, 0.9, 0.9)))
 
         # Just in case it is passed type 2 blobs as unique argument
         elif np.asarray(blobs).ndim == 2:
             for blob_wm, blob_gm in blobs:
                 # Annotate inner:outer blob number in centroid location
-                plt.annotate( s=str(blob_wm.blob_num)+':'+str(blob_gm.blob_num),\
-                    xycoords='data', xy=tuple(np.array(blob_wm.blob_ctrd)[::-1]),\
-                    color=(0.9, 0.9, 0.9))
+                annotations.append((str(blob_wm.blob_num)+':'\
+                    +str(blob_gm.blob_num), \
+                    tuple(np.array(blob_wm.blob_ctrd)[::-1]), (0.9, 0.9, 0.9)))
 
         # If 'blobs2' correctly has dimension 2, iterate over its pairs
         if blobs2 is not None:
             if np.asarray(blobs2).ndim == 2:
                 for blob_wm, blob_gm in blobs2:
                     # Annotate inner:outer blob number in centroid location
-                    plt.annotate( s=str(blob_wm.blob_num)+':'+str(blob_gm.blob_num),\
-                        xycoords='data', xy=tuple(np.array(blob_wm.blob_ctrd)[::-1]),\
-                        color=(0.1, 0.1, 0.9))
+                    annotations.append((str(blob_wm.blob_num)+':'\
+                        +str(blob_gm.blob_num), \
+                        tuple(np.array(blob_wm.blob_ctrd)[::-1]), \
+                        (0.1, 0.1, 0.9)))
 
-        # If 'blobs3' correctly has dimension 3, iterate over its pairs
+        # Type 3 objects are (wm blobs, gm blobs, position)
         if blobs3 is not None:
-            if np.asarray(zip(blobs3)).ndim == 3:
-                for blobs_wm, blobs_gm, position in blobs3:
-                    # Annotate inner:outer blob number in centroid location
-                    gm_mask = np.zeros(lbl_slice.shape)
-                    for blob in blobs_gm:
-                        gm_mask[blob.blob_mask>0] = 1
-                    center = np.round(msr.regionprops(gm_mask.astype(np.int))[0].centroid)
-                    center = (center[1], center[0])
-                    plt.annotate( s=str(position), xycoords='data', xy=center,\
-                        color=(0.1, 0.9, 0.1))
-
-
-
-
-
-#            for blob_wm in zip(*blobs)[0]:
-#                plt.annotate( s=str(blob_wm.blob_num), xycoords='data', \
-#                    xy=tuple(np.array(blob_wm.blob_ctrd)[::-1]), color=(0.9, 0.2, 0.2))
-#            for blob_gm in zip(*blobs)[1]:
-#                plt.annotate( s=str(blob_gm.blob_num), xycoords='data', \
-#                    xy=tuple(np.array(blob_gm.blob_ctrd)[::-1]), color=(0.2, 0.2, 0.9))
-        plt.savefig(out_f_path)
-        plt.close(fig)
+            for blobs_wm, blobs_gm, position in blobs3:
+                # Annotate position in the centroid of the gray matter blobs
+                rows = []
+                cols = []
+                for blob in blobs_gm:
+                    crop_rows, crop_cols = np.nonzero(blob.blob_crop)
+                    rows.append(crop_rows + blob.blob_bbox[0])
+                    cols.append(crop_cols + blob.blob_bbox[1])
+                center = (np.round(np.mean(np.concatenate(cols))), \
+                    np.round(np.mean(np.concatenate(rows))))
+                annotations.append((str(position), center, (0.1, 0.9, 0.1)))
+
+        return annotations
 
     def blob_inner_region(self, props):
         '''
         Returns the image resulting of extracting the inner region of the blob.
 
         Parameters:
-                    props:          <skimage.measure._regionprops._RegionProperties>
-                                    Properties of the blob.
+                    props:          <Blob_record>
+                                    Properties of the blob. Region properties
+                                    of skimage are also accepted.
 
         Returns:
                     inner_region:           <numpy.ndarray>
@@ -145,7 +340,7 @@ class Locate_blobs(object):
                                     same size as blob bbox 
         '''
         image = props.image
-        filled_image = props.filled_image
+        filled_image = ndi.binary_fill_holes(image, np.ones((3,3)))
         inner_region = filled_image.astype(np.int) - image.astype(np.int)
 
         return inner_region
@@ -161,7 +356,7 @@ class Locate_blobs(object):
                                     (x_dim, y_dim) 
                    subimage:           <numpy.ndarray>
                                     Image of a blob or a region of the main image.
-                   blob_props:      <skimage.measure._regionprops._RegionProperties>
+                   blob_props:      <Blob_record>
                                     Properties of the given blob.
 
         Returns:
@@ -171,15 +366,114 @@ class Locate_blobs(object):
         b_props = blob_props
         ref_corner = b_props.bbox
         subimage_resized = np.zeros(output_shape)
-        coords = np.where(subimage==True)
-        for coord in zip(*coords):
-            x = coord[0] + ref_corner[0]
-            y = coord[1] + ref_corner[1]
-            subimage_resized[x, y] = 1
+        sub_rows, sub_cols = subimage.shape
+        subimage_resized[ref_corner[0]:ref_corner[0]+sub_rows, \
+            ref_corner[1]:ref_corner[1]+sub_cols][subimage==True] = 1
 
         return subimage_resized
 
-    def characterize_blobs_type1(self, wm_blobs_list, gm_blobs_list):
+    def find_inner_regions(self, lbl_slice, blobs, table=None):
+        '''
+        Stores in each 'Blob' object of 'blobs' the mask of its inner region.
+        The holes of the whole labelled slice are found in a single pass and
+        only the blobs that border any of them are filled. The rest of blobs
+        cannot enclose a hole (their Euler number is 1), so they get an empty
+        inner region without further work.
+
+        Parameters:
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image differently labelled for each blob.
+                    blobs:          <list>
+                                    List of objects of class 'Blob' found in
+                                    'lbl_slice'.
+                    table:          <numpy.ndarray>
+                                    Feature table of 'blobs', row by row. Its
+                                    hole areas are also set.
+
+        Updates object atributes of each blob:
+                    inner_crop:     <numpy.ndarray>
+                                    Inner region with the shape of the blob
+                                    bounding box.
+        '''
+        # Background is 8-connected, as in the filled image of region props
+        struct_elem = np.ones((3,3))
+        foreground = lbl_slice > 0
+        holes = ndi.binary_fill_holes(foreground, struct_elem)
+        holes[foreground] = False
+
+        # Labels neighbouring any hole of the slice
+        holed_labels = set()
+        if np.any(holes):
+            border = ndi.binary_dilation(holes, struct_elem)
+            holed_labels = set(np.unique(lbl_slice[border]))
+
+        if table is not None:
+            table['hole_area'] = 0
+        for k, blob in enumerate(blobs):
+            if blob.blob_num in holed_labels:
+                filled_image = ndi.binary_fill_holes(blob.blob_crop, struct_elem)
+                blob.inner_crop = filled_image & ~blob.blob_crop
+                if table is not None:
+                    table['hole_area'][k] = np.sum(blob.inner_crop)
+            else:
+                blob.inner_crop = np.zeros(blob.blob_crop.shape, dtype=np.bool_)
+
+    def inner_overlaps(self, gm_blobs_list, rows, wm_blobs_list, wm_lbl, \
+            gm_lbl=None, context=None):
+        '''
+        Returns the number of pixels of the inner region of the gray matter
+        blobs of 'rows' that lie over each white matter blob and, if 'gm_lbl'
+        is given, over each other gray matter blob.
+
+        Parameters:
+                    gm_blobs_list:  <list>
+                                    List of objects of class 'Blob' of gray 
+                                    matter.
+                    rows:           <numpy.ndarray>
+                                    Indices of the blobs of 'gm_blobs_list' to
+                                    measure.
+                    wm_blobs_list:  <list>
+                                    List of objects of class 'Blob' of white 
+                                    matter.
+                    wm_lbl:         <numpy.ndarray>
+                                    Labelled slice of white matter.
+                    gm_lbl:         <numpy.ndarray>
+                                    Labelled slice of gray matter.
+                    context:        <lib.context_lib.Slice_context>
+                                    Context of the slices, whose overlaps are
+                                    reused. Computed from the blobs if None.
+
+        Returns:
+                    wm_overlap:     <numpy.ndarray>
+                                    Matrix of shape (len(rows), 
+                                    len(wm_blobs_list)).
+                    gm_overlap:     <numpy.ndarray>
+                                    Matrix of shape (len(rows), 
+                                    len(gm_blobs_list)), with 0 for the blob 
+                                    itself. None without 'gm_lbl'.
+        '''
+        blobs = [gm_blobs_list[i] for i in rows]
+        wm_cols = [wm_blob.blob_num for wm_blob in wm_blobs_list]
+        if context is not None:
+            wm_overlap = context.inner_overlaps('wm', rows)[:, wm_cols]
+        else:
+            wm_overlap = overlap_matrix(blobs, wm_lbl)[:, wm_cols]
+        self.timer.count('overlaps', len(rows) * len(wm_blobs_list))
+
+        gm_overlap = None
+        if gm_lbl is not None:
+            gm_cols = [gm_blob.blob_num for gm_blob in gm_blobs_list]
+            if context is not None:
+                gm_overlap = context.inner_overlaps('gm', rows)[:, gm_cols]
+            else:
+                gm_overlap = overlap_matrix(blobs, gm_lbl)[:, gm_cols]
+            gm_overlap[np.arange(len(rows)), rows] = 0
+            self.timer.count('overlaps', len(rows) * len(gm_blobs_list))
+
+        return wm_overlap, gm_overlap
+
+    def characterize_blobs_type1(self, wm_blobs_list, gm_blobs_list, \
+            wm_lbl=None, gm_lbl=None, gm_table=None, context=None):
         '''
         Returns in a list the 'Blob' objects of gray matter that match the 
         constraints to be considered as object of type 1. 
@@ -189,12 +483,29 @@ class Locate_blobs(object):
                 center zone.
             - having no correspondence between its inner mask and no gray nor 
                 white blob.
+        The constraints are the rules 'type1_rules' of 'lib.rules_lib': size
+        and location are checked at once over the feature table of the gray
+        matter blobs, and the overlap matrices of the inner regions against
+        both labelled slices are computed only for the blobs that pass them.
 
         Parameters:
                     wm_blobs_list:  <list>
                                     List of objects of class 'Blob' of white matter
                     gm_blobs_list:  <list>
                                     List of objects of class 'Blob' of gray matter
+                    wm_lbl:         <numpy.ndarray>
+                                    Labelled slice of white matter. By default
+                                    it is rebuilt from 'wm_blobs_list'.
+                    gm_lbl:         <numpy.ndarray>
+                                    Labelled slice of gray matter. By default
+                                    it is rebuilt from 'gm_blobs_list'.
+                    gm_table:       <numpy.ndarray>
+                                    Feature table of 'gm_blobs_list'. By 
+                                    default it is built from the blobs.
+                    context:        <lib.context_lib.Slice_context>
+                                    Context of the slices of the blobs. If
+                                    given, the labelled slices, the table and
+                                    the overlaps are taken from it.
 
         Returns:
                     type1_blobs:    <list>
@@ -202,51 +513,36 @@ class Locate_blobs(object):
                                     matter.
         '''
         type1_blobs = []
-        for i, gm_blob in enumerate(gm_blobs_list):
-            # Check if it is too big
-            is_big = 0
-            if gm_blob.props.area > 2000:
-                is_big = 1
-
-            # Check if it is too small
-            is_noise = 0
-            if gm_blob.props.area < 3:
-                is_noise = 1
-
-            # Check if its centroid is in candidate region
-            is_out = 0
-            if (gm_blob.blob_ctrd[0] < 90) or (200 > gm_blob.blob_ctrd[1] > 150):
-                is_out = 1
-
-            # Check if it is empty ('is_something' must be 0):
-            # By NOT HAVING correspondence between its inner area and any white
-            # matter blob.
-            is_something = 0
-            wm_corr = 0
-            for wm_blob in wm_blobs_list:
-                wm_corr = correspondence(gm_blob.inner_mask, wm_blob.blob_mask)
-                if wm_corr > 0: 
-                    is_something += wm_corr
-            # And by NOT HAVING correspondence between its inner area and any other 
-            # gray matter blob.
-            self_corr = 0
-            for j in range(len(gm_blobs_list)):
-                if j != i:
-                    self_corr = correspondence(gm_blob.inner_mask, \
-                        gm_blobs_list[j].blob_mask)
-                if self_corr > 5:
-                    is_something += self_corr
-
-            # Check if blob supports all constrains 
-            #   empty:              is_something = 0
-            #   correct size:       is_big = 0 and is_noise = 0
-            #   correct_location:   is_out = 0
-            if np.all([is_something == 0, is_big == 0, is_noise == 0, is_out == 0]):
-                type1_blobs.append(gm_blob)
+        if len(gm_blobs_list) == 0:
+            return type1_blobs
+
+        if context is not None:
+            wm_lbl, gm_lbl, gm_table = context.wm_lbl, context.gm_lbl, \
+                context.gm_table
+        if wm_lbl is None:
+            wm_lbl = blobs_label_image(wm_blobs_list, gm_blobs_list[0].slc_shape)
+        if gm_lbl is None:
+            gm_lbl = blobs_label_image(gm_blobs_list, gm_blobs_list[0].slc_shape)
+        if gm_table is None:
+            gm_table = self.blobs_features(gm_blobs_list)[0]
+
+        def inner_overlap(rows):
+            # Pixels of the inner region over any white matter blob, plus the
+            # ones over each other gray matter blob when more than 5
+            wm_overlap, gm_overlap = self.inner_overlaps(gm_blobs_list, rows, \
+                wm_blobs_list, wm_lbl, gm_lbl, context)
+            gm_overlap[gm_overlap <= 5] = 0
+
+            return np.sum(wm_overlap, axis=1) + np.sum(gm_overlap, axis=1)
+
+        selected = self.rules['type1'].select(gm_table, \
+            {'inner_overlap': inner_overlap})
+        type1_blobs = [gm_blobs_list[i] for i in np.flatnonzero(selected)]
 
         return type1_blobs
 
-    def characterize_blobs_type2(self, wm_blobs_list, gm_blobs_list):
+    def characterize_blobs_type2(self, wm_blobs_list, gm_blobs_list, \
+            wm_lbl=None, gm_lbl=None, gm_table=None, context=None):
         '''
         Returns in a list pairs of the 'Blob' objects of white matter and gray 
         matter that match the constraints to be considered as objects of type 2.
@@ -258,12 +554,29 @@ class Locate_blobs(object):
                 matter blob. 
             - having correspondence between its inner mask and a white matter 
                 blob.
+        The constraints are the rules 'type2_rules' of 'lib.rules_lib': size,
+        location and hole are checked at once over the feature table of the
+        gray matter blobs, and the overlap matrix of the inner regions against
+        the white matter slice is computed only for the blobs that pass them.
 
         Parameters:
                     wm_blobs_list:   <list>
                                     List of objects of class 'Blob' of white matter
                     gm_blobs_list:  <list>
                                     List of objects of class 'Blob' of gray matter
+                    wm_lbl:         <numpy.ndarray>
+                                    Labelled slice of white matter. By default
+                                    it is rebuilt from 'wm_blobs_list'.
+                    gm_lbl:         <numpy.ndarray>
+                                    Labelled slice of gray matter. By default
+                                    it is rebuilt from 'gm_blobs_list'.
+                    gm_table:       <numpy.ndarray>
+                                    Feature table of 'gm_blobs_list'. By 
+                                    default it is built from the blobs.
+                    context:        <lib.context_lib.Slice_context>
+                                    Context of the slices of the blobs. If
+                                    given, the labelled slices, the table and
+                                    the overlaps are taken from it.
 
         Returns:
                     type2_blobs:           <classtype>
@@ -277,66 +590,49 @@ class Locate_blobs(object):
         # If there is no found candidate blob, 'type2_blobs' returns also empty.
 
         if len(wm_blobs_list) > 0 and len(gm_blobs_list) > 0:
-            for i, gm_blob in enumerate(gm_blobs_list):
-
-                # Check if it is too big
-                is_big = 0
-                if gm_blob.props.area > 2000:
-                    is_big = 1
-
-                # Check if it is too small
-                is_noise = 0
-                if gm_blob.props.area < 3:
-                    is_noise = 1
-
-                # Check if its centroid is in candidate region
-                is_out = 0
-                if (gm_blob.blob_ctrd[0] < 90) or (200 > gm_blob.blob_ctrd[1] > 150):
-                    is_out = 1
-
-                # Check if it has a hole
-                no_hole = 0
-                if np.sum(gm_blob.inner_mask) < 3:
-                    no_hole = 1
-
-                # Check if its hole is filled
-
-                # Check if its hole is properly filled
-                # By NOT HAVING correspondence between its inner area and any other
-                # gray matter blob.
-                is_trash = 0
-                self_corr = 0
-                for j, gm_blob2 in enumerate(gm_blobs_list):
-                    if j != i:
-                        self_corr = correspondence(gm_blob.inner_mask, \
-                            gm_blob2.blob_mask)
-                    if self_corr > 0:
-                        is_trash = 1
-
-                # By HAVING correspondence between its inner area and any white
-                # matter blob.
-                wm_candidate = None
-                min_corr = 0
-                for wm_blob in wm_blobs_list:
-                    wm_corr = correspondence(gm_blob.inner_mask, wm_blob.blob_mask)
-                    if wm_corr > min_corr: 
-                        min_corr = wm_corr
-                        wm_candidate = wm_blob
-
-                # Check if blob supports all constrains
-                #   has hole:           no_hole = 0
-                #   hole is filled:     min_corr > 0
-                #   correct size:       is_big = 0 and is_noise = 0
-                #   correct location:   is_out = 0
-                if np.all([no_hole == 0, min_corr > 0, is_big == 0, \
-                        is_noise == 0, is_out == 0]):
-                    type2_blobs.append((wm_candidate, gm_blob))
+            if context is not None:
+                wm_lbl, gm_lbl, gm_table = context.wm_lbl, context.gm_lbl, \
+                    context.gm_table
+            if wm_lbl is None:
+                wm_lbl = blobs_label_image(wm_blobs_list, \
+                    gm_blobs_list[0].slc_shape)
+            if gm_lbl is None:
+                gm_lbl = blobs_label_image(gm_blobs_list, \
+                    gm_blobs_list[0].slc_shape)
+            if gm_table is None:
+                gm_table = self.blobs_features(gm_blobs_list)[0]
+
+            # Hole areas not known yet are found from the inner regions
+            hole_area = gm_table['hole_area']
+            for i in np.flatnonzero(hole_area < 0):
+                if gm_blobs_list[i].inner_crop is None:
+                    gm_blobs_list[i].find_inner_region()
+                hole_area[i] = np.sum(gm_blobs_list[i].inner_crop)
+
+            # Pixels of the inner region over each white matter blob, kept to
+            # pair each selected blob with the white matter blob filling it
+            wm_overlaps = {}
+            def wm_overlap(rows):
+                wm_overlaps['rows'] = rows
+                wm_overlaps['matrix'] = self.inner_overlaps(gm_blobs_list, \
+                    rows, wm_blobs_list, wm_lbl, context=context)[0]
+
+                return np.max(wm_overlaps['matrix'], axis=1)
+
+            selected = self.rules['type2'].select(gm_table, \
+                {'wm_overlap': wm_overlap})
+            for i in np.flatnonzero(selected):
+                # The first white matter blob with the highest overlap is taken
+                wm_corr = wm_overlaps['matrix'][np.searchsorted(\
+                    wm_overlaps['rows'], i)]
+                wm_candidate = wm_blobs_list[np.argmax(wm_corr)]
+                type2_blobs.append((wm_candidate, gm_blobs_list[i]))
 
             type2_blobs = zip(*type2_blobs)
 
         return type2_blobs
 
-    def find_candidate_regions_type3(self, wm_slice, gm_slice):
+    def find_candidate_regions_type3(self, wm_slice, gm_slice, context=None):
         '''
         Returns a 2d image array with candidate regions extracted from original 
         blobs.To do so, first it is extracted a mask merging the 'wm_slice' mask
@@ -360,6 +656,10 @@ class Locate_blobs(object):
                                     Object 'Slice' of matter 'wm'.
                     gm_slice:           <lib.slice_lib.Slice>
                                     Object 'Slice' of matter 'gm'.
+                    context:            <lib.context_lib.Slice_context>
+                                    Context of both slices. If given, the 
+                                    images, the window and the dilated white
+                                    matter are taken from it.
 
         Returns:
                     wm_blobs_lbl:           <list>
@@ -374,42 +674,47 @@ class Locate_blobs(object):
         # Lets mix wm and gm masks to avoid holes in the gm blobs, then
         # performing morphology operations won't counterpose blobs inner
         # regions.
-        image_gm = gm_slice.slc_arr
-        image_wm = wm_slice.slc_arr
-        image_wm_dilated = mph.dilation(image_wm, np.ones((5,5)))   
+        if context is not None:
+            image_gm, image_wm = context.image_gm, context.image_wm
+        else:
+            image_gm, image_wm = gm_slice.slc_arr, wm_slice.slc_arr
+        # With 'roi_margin' set, the slice is cropped around the main blob of
+        # the mixed mask, the only one kept by 'characterize_blobs_type3'.
+        window = None
+        if self.roi_margin is not None:
+            if context is not None:
+                window = context.main_window(self.roi_margin)
+            else:
+                window = main_blob_window(image_wm, image_gm, self.roi_margin)
+        if window is not None:
+            frame_shape = image_gm.shape
+            image_gm = image_gm[window]
+            image_wm = image_wm[window]
+        if context is not None:
+            image_wm_dilated = context.wm_dilated(window)
+        else:
+            image_wm_dilated = mrp.binary_dilation(image_wm, np.ones((5,5)))
         image_mix = np.copy(image_gm)
         image_mix[image_wm_dilated > 0] = 1
 
-        # Generate structure elements to differently erode and dilate 
-        # image
-        struct_elem_A = np.array([[1,0,0,0,0,0,0,0,0,0,1],
-                                  [1,1,0,0,0,0,0,0,0,1,1],
-                                  [1,1,1,1,1,1,1,1,1,1,1],
-                                  [1,1,0,0,0,0,0,0,0,1,1],
-                                  [1,0,0,0,0,0,0,0,0,0,1]])
-
-        struct_elem_B = np.array([[1,0,0,0,0,0,0,0,1],
-                                  [1,1,1,1,1,1,1,1,1],
-                                  [1,0,0,0,0,0,0,0,1]])
-
         # Perform erosion transformation to expand black areas and attempt 
         # to split global blob. Small bright areas, that often are noise,
         # disappear.
-        ero1 = mph.erosion(image_mix, selem=struct_elem_A)
+        ero1 = mrp.binary_erosion(image_mix, struct_elem_A)
 
         # Perform dilation transformation to recover image main shape. 
         # Enlarge bright areas, which could undo our splitting, but can
         # be driven with a structure element, different of such used in 
         # erosion.
-        dil1 = mph.dilation(ero1, selem=struct_elem_B)
+        dil1 = mrp.binary_dilation(ero1, struct_elem_B)
 
         # Performing erosion again it is achieved a good splitting of lower
         # blobs
-        ero2 = mph.erosion(dil1, selem=struct_elem_A)
+        ero2 = mrp.binary_erosion(dil1, struct_elem_A)
         
         # It is performed dilation again to recover at least a shade of the
         # original shape.
-        dil2 = mph.dilation(ero2, selem=np.ones((3,3)))
+        dil2 = mrp.binary_dilation(ero2, np.ones((3,3)))
 
         # Now, let's find the blobs:
 
@@ -519,10 +824,135 @@ class Locate_blobs(object):
 ##########
 ###############
 
+        # Regions are given back in the coordinates of the whole slice
+        if window is not None:
+            wm_blobs_lbl = paste_window(wm_blobs_lbl, window, frame_shape)
+            gm_blobs_lbl = paste_window(gm_blobs_lbl, window, frame_shape)
 
         return wm_blobs_lbl, gm_blobs_lbl
 
 
+    def find_candidate_regions_type3_stack(self, wm_slices, gm_slices, \
+            contexts=None):
+        '''
+        Returns the candidate regions of type 3 of several slices, the same as
+        'find_candidate_regions_type3' of each pair of slices, processing the
+        slices stacked as a volume. With 'roi_margin' set, each slice is 
+        cropped to the window around its own main blob, and the windows are
+        stacked with 'stack_windows'. The mixed masks and morphology operations
+        are performed at once over the stack, with structure elements within
+        each slice, so each slice gives the same result as alone. The distance
+        transform, the thresholds, the merging and purging of the seeds and the
+        watershed are performed over the window of each slice.
+
+        Parameters:
+                    wm_slices:      <list>
+                                    List of objects 'Slice' of matter 'wm'.
+                    gm_slices:      <list>
+                                    List of objects 'Slice' of matter 'gm', of 
+                                    the same slice numbers.
+                    contexts:       <list>
+                                    Objects 'Slice_context' of each pair of 
+                                    slices. If given, the images and the 
+                                    windows are taken from them.
+
+        Returns:
+                    regions:        <list>
+                                    Pair (wm_blobs_lbl, gm_blobs_lbl) of each 
+                                    slice, as 'find_candidate_regions_type3'.
+        '''
+        if len(gm_slices) == 0:
+            return []
+
+        if contexts is not None:
+            images_gm = [context.image_gm for context in contexts]
+            images_wm = [context.image_wm for context in contexts]
+        else:
+            images_gm = [gm_slice.slc_arr for gm_slice in gm_slices]
+            images_wm = [wm_slice.slc_arr for wm_slice in wm_slices]
+        frame_shape = images_gm[0].shape
+        # With 'roi_margin' set, each slice is cropped to the window of its 
+        # main blob. Slices without blobs keep the whole frame.
+        windows = [None] * len(images_gm)
+        if self.roi_margin is not None:
+            if contexts is not None:
+                windows = [context.main_window(self.roi_margin) for context \
+                    in contexts]
+            else:
+                windows = [main_blob_window(wm, gm, self.roi_margin) for \
+                    wm, gm in zip(images_wm, images_gm)]
+        frame = (slice(0, frame_shape[0]), slice(0, frame_shape[1]))
+        windows = [frame if window is None else window for window in windows]
+        shapes = [(window[0].stop - window[0].start, window[1].stop - \
+            window[1].start) for window in windows]
+        # Windows of different shapes are padded beyond the reach of the
+        # largest structure element
+        padding = 0
+        if len(set(shapes)) > 1:
+            padding = max(struct_elem_A.shape + struct_elem_B.shape)
+
+        # Slices are stacked along the first axis
+        image_gm = stack_windows(images_gm, windows, padding)
+        image_wm = stack_windows(images_wm, windows, padding)
+        image_wm_dilated = mrp.binary_dilation(image_wm, np.ones((5,5)))
+        image_mix = np.copy(image_gm)
+        image_mix[image_wm_dilated > 0] = 1
+        self.timer.count_bytes(image_mix)
+
+        # The padding is reflected again before each operation, so the
+        # pixels of the windows only see the ones of their own slice
+        ero1 = mrp.binary_erosion(reflect_windows(image_mix, shapes), \
+            struct_elem_A)
+        dil1 = mrp.binary_dilation(reflect_windows(ero1, shapes), \
+            struct_elem_B)
+        ero2 = mrp.binary_erosion(reflect_windows(dil1, shapes), \
+            struct_elem_A)
+        dil2 = mrp.binary_dilation(reflect_windows(ero2, shapes), \
+            np.ones((3,3)))
+
+        # Distance transform and threshold of 'thres_per_percent' of the 
+        # window of each slice. The padding stays out of the seeds.
+        dist = np.zeros(dil2.shape)
+        key_image = np.zeros(dil2.shape, dtype=np.bool_)
+        for k, (rows, cols) in enumerate(shapes):
+            window_dist = ndi.distance_transform_edt(dil2[k, :rows, :cols])
+            dist[k, :rows, :cols] = window_dist
+            key_image[k, :rows, :cols] = window_dist > thres_per_percent(\
+                window_dist, np.float64(5))
+
+        # Regions are labelled in scan order, so the labels of each slice 
+        # follow the ones of the previous slices.
+        seeds = ndi.label(key_image, structure=slice_structure(\
+            np.ones((3,3))))[0]
+        last_labels = np.max(seeds.reshape(len(seeds), -1), axis=1)
+        offsets = np.concatenate([[0], np.maximum.accumulate(last_labels)[:-1]])
+
+        # Watershed is run over the window of each slice: all the seeds enter
+        # its queue at once, so ties between seeds of a slice depend on the 
+        # seeds of the others.
+        regions = []
+        for k, (rows, cols) in enumerate(shapes):
+            labels = np.zeros((rows, cols), dtype=np.intp)
+            if last_labels[k] > 0:
+                window_seeds = seeds[k, :rows, :cols]
+                slice_seeds = np.where(window_seeds > 0, window_seeds - \
+                    offsets[k], 0)
+                purged_seeds = ignore_small_seeds(merge_neigh_seeds(\
+                    slice_seeds))
+                labels = mph.watershed(dist[k, :rows, :cols], purged_seeds, \
+                    mask=None, compactness=10)
+
+            wm_blobs_lbl = np.copy(labels)
+            gm_blobs_lbl = np.copy(labels)
+            wm_blobs_lbl[image_wm[k, :rows, :cols] == 0] = 0
+            gm_blobs_lbl[image_gm[k, :rows, :cols] == 0] = 0
+            regions.append((paste_window(wm_blobs_lbl, windows[k], \
+                frame_shape), paste_window(gm_blobs_lbl, windows[k], \
+                frame_shape)))
+
+        return regions
+
+
 ###############
 ##########
 #####
@@ -547,7 +977,8 @@ class Locate_blobs(object):
 ###############
 
     def characterize_blobs_type3(self, wm_blobs_list, gm_blobs_list, \
-            original_wm_slice, original_gm_slice):
+            original_wm_slice, original_gm_slice, wm_table=None, gm_table=None,\
+            context=None):
         '''
         Returns either a list of pairs of white and gray matter 'Blob' objects, 
         or a list of pair of an empty list and a gray matter 'Blob' objects,
@@ -566,6 +997,18 @@ class Locate_blobs(object):
                                     Object of class 'Slice' of white matter.
                     original_gm_slice: <lib.slice_lib.Slice>
                                     Object of class 'Slice' of gray matter.
+                    wm_table:          <numpy.ndarray>
+                                    Feature table of 'wm_blobs_list'. By 
+                                    default it is built from the blobs.
+                    gm_table:          <numpy.ndarray>
+                                    Feature table of 'gm_blobs_list'. By 
+                                    default it is built from the blobs.
+                    context:           <lib.context_lib.Slice_context>
+                                    Context of both slices. If given, the mask
+                                    of the main mixed blob is taken from it.
+                                    When the slices are packed, the mask is
+                                    packed too and the overlaps of the blobs
+                                    with it are counted by popcount.
 
         Returns:
                     type3_blobs:     <tuple>
@@ -581,29 +1024,41 @@ class Locate_blobs(object):
 
         if len(gm_blobs_list) > 0:
 
-            mask_wm = original_wm_slice.slc_arr
-            mask_gm = original_gm_slice.slc_arr
-            image_mix = np.copy(mask_gm)
-            image_mix[mask_wm > 0] = 1
-            mix_labels = msr.label(image_mix)
-            mix_props = msr.regionprops(mix_labels)
-
-            # Locate biggest blob. It is suppossed to be the main blob.
-            max_area = 0
-            main_mixed_blob = None
-            for blob_p in mix_props:
-                if blob_p.area > max_area:
-                    main_mixed_blob = blob_p
-                    max_area = blob_p.area
-
-            # Create a mask with exclusively the main blob.
-            main_mixed_blob_mask = np.zeros(original_wm_slice.slc_arr.shape)
-            main_mixed_blob_mask[mix_labels == main_mixed_blob.label] = 1
+            if context is not None:
+                main_mixed_blob_mask = context.main_mask
+            else:
+                mask_wm = original_wm_slice.slc_arr
+                mask_gm = original_gm_slice.slc_arr
+                image_mix = np.copy(mask_gm)
+                image_mix[mask_wm > 0] = 1
+                mix_labels = msr.label(image_mix)
+                mix_props = msr.regionprops(mix_labels)
+
+                # Locate biggest blob. It is suppossed to be the main blob.
+                max_area = 0
+                main_mixed_blob = None
+                for blob_p in mix_props:
+                    if blob_p.area > max_area:
+                        main_mixed_blob = blob_p
+                        max_area = blob_p.area
+
+                # Create a mask with exclusively the main blob.
+                main_mixed_blob_mask = np.zeros(\
+                    original_wm_slice.slc_arr.shape)
+                main_mixed_blob_mask[mix_labels == main_mixed_blob.label] = 1
+
+            # Overlaps with the main blob of packed slices are counted over
+            # its packed mask
+            if original_wm_slice.slc_bits is not None:
+                if context is not None:
+                    main_mixed_blob_mask = context.main_bits
+                else:
+                    main_mixed_blob_mask = bvl.pack_slice(main_mixed_blob_mask)
 
             type3_wm_blobs = self.characterize_blobs_type3_wm(wm_blobs_list, \
-                main_mixed_blob_mask) 
+                main_mixed_blob_mask, wm_table) 
             type3_gm_blobs = self.characterize_blobs_type3_gm(gm_blobs_list, \
-                main_mixed_blob_mask) 
+                main_mixed_blob_mask, gm_table) 
 
             if len(type3_gm_blobs) > 0:
                 if len(type3_wm_blobs) > 0:
@@ -615,7 +1070,7 @@ class Locate_blobs(object):
 
         return type3_blobs
 
-    def characterize_blobs_type3_wm(self, wm_blobs, main_mask):
+    def characterize_blobs_type3_wm(self, wm_blobs, main_mask, table=None):
         '''
         Returns in a list the 'Blob' objects of white matter that match the 
         constraints to be considered as object of type 3. 
@@ -625,6 +1080,7 @@ class Locate_blobs(object):
                 center zone. 
             - having correspondence between its mask and the biggest blob of 
                 the mixed mask, stored in 'main_mask'.
+        The constraints are the rules 'type3_wm_rules' of 'lib.rules_lib'.
 
         Parameters:
                     wm_blobs:           <list>
@@ -632,108 +1088,21 @@ class Locate_blobs(object):
                                     matter.
                     main_mask:           <numpy.ndarray>
                                     2d image array of the main blob of the 
-                                    mixed mask.
+                                    mixed mask, or the mask packed as a 
+                                    <lib.bitvol_lib.Bit_slice>.
+                    table:          <numpy.ndarray>
+                                    Feature table of 'wm_blobs'. By default it
+                                    is built from the blobs.
 
         Returns:
                     blobs_ty3_wm:           <list>
                                     List of objects of class 'Blob' of white 
                                     matter.
         '''
-        blobs_ty3_wm = []
-
-###############
-##########
-#####
-#        print ('wm_blobs: {} type: {}'.format(np.sum(np.unique(wm_blobs, \
-#            return_counts=True)[1]), type(wm_blobs[0])))
-#        ax = plt.subplots()
-#        ax.imshow(main_mask)
-#        ax.set_title('main_mask')
-#        plt.show()
-#        raw_input()
-#####
-##########
-###############
-        if len(wm_blobs)>0:
-            if '-debug' in sys.argv:
-                print ('Checking WM blobs for type 3 objects. Slice {}'.format(\
-                    wm_blobs[0].slice_number))
-        for i, wm_blob in enumerate(wm_blobs):
-    
-            # Check if it is too big
-            is_big = 0
-            if wm_blob.props.area > 2000:
-                is_big = 1
-        
-            # Check if it is too small
-            is_noise = 0
-            if wm_blob.props.area < 3:
-                is_noise = 1
-        
-            # Check if its centroid is in candidate region
-            is_out = 0
-            if (wm_blob.blob_ctrd[0] < 95) or (200 > wm_blob.blob_ctrd[1] > 150):
-                is_out = 1
-        
-            # Check if the blob lies over the original MAIN mixed blob with
-            # a high level correspondence. This means that the blobs were 
-            # merged to the main blob.
-
-            wm_corr = correspondence(main_mask, wm_blob.blob_mask)
-      
-            is_correlated = 0
-#temp            max_discordance = 5
-#temp            if wm_corr > (wm_blob.props.area - max_discordance):
-#temp                is_correlated = 1 
- 
-###############
-##########
-#####
-#            max_discordance = 5
-            if wm_corr > wm_blob.props.area*0.8:
-                is_correlated = 1 
-
-            if '-debug' in sys.argv:
-                print ('Blob {} flags: is_big {} is_noise {} is_out {} '\
-                    'is_correlated {}'.format(wm_blob.blob_num, is_big, \
-                    is_noise, is_out, is_correlated))
-#####
-##########
-############### 
-        
-            # Check if blob supports all constrains
-            #   correct size:       is_big = 0 and is_noise = 0
-            #   correct location:   is_out = 0
-            #   was main blob:      is_correlated = 1
-            if np.all([is_big == 0, is_noise == 0, is_out == 0, is_correlated == 1]):
-                blobs_ty3_wm.append(wm_blob)
-
-###############
-##########
-#####
-#                fig, ax = plt.subplots()
-#                ax.imshow(wm_blob.blob_mask)
-#                ax.set_title('wm candidate accepted')
-#                plt.show()
+        return self.select_blobs_type3(wm_blobs, main_mask, table, \
+            self.rules['type3_wm'])
 
- #           else:
-
- #               fig, ax = plt.subplots()
- #               ax.imshow(wm_blob.blob_mask)
- #               ax.set_title('wm candidate denied')
- #               plt.show()
-
-
-#        print ('blobs_ty3_wm: {}'.format(blobs_ty3_wm))
-#        raw_input()
-#####
-##########
-###############
-
-        return blobs_ty3_wm
-    
-
-    def characterize_blobs_type3_gm(self, gm_blobs, main_mask):
+    def characterize_blobs_type3_gm(self, gm_blobs, main_mask, table=None):
         '''
         Returns in a list the 'Blob' objects of gray matter that match the 
         constraints to be considered as object of type 3. 
@@ -743,6 +1112,7 @@ class Locate_blobs(object):
                 center zone. 
             - having correspondence between its mask and the biggest blob of 
                 the mixed mask, stored in 'main_mask'.
+        The constraints are the rules 'type3_gm_rules' of 'lib.rules_lib'.
 
         Parameters:
                     gm_blobs:        <list>
@@ -750,86 +1120,76 @@ class Locate_blobs(object):
                                     matter.
                     main_mask:       <numpy.ndarray>
                                     2d image array of the main blob of the 
-                                    mixed mask.
+                                    mixed mask, or the mask packed as a 
+                                    <lib.bitvol_lib.Bit_slice>.
+                    table:          <numpy.ndarray>
+                                    Feature table of 'gm_blobs'. By default it
+                                    is built from the blobs.
 
         Returns:
                     blobs_ty3_gm:    <list>
                                     List of objects of class 'Blob' of gray 
                                     matter.
         '''
-        blobs_ty3_gm = []
-        
-        if len(gm_blobs)>0:
-            if '-debug' in sys.argv:
-                print ('Checking WM blobs for type 3 objects. Slice {}'.format(\
-                    gm_blobs[0].slice_number))
+        return self.select_blobs_type3(gm_blobs, main_mask, table, \
+            self.rules['type3_gm'])
 
-        for i, gm_blob in enumerate(gm_blobs):
-    
-            # Check if it is too big
-            is_big = 0
-            if gm_blob.props.area > 3000:
-                is_big = 1
-        
-            # Check if it is too small
-            is_noise = 0
-            if gm_blob.props.area < 15:
-                is_noise = 1
-        
-            # Check if its centroid is in candidate region
-            is_out = 0
-            if (gm_blob.blob_ctrd[0] < 95) or (200 > gm_blob.blob_ctrd[1] > 150):
-                is_out = 1
-    
-            # Check if the blob lies over the original MAIN mixed blob with
-            # a high level correspondence. This means that the blobs were 
-            # merged to the main blob.
-            gm_corr = correspondence(main_mask, gm_blob.blob_mask)
-        
-            is_correlated = 0
-            if gm_corr > gm_blob.props.area*0.8:
-                is_correlated = 1 
-###############
-##########
-#####
-            if '-debug' in sys.argv:
-                print ('Blob {} flags: is_big {} is_noise {} is_out {} '\
-                    'is_correlated {}'.format(gm_blob.blob_num, is_big, \
-                    is_noise, is_out, is_correlated))
-#####
-##########
-############### 
-     
-            # Check if blob supports all constrains
-            #   has hole:           no_hole = 0
-            #   hole is filled:     min_corr > 0
-            #   correct size:       is_big = 0 and is_noise = 0
-            #   correct location:   is_out = 0
-            if np.all([is_big == 0, is_noise == 0, is_out == 0, is_correlated == 1]):
-                blobs_ty3_gm.append(gm_blob)
-###############
-##########
-#####
-#                fig, ax = plt.subplots()
-#                ax.imshow(gm_blob.blob_mask)
-#                ax.set_title('gm candidate accepted')
-#                plt.show()
-#            
-#            else:
-#                fig, ax = plt.subplots()
-#                ax.imshow(gm_blob.blob_mask)
-#                ax.set_title('gm candidate denied')
-#                plt.show()
-#####
-##########
-###############        
+    def select_blobs_type3(self, blobs, main_mask, table, rules):
+        '''
+        Returns the blobs of 'blobs' that satisfy 'rules'. The correspondence
+        of each blob with 'main_mask' is given to the rules as column 
+        'main_overlap'. With '-debug' the result of each rule for every blob is
+        printed.
 
-        return blobs_ty3_gm
+        Parameters:
+                    blobs:          <list>
+                                    List of objects of class 'Blob'.
+                    main_mask:      <numpy.ndarray>
+                                    2d image array of the main blob of the 
+                                    mixed mask, or the mask packed as a 
+                                    <lib.bitvol_lib.Bit_slice>.
+                    table:          <numpy.ndarray>
+                                    Feature table of 'blobs'. Built from the
+                                    blobs if None.
+                    rules:          <lib.rules_lib.Blob_rules>
+                                    Rules of the blobs of type 3 of their 
+                                    matter.
+
+        Returns:
+                    selected_blobs: <list>
+                                    List of objects of class 'Blob'.
+        '''
+        if table is None:
+            table = self.blobs_features(blobs)[0]
+
+        def main_overlap(rows):
+            # Pixels of each blob over the main blob of the mixed mask
+            self.timer.count('overlaps', len(rows))
+            overlap = np.zeros(len(rows), dtype=np.int64)
+            for k, i in enumerate(rows):
+                bbox = blobs[i].blob_bbox
+                if isinstance(main_mask, bvl.Bit_slice):
+                    overlap[k] = main_mask.overlap_crop(blobs[i].blob_crop, \
+                        bbox)
+                else:
+                    overlap[k] = correspondence(main_mask[bbox[0]:bbox[2], \
+                        bbox[1]:bbox[3]], blobs[i].blob_crop)
 
+            return overlap
 
+        providers = {'main_overlap': main_overlap}
+        if '-debug' in sys.argv and len(blobs) > 0:
+            print ('Checking blobs for {} objects. Slice {}'.format(\
+                rules.name, blobs[0].slice_number))
+            results = rules.explain(table, providers)
+            for k, blob in enumerate(blobs):
+                print ('Blob {} flags: {}'.format(blob.blob_num, ', '.join(\
+                    ['{}: {}'.format(text, int(passed[k])) for text, passed \
+                    in results])))
 
+        selected = rules.select(table, providers)
 
-        
+        return [blobs[i] for i in np.flatnonzero(selected)]
 
 def correspondence(matrixA, matrixB):
     '''
@@ -855,6 +1215,223 @@ def correspondence(matrixA, matrixB):
 
     return correspondence
 
+def overlap_matrix(blobs, lbl_image):
+    '''
+    Returns the matrix with the number of pixels of the inner region of each
+    blob of 'blobs' that lie over each label of 'lbl_image'. All the pairs are
+    counted at once with a single bincount over the pixels of the inner regions,
+    so the cost depends on the holes area instead of on the slice size.
+    Inner regions that are not computed yet are found first.
+
+    Parameters:
+                blobs:          <list>
+                                List of objects of class 'Blob'.
+                lbl_image:      <numpy.ndarray>
+                                2d image differently labelled for each blob.
+
+    Returns:
+                overlap:        <numpy.ndarray>
+                                Matrix of shape (len(blobs), max label + 1).
+                                Item [i, l] is the number of pixels of the inner
+                                region of blob i labelled as 'l'. Column 0
+                                stores the pixels over the background.
+    '''
+    n_cols = int(np.max(lbl_image)) + 1 if lbl_image.size > 0 else 1
+    rows = []
+    cols = []
+    owners = []
+    for i, blob in enumerate(blobs):
+        if blob.inner_crop is None:
+            blob.find_inner_region()
+        rr, cc = np.nonzero(blob.inner_crop)
+        rows.append(rr + blob.blob_bbox[0])
+        cols.append(cc + blob.blob_bbox[1])
+        owners.append(np.full(rr.size, i, dtype=np.intp))
+
+    if len(blobs) == 0:
+        return np.zeros((0, n_cols), dtype=np.intp)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    owners = np.concatenate(owners)
+    pairs = owners * n_cols + lbl_image[rows, cols]
+    overlap = np.bincount(pairs, minlength=len(blobs)*n_cols)
+
+    return overlap.reshape(len(blobs), n_cols)
+
+def blobs_label_image(blobs, shape):
+    '''
+    Returns a labelled image of shape 'shape' with the mask of each blob of
+    'blobs' set to its blob number.
+
+    Parameters:
+                blobs:          <list>
+                                List of objects of class 'Blob'.
+                shape:          <tuple>
+                                Output image dimensions.
+
+    Returns:
+                lbl_image:      <numpy.ndarray>
+                                2d image differently labelled for each blob.
+    '''
+    lbl_image = np.zeros(shape, dtype=np.int)
+    for blob in blobs:
+        bbox = blob.blob_bbox
+        lbl_image[bbox[0]:bbox[2], bbox[1]:bbox[3]][blob.blob_crop] = blob.blob_num
+
+    return lbl_image
+
+def main_blob_window(image_wm, image_gm, margin):
+    '''
+    Returns the window of the bounding box of the biggest blob of the mask 
+    mixing 'image_wm' and 'image_gm', enlarged by 'margin' pixels at each 
+    side and clipped to the slice.
+
+    Parameters:
+                image_wm:       <numpy.ndarray>
+                                2d image of white matter.
+                image_gm:       <numpy.ndarray>
+                                2d image of gray matter.
+                margin:         <int>
+                                Pixels added at each side of the bounding box.
+
+    Returns:
+                window:         <tuple>
+                                Pair of slices of rows and columns, or None if
+                                both images are empty.
+    '''
+    mix_labels = msr.label((image_gm > 0) | (image_wm > 0))
+    main_label = main_blob_label(mix_labels)
+    if main_label is None:
+        return None
+
+    return blob_window(mix_labels, main_label, margin)
+
+def main_blob_label(lbl_image):
+    '''
+    Returns the label of the biggest blob of 'lbl_image', the first one if 
+    several have the same area, or None if there is no blob.
+    '''
+    areas = np.bincount(lbl_image.ravel())
+    if areas.size < 2:
+        return None
+
+    return int(np.argmax(areas[1:])) + 1
+
+def blob_window(lbl_image, label, margin):
+    '''
+    Returns the window of the bounding box of the blob 'label' of 
+    'lbl_image', enlarged by 'margin' pixels at each side and clipped to the
+    image.
+
+    Parameters:
+                lbl_image:      <numpy.ndarray>
+                                Labelled 2d image.
+                label:          <int>
+                                Label of the blob.
+                margin:         <int>
+                                Pixels added at each side of the bounding box.
+
+    Returns:
+                window:         <tuple>
+                                Pair of slices of rows and columns.
+    '''
+    rows, cols = ndi.find_objects(lbl_image, label)[label - 1]
+
+    return (slice(max(rows.start - margin, 0), min(rows.stop + margin, \
+        lbl_image.shape[0])), slice(max(cols.start - margin, 0), \
+        min(cols.stop + margin, lbl_image.shape[1])))
+
+def paste_window(image, window, frame_shape):
+    '''
+    Returns an image of 'frame_shape', whose last two axes are the ones of a 
+    slice, with 'image' placed at 'window' and zeros elsewhere.
+
+    Parameters:
+                image:          <numpy.ndarray>
+                                Image of the window.
+                window:         <tuple>
+                                Pair of slices of rows and columns.
+                frame_shape:    <tuple>
+                                Shape of the output image.
+
+    Returns:
+                framed:         <numpy.ndarray>
+                                Image with the dtype of 'image'.
+    '''
+    framed = np.zeros(frame_shape, dtype=image.dtype)
+    framed[(Ellipsis,) + window] = image
+
+    return framed
+
+def stack_windows(images, windows, padding=0):
+    '''
+    Returns the stack of the 'windows' of the 2d 'images', each one placed at
+    the top left corner of a slice of the shape of the largest window plus 
+    'padding' pixels. The rest of each slice is the window reflected, as
+    'morph_lib' reflects the borders of an image.
+
+    Parameters:
+                images:         <list>
+                                2d images.
+                windows:        <list>
+                                Pair of slices of rows and columns of each 
+                                image.
+                padding:        <int>
+                                Pixels added after the largest window.
+
+    Returns:
+                stack:          <numpy.ndarray>
+                                3d image with the slices along the first axis.
+    '''
+    crops = [image[window] for image, window in zip(images, windows)]
+    rows = max([crop.shape[0] for crop in crops]) + padding
+    cols = max([crop.shape[1] for crop in crops]) + padding
+
+    return np.stack([np.pad(crop, ((0, rows - crop.shape[0]), (0, cols - \
+        crop.shape[1])), mode='symmetric') for crop in crops])
+
+def reflect_windows(stack, shapes):
+    '''
+    Returns 'stack', built by 'stack_windows', with the pixels out of the 
+    window of each slice replaced by the window reflected, so a morphology
+    operation over the stack gives in each window the same result as over 
+    the window alone. Updates 'stack' in place.
+
+    Parameters:
+                stack:          <numpy.ndarray>
+                                3d image with the slices along the first axis.
+                shapes:         <list>
+                                Shape of the window of each slice.
+
+    Returns:
+                stack:          <numpy.ndarray>
+    '''
+    for k, (rows, cols) in enumerate(shapes):
+        if (rows, cols) != stack.shape[1:]:
+            stack[k] = np.pad(stack[k, :rows, :cols], ((0, stack.shape[1] - \
+                rows), (0, stack.shape[2] - cols)), mode='symmetric')
+
+    return stack
+
+def slice_structure(struct_elem):
+    '''
+    Returns the 3d structure that connects the pixels of each slice of a stack
+    of slices as the 2d 'struct_elem' and no pixels of different slices.
+
+    Parameters:
+                struct_elem:    <numpy.ndarray>
+                                2d structure of shape (3, 3).
+
+    Returns:
+                structure:      <numpy.ndarray>
+                                Structure of shape (3, 3, 3).
+    '''
+    structure = np.zeros((3,) + struct_elem.shape, dtype=struct_elem.dtype)
+    structure[1] = struct_elem
+
+    return structure
+
 def thres_per_percent(image, percentage):
     '''
     Returns the real value of the 'percentage' of the 'image' range values.
@@ -878,85 +1455,139 @@ def thres_per_percent(image, percentage):
 
     return threshold
 
-def ignore_small_seeds(seeds_mask):
+def ignore_small_seeds(seeds_mask, min_area=5):
     '''
-    Returns a labelled image .
+    Returns a labelled image equal to 'seeds_mask' with the small regions
+    discarded. The areas of all the regions are counted at once and the image
+    is relabelled through a single lookup table.
 
     Parameters:
                 seeds_mask:           <numpy.ndarray>
                                 Labelled 2d image.
+                min_area:             <int>
+                                Regions with this area or less are discarded.
 
     Returns:
                 new_seeds_mask:           <numpy.ndarray>
                                 Labelled 2d image of the same shape as input one
                                 with small blobs discarded.
     '''
+    seeds_mask = seeds_mask.astype(np.intp)
     # They are discarded the small seeds regions
-    seeds_props = msr.regionprops(seeds_mask)
-    choosen_seeds = []
-    for prop in seeds_props:
-        if prop.area > 5:
-            choosen_seeds.append(prop)
+    areas = np.bincount(seeds_mask.ravel())
+    lookup = np.arange(areas.size)
+    lookup[areas <= min_area] = 0
+    lookup[0] = 0
     # Generate new seeds mask with the choosen regions
-    new_seeds_mask = np.zeros(seeds_mask.shape)
-    for seed in choosen_seeds:
-        new_seeds_mask[seeds_mask==seed.label]=seed.label
+    new_seeds_mask = lookup[seeds_mask]
 
     return new_seeds_mask
 
-def merge_neigh_seeds(seeds_mask):
+def merge_neigh_seeds(seeds_mask, max_distance=15):
     '''
     Returns a labelled image equal to 'seeds_mask' with the regions that are 
     close set as the same label and with a line of the same label merging their
     centroids.
+    The nearest neighbour of each region is found with a KD-tree over the 
+    centroids. The close pairs are joined with a union-find table, whose 
+    representative is the lowest label of each group, and the image is 
+    relabelled through a single lookup table.
 
     Parameters:
                 seeds_mask:     <numpy.ndarray>
                                 Labelled 2d image.
+                max_distance:   <float>
+                                Regions whose centroids are closer than this
+                                distance are merged.
     Returns:
                 merged_seeds:   <numpy.ndarray>
                                 Labelled 2d image of the same shape as input one
                                 with close blobs merged. 
     '''
-    #They are merged close regions.
-    min_distance = 10000
-    seeds_props = msr.regionprops(seeds_mask.astype(np.int))
-
-    pairs = []
-    nearest_neigh = None
-    for i, prop_i in enumerate(seeds_props):
-        for j, prop_j in enumerate(seeds_props):
-            if i!=j:
-                blobs_distance = spt.distance.euclidean(prop_i.centroid, \
-                    prop_j.centroid)
-                if blobs_distance < min_distance:
-                    min_distance = blobs_distance
-                    nearest_neigh = prop_j
-        if nearest_neigh is not None:
-            pair = [prop_i, nearest_neigh]
-            pairs.append(pair)
-        else:
-            pair = []
-        
-        min_distance = 10000
+    seeds_mask = seeds_mask.astype(np.intp)
+    labels = np.unique(seeds_mask)
+    labels = labels[labels > 0]
+    if labels.size < 2:
+        return np.copy(seeds_mask)
 
-    merge_this = []
-    for pair in pairs:
-        pair_distance = spt.distance.euclidean(pair[0].centroid, pair[1].centroid)
-        if pair_distance < 15:
-            merge_this.append(pair)
-    
-    merged_seeds = np.copy(seeds_mask)
-    # For each pair the second member takes the label of the first one and it 
-    # is drawn a line of the same label between them
-    for seeds_pair in merge_this:
-        # Relabel second member of pair 
-        merged_seeds[seeds_mask==seeds_pair[1].label] = seeds_pair[0].label
-
-        # Draw a line between blobs
-        c0_x, c0_y = np.array(seeds_pair[0].centroid).astype(np.int)
-        c1_x, c1_y = np.array(seeds_pair[1].centroid).astype(np.int)
+    #They are merged close regions.
+    centroids = np.array(ndi.center_of_mass(seeds_mask > 0, seeds_mask, labels))
+    tree = spt.cKDTree(centroids)
+    distances, neighbours = tree.query(centroids, k=2)
+    # The region itself is the first result unless another region shares its
+    # centroid.
+    own = np.arange(labels.size)
+    nearest = np.where(neighbours[:,0] == own, neighbours[:,1], neighbours[:,0])
+    nearest_distance = np.where(neighbours[:,0] == own, distances[:,1], \
+        distances[:,0])
+    close = np.nonzero(nearest_distance < max_distance)[0]
+
+    parents = list(range(labels.size))
+    for i in close:
+        join_roots(parents, i, nearest[i])
+
+    lookup = np.zeros(labels[-1] + 1, dtype=np.intp)
+    roots = [find_root(parents, i) for i in range(labels.size)]
+    lookup[labels] = labels[roots]
+    merged_seeds = lookup[seeds_mask]
+
+    # For each close pair it is drawn a line of the label of its group between
+    # their centroids
+    for i in close:
+        c0_x, c0_y = centroids[i].astype(np.int)
+        c1_x, c1_y = centroids[nearest[i]].astype(np.int)
         rr,cc = draw.line(c0_x, c0_y, c1_x, c1_y)
-        merged_seeds[rr,cc] = seeds_pair[0].label
+        merged_seeds[rr,cc] = lookup[labels[i]]
 
     return merged_seeds
+
+def find_root(parents, node):
+    '''
+    Returns the representative of the group of 'node' in the union-find table
+    'parents', compressing the visited path.
+
+    Parameters:
+                parents:        <list>
+                                Union-find table. Each item is the parent of
+                                the node of such position.
+                node:           <int>
+                                Node whose representative is looked for.
+
+    Returns:
+                root:           <int>
+                                Representative of the group of 'node'.
+    '''
+    root = node
+    while parents[root] != root:
+        root = parents[root]
+    while parents[node] != root:
+        parents[node], node = root, parents[node]
+
+    return root
+
+def join_roots(parents, node_a, node_b):
+    '''
+    Joins the groups of 'node_a' and 'node_b' in the union-find table 
+    'parents'. The lowest representative is kept as representative of the
+    joined group.
+
+    Parameters:
+                parents:        <list>
+                                Union-find table. Each item is the parent of
+                                the node of such position.
+                node_a:         <int>
+                                Node of the first group.
+                node_b:         <int>
+                                Node of the second group.
+
+    Returns:
+                root:           <int>
+                                Representative of the joined group.
+    '''
+    root_a = find_root(parents, node_a)
+    root_b = find_root(parents, node_b)
+    root = min(root_a, root_b)
+    parents[root_a] = root
+    parents[root_b] = root
+
+    return root
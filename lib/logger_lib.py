@@ -1,28 +1,205 @@
+import threading
+import atexit
 import time
+import sys
+try:
+    import Queue as queue               # Python 2
+except ImportError:
+    import queue
+
+# Levels ordered by severity
+log_levels = {'log': 0, 'warn': 1, 'error': 2, 'critical': 3}
 
 class Logger(object):
-    
-    def __init__(self, logger_file):
+    '''
+    Writes the log messages to 'logger_file' from a background thread. Messages
+    are queued by 'write_log' and written in batches, keeping the file open,
+    so logging does not wait on the disk. Messages of levels under 'level' are
+    discarded before being queued. If the file cannot be written, the error
+    is kept in 'error' and later messages are discarded.
+    '''
+
+    def __init__(self, logger_file, level='log', batch=1024):
         self.logger_file = logger_file
-        with open(self.logger_file,"w") as container:
-            hour = time.strftime("%H:%M:%S")
-            date = time.strftime("%d/%m/%Y")
-            message = date+"-"+hour+"[log]<<Log start>>\n"
-            container.write(message)
+        self.min_level = log_levels[level]
+        self.batch = batch
+        self.closed = False
+        self.error = None
+        # Timestamp of the last second a message was written in
+        self.stamp_second = None
+        self.stamp = ''
+        self.records = queue.Queue()
+        self.container = open(self.logger_file,"w")
+        self.container.write(self.timestamp(time.time())+"[log]<<Log start>>\n")
+
+        self.writer = threading.Thread(target=self.write_records)
+        self.writer.daemon = True
+        self.writer.start()
+        # The exit of the program does not wait forever on a stuck disk
+        atexit.register(self.close, 10)
+
+    def enabled(self, level):
+        '''
+        Returns whether messages of 'level' are written. Unknown levels are
+        always written.
 
+        Parameters:
+                    level:          <str>
+                                    'log', 'warn', 'error' or 'critical'.
 
+        Returns:
+                    enabled:        <bool>
+        '''
+        return log_levels.get(level, 3) >= self.min_level
 
     def write_log(self, level, message):
-        with open(self.logger_file,"a") as container:
-            hour = time.strftime("%H:%M:%S")
-            date = time.strftime("%d/%m/%Y")
+        if log_levels.get(level, 3) < self.min_level or self.closed or \
+                self.error is not None:
+            return
+
+        self.records.put((time.time(), level, message))
+
+    def write_ctx(self, level, heading, method, message):
+        '''
+        Writes 'message' preceded by the heading of the class and the name of
+        the method it comes from. Nothing is built when 'level' is disabled,
+        and the line is put together by the writer thread.
+
+        Parameters:
+                    level:          <str>
+                                    'log', 'warn', 'error' or 'critical'.
+                    heading:        <str>
+                                    File and class heading, as the class
+                                    attribute 'log_class_heading'.
+                    method:         <str>
+                                    Name of the method.
+                    message:        <str>
+                                    Message to write.
+        '''
+        if log_levels.get(level, 3) < self.min_level or self.closed or \
+                self.error is not None:
+            return
+
+        self.records.put((time.time(), level, (heading, method, message)))
+
+    def timestamp(self, seconds):
+        '''
+        Returns the date and hour of 'seconds', formatted once per second.
+        '''
+        second = int(seconds)
+        if second != self.stamp_second:
+            local = time.localtime(second)
+            hour = time.strftime("%H:%M:%S", local)
+            date = time.strftime("%d/%m/%Y", local)
+            self.stamp = date+"-"+hour
+            self.stamp_second = second
+
+        return self.stamp
+
+    def write_records(self):
+        '''
+        Body of the writer thread. Waits for a record and writes it together
+        with the ones queued meanwhile, up to 'batch' of them. A None record
+        stops the thread and an event record is set once the previous ones are
+        written. After an error writing the file the thread keeps taking the
+        records, discarding the messages and setting the events.
+        '''
+        running = True
+        while running:
+            records = [self.records.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            running = None not in records
+            events = [record for record in records if record is not None and \
+                not isinstance(record, tuple)]
+            try:
+                if self.error is None:
+                    lines = []
+                    for record in records:
+                        if isinstance(record, tuple):
+                            seconds, level, message = record
+                            if isinstance(message, tuple):
+                                message = message[0]+" Method: "+message[1]+\
+                                    " ::: "+message[2]
+                            lines.append(self.timestamp(seconds)+"["+level+\
+                                "]<<"+message+">>\n")
+                    self.container.write(''.join(lines))
+                    if events or not running:
+                        self.container.flush()
+            except Exception as error:
+                self.error = error
+                sys.stderr.write('Log file {} could not be written: {}\n'\
+                    .format(self.logger_file, error))
+            for event in events:
+                event.set()
+
+    def flush(self, timeout=None):
+        '''
+        Waits until every message queued so far is written to the file, or
+        discarded after an error. Returns earlier if the writer thread is not 
+        running.
 
-            message = date+"-"+hour+"["+level+"]<<"+message+">>\n"
-            container.write(message)
+        Parameters:
+                    timeout:        <float>
+                                    Maximum seconds to wait. No limit if None.
+        '''
+        if self.closed or not self.writer.is_alive():
+            return
+
+        event = threading.Event()
+        self.records.put(event)
+        start = time.time()
+        while not event.wait(0.1) and self.writer.is_alive():
+            if timeout is not None and time.time() - start > timeout:
+                break
+
+    def close(self, timeout=None):
+        '''
+        Writes the queued messages, stops the writer thread and closes the
+        file. Later messages are discarded.
+
+        Parameters:
+                    timeout:        <float>
+                                    Maximum seconds to wait for the writer 
+                                    thread. No limit if None.
+        '''
+        if self.closed:
+            return
+
+        self.closed = True
+        self.records.put(None)
+        self.writer.join(timeout)
+        if not self.writer.is_alive():
+            self.container.close()
+
+class NullLogger(object):
+    '''
+    Logger that discards every message. Used where no log file is shared, as
+    in worker processes.
+    '''
+
+    def enabled(self, level):
+        return False
+
+    def write_log(self, level, message):
+        pass
+
+    def write_ctx(self, level, heading, method, message):
+        pass
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
 
 # CUANDO CIERRO EL ARCHIVO, DONDE SE QUEDA EL CURSOR
 # log
 # warn
 # error
-# (opcional) critical 
-        
+# (opcional) critical
+
@@ -1,25 +1,30 @@
-from inspect import stack                   # To write log
 import input_process_lib as inp
+import label3d_lib as lb3
+import bitvol_lib as bvl
+import cache_lib as cch
+import numpy as np
 
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class Matter(object):
+    log_class_heading = log_file_heading+"Class: Matter"
     file_MRI_name = ''
     file_MRI_path = ''
     sitk_img = None
     npa_img = None
+    header = None
+    thres_value = None
     img3d = None
+    cache = None
+    volume_key = None
     name = ''
     slices_obj_list = []
     
     def __init__(self, log, filepath, filename, stct):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
         self.file_MRI_name = filename
         self.file_MRI_path = filepath
@@ -51,7 +56,88 @@ class Matter(object):
         if f_name is None:
             f_name = self.file_MRI_name
 
-        self.sitk_img = self.in_proc.read_input(f_path, f_name)
+        with self.stct.timer.stage('read_input'):
+            self.sitk_img = self.in_proc.read_input(f_path, f_name)
+
+    def map_file(self, f_path=None, f_name=None):
+        '''
+        Stores as attributes the header of the 3D (f.hdr+f.img) file pointed by
+        the inputs and its voxels mapped from disk, well-oriented as 
+        'preprocess' does. Only the header is read, voxels are paged in when 
+        they are accessed. Replaces 'read_file' and 'preprocess'.
+        By default takes self object attributes.
+
+        Parameters:
+                    f_path:         <str>
+                                    Path to 3D files directory.
+                                    /path/to/directory/
+                    f_name:         <str>
+                                    Name of 3D file.
+                                    'filename.extension'
+
+        Updates object atributes:
+                    header:         <dict>
+                                    Header fields of the file.
+                    npa_img:        <numpy.memmap>
+                                    3-dimensional array of the image, 
+                                    well-oriented and not normalized.
+        '''
+        if f_path is None:
+            f_path = self.file_MRI_path
+        if f_name is None:
+            f_name = self.file_MRI_name
+
+        with self.stct.timer.stage('map_input'):
+            self.header = self.in_proc.read_header(f_path, f_name)
+            self.npa_img = self.in_proc.map_input(self.header)
+
+    def set_cache(self, cache):
+        '''
+        Stores as an attribute the cache where the results of the stages are
+        kept between runs.
+
+        Parameters:
+                    cache:          <lib.cache_lib.Stage_cache>
+                                    Cache of the stages. None to disable it.
+
+        Updates object atributes:
+                    cache:          <lib.cache_lib.Stage_cache>
+                                    Cache of the stages.
+        '''
+        self.cache = cache
+
+    def input_key(self, f_path=None, f_name=None):
+        '''
+        Returns the key of the content of the input files of the matter, the
+        header and the voxels file. Files that are not Analyze or NIfTI-1 
+        headers, as compressed '.nii.gz' files, are hashed alone, as the single
+        file SimpleITK reads.
+        By default takes self object attributes.
+
+        Parameters:
+                    f_path:         <str>
+                                    Path to 3D files directory.
+                    f_name:         <str>
+                                    Name of 3D file.
+
+        Returns:
+                    key:            <str>
+                                    Key given by 'Stage_cache.file_key'.
+        '''
+        if f_path is None:
+            f_path = self.file_MRI_path
+        if f_name is None:
+            f_name = self.file_MRI_name
+
+        paths = [f_path+f_name]
+        try:
+            header = self.in_proc.read_header(f_path, f_name)
+        except ValueError:
+            return self.cache.file_key(paths)
+        if header['img_file'] != paths[0]:
+            paths.append(header['img_file'])
+
+        return self.cache.file_key(paths)
 
     def preprocess(self, original=None):
         '''
@@ -72,10 +158,12 @@ class Matter(object):
         if original is None:
             original = self.sitk_img
 
-        self.npa_img = self.in_proc.preprocess_serie(original)
+        with self.stct.timer.stage('preprocess_serie'):
+            self.npa_img = self.in_proc.preprocess_serie(original)
+        self.stct.timer.count_bytes(self.npa_img)
 
 
-    def binarize(self, to_binary=None, threshold=80):
+    def binarize(self, to_binary=None, threshold=80, packed=False):
         '''
         Stores as an attribute the result of performing thresholding over the 
         'to_binary' input 3-d image. Get the mask of the values over the 
@@ -88,10 +176,13 @@ class Matter(object):
                     threshold:      <int>
                                     percent value over which pixels are going 
                                     to be selected.
+                    packed:         <bool>
+                                    Store the mask packed 8 voxels per byte.
 
         Updates object atributes:
                     img3d:           <numpy.ndarray>
-                                    3d array image binarized. 
+                                    3d array image binarized. A
+                                    'lib.bitvol_lib.Bit_volume' if 'packed'.
         '''
         if to_binary is None:
             to_binary = self.npa_img
@@ -99,7 +190,76 @@ class Matter(object):
         if self.name == 'I3T':
             self.img3d = to_binary
         else:
-            self.img3d = self.in_proc.binarize_serie(to_binary, threshold)
+            with self.stct.timer.stage('binarize_serie'):
+                self.img3d = self.in_proc.binarize_serie(to_binary, threshold)
+                if packed:
+                    self.img3d = bvl.Bit_volume(self.log, self.img3d)
+            self.stct.timer.count_bytes(self.img3d)
+
+    def preprocess_binarize(self, original=None, threshold=80, packed=False):
+        '''
+        Stores as attributes the result of 'preprocess' followed by 'binarize'
+        computed in a fused stage. The image values are kept as a well-oriented
+        view, not normalized, and only the output image is allocated: the
+        normalized image for matter 'I3T' and the binarized one for the rest.
+        With a cache set, the result of a previous run over the same file is
+        loaded instead, and the file is only read when there is none.
+        By default takes self object attributes.
+
+        Parameters:
+                    original:       <SimpleITK.SimpleITK.Image>
+                                    3-dimensional image. Mapped images from
+                                    'map_file' are also accepted.
+                    threshold:      <int>
+                                    percent value over which pixels are going 
+                                    to be selected.
+                    packed:         <bool>
+                                    Store the mask packed 8 voxels per byte.
+
+        Updates object atributes:
+                    npa_img:        <numpy.ndarray>
+                                    3-dimensional view of the image, 
+                                    well-oriented and not normalized.
+                    img3d:          <numpy.ndarray>
+                                    3d array image binarized, or normalized for
+                                    matter 'I3T'. A 'lib.bitvol_lib.Bit_volume'
+                                    if 'packed'.
+        '''
+        if self.cache is not None:
+            self.volume_key = self.cache.stage_key('volume', self.input_key(), \
+                {'threshold': threshold, 'packed': packed, \
+                'normalize': self.name == 'I3T'})
+            arrays = self.cache.load(self.volume_key)
+            if arrays is not None:
+                if 'bits' in arrays:
+                    self.img3d = bvl.Bit_volume(self.log, bits=arrays['bits'], \
+                        shape=arrays['shape'])
+                else:
+                    self.img3d = arrays['img3d']
+                self.stct.timer.count('cache_hits')
+                return
+
+        if original is None:
+            original = self.sitk_img
+            if original is None:
+                original = self.npa_img
+            if original is None:
+                self.read_file()
+                original = self.sitk_img
+
+        with self.stct.timer.stage('preprocess_binarize'):
+            self.npa_img, self.img3d = self.in_proc.preprocess_binarize_serie(\
+                original, threshold, normalize=self.name == 'I3T')
+            if packed and self.name != 'I3T':
+                self.img3d = bvl.Bit_volume(self.log, self.img3d)
+        self.stct.timer.count_bytes(self.img3d)
+
+        if self.cache is not None:
+            if isinstance(self.img3d, bvl.Bit_volume):
+                self.cache.store(self.volume_key, {'bits': self.img3d.bits, \
+                    'shape': np.array(self.img3d.shape)})
+            else:
+                self.cache.store(self.volume_key, {'img3d': self.img3d})
 
     def make_slice_objs(self, img3d=None, matt_name=None):
         '''
@@ -122,5 +282,234 @@ class Matter(object):
         if matt_name is None:
             matt_name = self.name
 
-        self.slices_obj_list = self.stct.create_slice_objs(img3d, matt_name)
+        with self.stct.timer.stage('make_slice_objs'):
+            self.slices_obj_list = self.stct.create_slice_objs(img3d, matt_name)
+
+    def find_labels_3d(self, slice_objs=None, z_connectivity=1):
+        '''
+        Labels the blobs of every slice streaming through the volume, as 
+        'Slice.find_slice_labels' does, and relates them to the 3d connected
+        component they belong to. The labels of every slice are kept in its
+        object; 'MRI_inspect.iter_imobj_slices' with 'labels3d' keeps only one
+        slice at a time.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_objs:     <list>
+                                    List of objects of class 'Slice', ordered
+                                    by slice number.
+                    z_connectivity: <int>
+                                    1 to connect pixels at the same position of
+                                    consecutive slices, 2 to also connect their
+                                    diagonal neighbours.
+
+        Updates object atributes of each slice:
+                    slc_lbl:        <numpy.ndarray>
+                                    Array differently labelled for each blob.
+                    lbls_num:       <int>
+                                    Number of different blobs found.
+                    lbls_3d:        <numpy.ndarray>
+                                    3d component id of each label. Item 0 is
+                                    the background.
+        '''
+        if slice_objs is None:
+            slice_objs = self.slices_obj_list
+
+        stream = lb3.Labels_3d_stream(self.log, z_connectivity)
+        for slice_obj in slice_objs:
+            slice_obj.find_slice_labels_3d(stream)
+
+        lookup = stream.global_ids()
+        for slice_obj in slice_objs:
+            slice_obj.lbls_3d = lookup[slice_obj.lbls_3d]
+
+    def feature_table(self, slice_objs=None):
+        '''
+        Returns the feature table of all the blobs of the volume, one row per
+        blob ordered by slice and label, and the store of their masks. Blobs 
+        can then be filtered with masks over its columns, i.e. 
+        'table[table['area'] > 15]'.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_objs:     <list>
+                                    List of objects of class 'Slice' with their
+                                    blobs made.
+
+        Returns:
+                    table:          <numpy.ndarray>
+                                    Structured array of 
+                                    'lib.locate_blobs.blob_feature_dtype'.
+                    mask_store:     <numpy.ndarray>
+                                    Boolean array with the masks of the blobs,
+                                    pointed by column 'mask_offset'.
+        '''
+        if slice_objs is None:
+            slice_objs = self.slices_obj_list
+
+        tables = []
+        stores = []
+        offset = 0
+        for slice_obj in slice_objs:
+            if slice_obj.blob_features is None:
+                continue
+            table = slice_obj.blob_features.copy()
+            table['mask_offset'] += offset
+            offset += slice_obj.mask_store.size
+            tables.append(table)
+            stores.append(slice_obj.mask_store)
+        if not tables:
+            return self.stct.loc.blobs_features([])
+
+        return np.concatenate(tables), np.concatenate(stores)
+
+    def blobs_key(self, labels3d=False, z_connectivity=1):
+        '''
+        Returns the key of the labels and blob tables of the slices, computed
+        from the key of the volume they are found in.
+
+        Parameters:
+                    labels3d:       <bool>
+                                    Slices are labelled with 'find_labels_3d'.
+                    z_connectivity: <int>
+                                    Connectivity between slices of
+                                    'find_labels_3d'.
+
+        Returns:
+                    key:            <str>
+                                    Key given by 'Stage_cache.stage_key'.
+        '''
+        # Blobs are stored as feature tables
+        params = {'connectivity': 2, 'labels3d': labels3d, 'layout': 'table'}
+        if labels3d:
+            params['z_connectivity'] = z_connectivity
+
+        return self.cache.stage_key('blobs', self.volume_key, params)
+
+    def load_blobs(self, slice_objs=None, labels3d=False, z_connectivity=1):
+        '''
+        Sets the labels and the blob objects of every slice from the cache, as 
+        left by 'store_blobs' in a previous run. Labelled slices are memory
+        mapped.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_objs:     <list>
+                                    List of objects of class 'Slice', ordered
+                                    by slice number.
+                    labels3d:       <bool>
+                                    Slices are labelled with 'find_labels_3d'.
+                    z_connectivity: <int>
+                                    Connectivity between slices of
+                                    'find_labels_3d'.
+
+        Returns:
+                    loaded:         <bool>
+                                    True if the cache had them.
+
+        Updates object atributes of each slice:
+                    slc_lbl, lbls_num, lbls_3d and blobs_obj_list.
+        '''
+        if slice_objs is None:
+            slice_objs = self.slices_obj_list
+        if self.cache is None or self.volume_key is None:
+            return False
+
+        arrays = self.cache.load(self.blobs_key(labels3d, z_connectivity))
+        if arrays is None:
+            return False
+
+        self.stct.timer.count('cache_hits')
+        tables = cch.unpack_blob_tables(arrays, len(slice_objs))
+        for i, slice_obj in enumerate(slice_objs):
+            slice_obj.slc_lbl = arrays['labels'][i]
+            slice_obj.lbls_num = int(arrays['labels_num'][i])
+            if labels3d:
+                first, last = arrays['ids_offsets'][i:i+2]
+                slice_obj.lbls_3d = np.asarray(arrays['ids_3d'][first:last])
+            slice_obj.make_blob_objs(features=tables[i])
+
+        return True
+
+    def store_blobs(self, slice_objs=None, labels3d=False, z_connectivity=1):
+        '''
+        Stores in the cache the labels and the blob tables of every slice, to
+        be loaded by 'load_blobs'. Does nothing without a cache.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_objs:     <list>
+                                    List of objects of class 'Slice', ordered
+                                    by slice number.
+                    labels3d:       <bool>
+                                    Slices are labelled with 'find_labels_3d'.
+                    z_connectivity: <int>
+                                    Connectivity between slices of
+                                    'find_labels_3d'.
+        '''
+        if slice_objs is None:
+            slice_objs = self.slices_obj_list
+        if self.cache is None or self.volume_key is None or not slice_objs:
+            return
+
+        table, mask_store = self.feature_table(slice_objs)
+        arrays = cch.pack_blob_tables(table, mask_store, [len(\
+            slice_obj.blob_features) for slice_obj in slice_objs])
+        arrays['labels'] = np.stack([slice_obj.slc_lbl for slice_obj in \
+            slice_objs]).astype(np.int32)
+        arrays['labels_num'] = np.array([slice_obj.lbls_num for slice_obj in \
+            slice_objs], dtype=np.int32)
+        if labels3d:
+            ids = [slice_obj.lbls_3d for slice_obj in slice_objs]
+            arrays['ids_3d'] = np.concatenate(ids)
+            arrays['ids_offsets'] = np.cumsum([0]+[len(i) for i in ids])
+        self.cache.store(self.blobs_key(labels3d, z_connectivity), arrays)
+
+    def find_threshold(self, to_binary=None, threshold=80):
+        '''
+        Stores as an attribute the value over which 'binarize' selects the 
+        pixels, so slices can be binarized one at a time with 
+        'binarize_slice'.
+        By default takes self object attributes.
+
+        Parameters:
+                    to_binary:      <numpy.ndarray>
+                                    3d array image to be binarized.
+                    threshold:      <int>
+                                    percent value over which pixels are going 
+                                    to be selected.
+
+        Updates object atributes:
+                    thres_value:    <numpy.float64>
+                                    Value over which pixels are selected.
+        '''
+        if to_binary is None:
+            to_binary = self.npa_img
+
+        if self.name != 'I3T':
+            self.thres_value = self.in_proc.serie_threshold(to_binary, threshold)
+
+    def binarize_slice(self, slice_number, to_binary=None):
+        '''
+        Returns the slice 'slice_number' binarized as 'binarize' does over the
+        whole 3d image. 'find_threshold' must be called before.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_number:   <int>
+                                    Number of the slice.
+                    to_binary:      <numpy.ndarray>
+                                    3d array image to be binarized.
+
+        Returns:
+                    slice_2d:       <numpy.ndarray>
+                                    2d array of the slice binarized, or the 
+                                    slice itself for matter 'I3T'.
+        '''
+        if to_binary is None:
+            to_binary = self.npa_img
+
+        if self.name == 'I3T':
+            return to_binary[..., slice_number]
 
+        return to_binary[..., slice_number] > self.thres_value
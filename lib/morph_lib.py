@@ -0,0 +1,186 @@
+from collections import namedtuple
+import numpy as np
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# Line of 'length' pixels of a structure element along 'axis' (0 for a column,
+# 1 for a row), starting at its pixel ('row', 'col').
+Segment = namedtuple('Segment', ['row', 'col', 'axis', 'length'])
+
+# Segments of the structure elements already decomposed, by their bytes
+segments_cache = {}
+
+def line_segments(struct_elem):
+    '''
+    Returns line segments whose union is 'struct_elem'. Segments are taken
+    greedily among the rows and columns of the element, the one covering the
+    most pixels not covered yet first, so sparse elements made of lines
+    need few of them.
+
+    Parameters:
+                struct_elem:    <numpy.ndarray>
+                                2d structure element.
+
+    Returns:
+                segments:       <list>
+                                List of 'Segment'.
+    '''
+    elem = np.asarray(struct_elem) != 0
+    key = (elem.shape, elem.tobytes())
+    if key in segments_cache:
+        return segments_cache[key]
+
+    # Maximal runs of each row and each column
+    runs = []
+    for axis in (1, 0):
+        lines = elem if axis == 1 else elem.T
+        for i, line in enumerate(lines):
+            edges = np.diff(np.concatenate([[0], line.astype(np.int8), [0]]))
+            for start, stop in zip(np.flatnonzero(edges == 1), \
+                    np.flatnonzero(edges == -1)):
+                if axis == 1:
+                    runs.append(Segment(i, start, axis, stop - start))
+                else:
+                    runs.append(Segment(start, i, axis, stop - start))
+
+    covered = np.zeros(elem.shape, dtype=np.bool_)
+    segments = []
+    while not np.all(covered[elem]):
+        gains = [np.sum(~covered[segment_pixels(run)]) for run in runs]
+        best = runs[int(np.argmax(gains))]
+        covered[segment_pixels(best)] = True
+        segments.append(best)
+
+    segments_cache[key] = segments
+
+    return segments
+
+def segment_pixels(segment):
+    '''
+    Returns the index of the pixels of 'segment' in its structure element.
+    '''
+    if segment.axis == 1:
+        return (segment.row, slice(segment.col, segment.col + segment.length))
+
+    return (slice(segment.row, segment.row + segment.length), segment.col)
+
+def running_window(image, length, axis, reduce_func):
+    '''
+    Returns the reduction with 'reduce_func' of each window of 'length' pixels
+    along 'axis' of 'image'. The windows are built by doubling, reducing the
+    image with itself shifted 1, 2, 4... pixels, so it takes about log2 of
+    'length' passes.
+
+    Parameters:
+                image:          <numpy.ndarray>
+                                Boolean image.
+                length:         <int>
+                                Length of the windows.
+                axis:           <int>
+                                Axis of the windows.
+                reduce_func:    <numpy.ufunc>
+                                'np.logical_and' or 'np.logical_or'.
+
+    Returns:
+                windows:        <numpy.ndarray>
+                                Item i along 'axis' is the reduction of the
+                                items i to i+length-1 of 'image'. The axis is
+                                'length'-1 items shorter.
+    '''
+    def shifted(array, first, last):
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(first, last)
+        return array[tuple(index)]
+
+    windows = image
+    span = 1
+    while span * 2 <= length:
+        size = windows.shape[axis]
+        windows = reduce_func(shifted(windows, 0, size - span), \
+            shifted(windows, span, size))
+        span *= 2
+    if span < length:
+        shift = length - span
+        size = windows.shape[axis]
+        windows = reduce_func(shifted(windows, 0, size - shift), \
+            shifted(windows, shift, size))
+
+    return windows
+
+def binary_morphology(image, struct_elem, reduce_func, center=None):
+    '''
+    Returns the reduction with 'reduce_func' of 'image' over the pixels of
+    'struct_elem' around each pixel, with the borders reflected as in
+    'scipy.ndimage'. The element applies to the last two axes, so a stack of
+    slices is processed slice by slice. Elements full of ones are reduced
+    along rows and then along columns, and other elements as the union of
+    their line segments, so the cost grows with the number of segments
+    instead of the area of the element.
+
+    Parameters:
+                image:          <numpy.ndarray>
+                                Binary image of 2 or more dimensions.
+                struct_elem:    <numpy.ndarray>
+                                2d structure element.
+                reduce_func:    <numpy.ufunc>
+                                'np.logical_and' for erosion or
+                                'np.logical_or' for dilation.
+                center:         <tuple>
+                                Pixel of the element placed over each pixel
+                                of the image. By default the one at half of
+                                each dimension.
+
+    Returns:
+                result:         <numpy.ndarray>
+                                Boolean image with the shape of 'image'.
+    '''
+    elem = np.asarray(struct_elem) != 0
+    if center is None:
+        center = (elem.shape[0] // 2, elem.shape[1] // 2)
+    rows, cols = image.shape[-2:]
+    padding = [(0, 0)] * (image.ndim - 2) + [(center[0], elem.shape[0] - 1 - \
+        center[0]), (center[1], elem.shape[1] - 1 - center[1])]
+    padded = np.pad(np.asarray(image) != 0, padding, mode='symmetric')
+
+    if np.all(elem):
+        return running_window(running_window(padded, elem.shape[1], -1, \
+            reduce_func), elem.shape[0], -2, reduce_func)
+
+    result = None
+    windows = {}
+    for segment in line_segments(elem):
+        axis = -1 if segment.axis == 1 else -2
+        # Segments of the same length share their windows
+        if (axis, segment.length) not in windows:
+            windows[(axis, segment.length)] = running_window(padded, \
+                segment.length, axis, reduce_func)
+        window = windows[(axis, segment.length)]
+        part = window[..., segment.row:segment.row+rows, \
+            segment.col:segment.col+cols]
+        result = part if result is None else reduce_func(result, part)
+
+    return result
+
+def binary_erosion(image, struct_elem):
+    '''
+    Returns the erosion of the binary 'image' with 'struct_elem'. Equal to the
+    nonzero pixels of 'scipy.ndimage.grey_erosion' of a non negative image,
+    and of 'skimage.morphology.erosion' with symmetric elements of odd
+    dimensions. See 'binary_morphology'.
+    '''
+    return binary_morphology(image, struct_elem, np.logical_and)
+
+def binary_dilation(image, struct_elem):
+    '''
+    Returns the dilation of the binary 'image' with 'struct_elem'. Equal to the
+    nonzero pixels of 'scipy.ndimage.grey_dilation' of a non negative image,
+    and of 'skimage.morphology.dilation' with symmetric elements of odd
+    dimensions. The element is mirrored, together with its center, as the
+    dilation is the maximum over the pixels at minus each offset of the
+    element. See 'binary_morphology'.
+    '''
+    struct_elem = np.asarray(struct_elem)[::-1, ::-1]
+    center = (struct_elem.shape[0] - 1 - struct_elem.shape[0] // 2, \
+        struct_elem.shape[1] - 1 - struct_elem.shape[1] // 2)
+
+    return binary_morphology(image, struct_elem, np.logical_or, center)
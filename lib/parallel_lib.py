@@ -0,0 +1,331 @@
+from multiprocessing import util as mp_util
+import multiprocessing as mp
+import numpy as np
+import gc
+import logger_lib as logger
+import structure as sct             # Structure objects hierarchy
+import slice_lib as slc
+import imobj_lib as imobj
+import bitvol_lib as bvl
+
+try:
+    from multiprocessing import shared_memory as shm
+except ImportError:                 # Only available from Python 3.8
+    shm = None
+    from multiprocessing import sharedctypes
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# State of each worker process, set once by 'init_worker'.
+worker_state = {}
+
+class Parallel_classifier(object):
+    '''
+    Classifies the image object slices in a pool of processes. The matter
+    volumes and the labels, feature tables and inner regions of the blobs
+    found by the main process are placed in shared memory, so each worker
+    reads its slices without copying them or finding their blobs again, and
+    only compact records are sent back.
+    '''
+    log_class_heading = log_file_heading+"Class: Parallel_classifier"
+    workers = 1
+    shared_blocks = []
+    roi_margin = None
+
+    def __init__(self, log, workers, roi_margin=None):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.workers = workers
+        self.shared_blocks = []
+        # Margin of the type 3 windows of the workers, see 
+        # 'Locate_blobs.roi_margin'
+        self.roi_margin = roi_margin
+
+    def share_volume(self, volume):
+        '''
+        Returns the descriptor of a copy of 'volume' placed in shared memory.
+        The shared block is kept alive until 'release' is called. Packed
+        volumes are shared packed.
+
+        Parameters:
+                    volume:         <numpy.ndarray>
+                                    3d array image to share, or a
+                                    'lib.bitvol_lib.Bit_volume'. Any other
+                                    array, as feature tables, is also shared.
+
+        Returns:
+                    descriptor:     <tuple>
+                                    (block, shape, dtype, dense_shape) to attach
+                                    the volume from the workers. 'block' is the
+                                    name of the shared memory block, or the
+                                    shared array itself in Python 2. 'dtype'
+                                    lists the fields of structured arrays.
+                                    'dense_shape' is None unless the volume is
+                                    packed.
+        '''
+        dense_shape = None
+        if isinstance(volume, bvl.Bit_volume):
+            dense_shape = volume.shape
+            volume = volume.bits
+        volume = np.asarray(volume)
+        if shm is not None:
+            block = shm.SharedMemory(create=True, size=max(volume.nbytes, 1))
+            self.shared_blocks.append(block)
+            handle = block.name
+            buf = block.buf
+        else:
+            block = sharedctypes.RawArray('b', max(volume.nbytes, 1))
+            self.shared_blocks.append(block)
+            handle = block
+            buf = block
+
+        shared = np.ndarray(volume.shape, dtype=volume.dtype, buffer=buf)
+        shared[...] = volume
+
+        dtype = volume.dtype.str
+        if volume.dtype.names is not None:
+            dtype = volume.dtype.descr
+
+        return (handle, volume.shape, dtype, dense_shape)
+
+    def share_blobs(self, matter_obj):
+        '''
+        Returns the descriptors of the labels, the feature table and the inner
+        regions of the blobs of every slice of 'matter_obj', placed in shared
+        memory. Inner regions are stored as the masks of the blobs, in a store
+        with the same offsets as the mask store of the table.
+
+        Parameters:
+                    matter_obj:     <lib.matter_lib.Matter>
+                                    Matter whose slices have their blobs and
+                                    inner regions found.
+
+        Returns:
+                    blobs:          <dict>
+                                    Descriptors 'labels', 'table', 'masks' and
+                                    'inner', as given by 'share_volume', and 
+                                    arrays 'labels_num' and 'table_offsets', 
+                                    the first row of each slice.
+        '''
+        slice_objs = matter_obj.slices_obj_list
+        table, mask_store = matter_obj.feature_table()
+        inner_store = np.zeros(mask_store.shape, dtype=np.bool_)
+        blob_objs = [blob_obj for slice_obj in slice_objs for blob_obj in \
+            slice_obj.blobs_obj_list]
+        for row, blob_obj in zip(table, blob_objs):
+            if blob_obj.inner_crop is not None:
+                offset = int(row['mask_offset'])
+                inner_store[offset:offset+blob_obj.inner_crop.size] = \
+                    blob_obj.inner_crop.ravel()
+
+        blobs = {}
+        blobs['labels'] = self.share_volume(np.stack([slice_obj.slc_lbl for \
+            slice_obj in slice_objs]).astype(np.int32))
+        blobs['table'] = self.share_volume(table)
+        blobs['masks'] = self.share_volume(mask_store)
+        blobs['inner'] = self.share_volume(inner_store)
+        blobs['labels_num'] = np.array([slice_obj.lbls_num for slice_obj in \
+            slice_objs])
+        blobs['table_offsets'] = np.cumsum([0]+[len(slice_obj.blob_features) \
+            for slice_obj in slice_objs])
+
+        return blobs
+
+    def release(self):
+        '''
+        Frees the shared memory blocks created by 'share_volume'.
+        '''
+        for block in self.shared_blocks:
+            if shm is not None:
+                block.close()
+                block.unlink()
+        self.shared_blocks = []
+
+    def classify_slices(self, matter_objs, n_slices):
+        '''
+        Returns the records of the image objects of types 1, 2 and 3 found in
+        each slice. Slices are distributed among 'workers' processes.
+
+        Parameters:
+                    matter_objs:    <list>
+                                    List of objects of class 'Matter', ordered
+                                    as WM, GM, CSF and I3T. The slices of WM
+                                    and GM must have their blobs and inner
+                                    regions found.
+                    n_slices:       <int>
+                                    Number of slices of the volumes.
+
+        Returns:
+                    records:        <list>
+                                    Record of each slice, ordered by slice
+                                    number. See 'ImageObjectSlice.slice_record'.
+        '''
+        try:
+            descriptors = [self.share_volume(matter.img3d) for matter in \
+                matter_objs]
+            names = [matter.name for matter in matter_objs]
+            blobs = [self.share_blobs(matter) for matter in matter_objs[:2]]
+            pool = mp.Pool(self.workers, init_worker, (descriptors, names, \
+                blobs, self.roi_margin))
+            try:
+                chunk = max(1, n_slices // (self.workers * 4))
+                records = pool.map(classify_slice, range(n_slices), chunk)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            self.release()
+
+        return records
+
+def attach_volume(descriptor, log):
+    '''
+    Returns the shared memory block and the array of the volume described by
+    'descriptor', without copying its data.
+
+    Parameters:
+                descriptor:     <tuple>
+                                (block, shape, dtype, dense_shape) as returned
+                                by 'Parallel_classifier.share_volume'.
+                log:            <lib.logger_lib.NullLogger>
+                                Log of the worker.
+
+    Returns:
+                block:          <object>
+                                Shared memory block. Must be kept referenced
+                                while the array is used.
+                volume:         <numpy.ndarray>
+                                3d array image, or a 'lib.bitvol_lib.Bit_volume'
+                                when shared packed.
+    '''
+    handle, shape, dtype, dense_shape = descriptor
+    if shm is not None:
+        block = shm.SharedMemory(name=handle)
+        buf = block.buf
+    else:
+        block = handle
+        buf = handle
+
+    volume = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf)
+    if dense_shape is not None:
+        volume = bvl.Bit_volume(log, bits=volume, shape=dense_shape)
+
+    return block, volume
+
+def init_worker(descriptors, names, blobs, roi_margin=None):
+    '''
+    Attaches the shared volumes and blobs and creates the objects used by a
+    worker process. Workers do not write to the log file.
+
+    Parameters:
+                descriptors:    <list>
+                                Descriptors of the shared volumes, ordered as
+                                WM, GM, CSF and I3T.
+                names:          <list>
+                                Matter name of each volume.
+                blobs:          <list>
+                                Shared blobs of WM and GM, as given by
+                                'Parallel_classifier.share_blobs'.
+                roi_margin:     <int>
+                                Margin of the windows of type 3, see
+                                'Locate_blobs.roi_margin'.
+    '''
+    log = logger.NullLogger()
+    attached = [attach_volume(descriptor, log) for descriptor in descriptors]
+    worker_state['blocks'] = [block for block, volume in attached]
+    worker_state['volumes'] = [volume for block, volume in attached]
+    worker_state['blobs'] = []
+    for matter_blobs in blobs:
+        arrays = dict(matter_blobs)
+        for name in ('labels', 'table', 'masks', 'inner'):
+            block, arrays[name] = attach_volume(matter_blobs[name], log)
+            worker_state['blocks'].append(block)
+        worker_state['blobs'].append(arrays)
+    worker_state['names'] = names
+    worker_state['log'] = log
+    worker_state['stct'] = sct.Structure(log)
+    worker_state['stct'].loc.roi_margin = roi_margin
+
+    # The blocks are closed when the worker exits, once the pool is closed
+    mp_util.Finalize(None, release_worker, exitpriority=10)
+
+def release_worker():
+    '''
+    Closes the shared memory blocks attached by a worker process. The arrays
+    over them are dropped first, since a block can not be closed while they
+    exist. Only the main process unlinks the blocks.
+    '''
+    blocks = worker_state.get('blocks', [])
+    worker_state.clear()
+    gc.collect()
+    if shm is not None:
+        for block in blocks:
+            block.close()
+
+def classify_slice(slice_index):
+    '''
+    Returns the record of the image objects found in a slice. Makes the blob
+    objects of the slice from the shared ones and finds the objects of types
+    1, 2 and 3, as the serial driver does.
+
+    Parameters:
+                slice_index:    <int>
+                                Number of the slice to classify.
+
+    Returns:
+                record:         <dict>
+                                See 'ImageObjectSlice.slice_record'.
+    '''
+    log = worker_state['log']
+    stct = worker_state['stct']
+    fill = 4 - len(list(str(slice_index)))
+    slice_name = 'slice'+'0'*fill+str(slice_index)
+    slices = []
+    for volume, name in zip(worker_state['volumes'], worker_state['names']):
+        if isinstance(volume, bvl.Bit_volume):
+            slice_2d = volume.packed(slice_index)
+        else:
+            slice_2d = volume[..., slice_index]
+        slices.append(slc.Slice(log, slice_2d, slice_name, name, stct))
+
+    # Blobs are only needed for white and gray matter
+    for slice_obj, blobs in zip(slices[:2], worker_state['blobs']):
+        load_shared_blobs(slice_obj, blobs, slice_index)
+
+    imobj_slice = imobj.ImageObjectSlice(log, slices[0], slices[1], slices[2],\
+        slices[3], stct)
+    imobj_slice.find_imobjs_type1()
+    imobj_slice.find_imobjs_type2()
+    imobj_slice.find_imobjs_type3()
+
+    return imobj_slice.slice_record()
+
+def load_shared_blobs(slice_obj, blobs, slice_index):
+    '''
+    Sets the labels, the blob objects and their centroids and inner regions 
+    of a slice from the blobs shared by the main process.
+
+    Parameters:
+                slice_obj:      <lib.slice_lib.Slice>
+                                Slice to set.
+                blobs:          <dict>
+                                Shared blobs of its matter, attached by
+                                'init_worker'.
+                slice_index:    <int>
+                                Number of the slice.
+
+    Updates object atributes of the slice:
+                slc_lbl, lbls_num, blobs_obj_list, blob_features and mask_store
+    '''
+    first, last = blobs['table_offsets'][slice_index:slice_index+2]
+    slice_obj.slc_lbl = blobs['labels'][slice_index]
+    slice_obj.lbls_num = int(blobs['labels_num'][slice_index])
+    slice_obj.make_blob_objs(features=(np.array(blobs['table'][first:last]), \
+        blobs['masks']))
+    for row, blob_obj in zip(slice_obj.blob_features, slice_obj.blobs_obj_list):
+        offset = int(row['mask_offset'])
+        blob_obj.inner_crop = blobs['inner'][offset:offset+\
+            blob_obj.blob_crop.size].reshape(blob_obj.blob_crop.shape)
+        blob_obj.find_blob_centroid()
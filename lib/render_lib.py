@@ -0,0 +1,115 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PathCollection
+from matplotlib.transforms import Affine2D
+from matplotlib.textpath import TextPath
+from matplotlib.figure import Figure
+import multiprocessing as mp
+import numpy as np
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# Figure reused by every render of the process, created by 'render_labels'.
+render_state = {}
+
+class Render_pool(object):
+    '''
+    Renders the labelled slices in a pool of processes while the analysis goes
+    on. Each process draws on its own Agg figure, reused for all its jobs.
+    'wait' is the barrier after which every file has been written.
+    '''
+    log_class_heading = log_file_heading+"Class: Render_pool"
+    workers = 1
+    pending = []
+
+    def __init__(self, log, workers):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.workers = workers
+        self.pending = []
+        self.pool = mp.Pool(self.workers)
+
+    def submit(self, out_f_path, lbl_slice, annotations):
+        '''
+        Queues the render of 'lbl_slice' with its 'annotations' into the file
+        'out_f_path'. Returns without waiting for it.
+
+        Parameters:
+                    out_f_path:     <str>
+                                    Output path of the plot.
+                    lbl_slice:      <numpy.ndarray>
+                                    2d image array to display.
+                    annotations:    <list>
+                                    List of (text, (x, y), color) as given by
+                                    'Locate_blobs.label_annotations'.
+        '''
+        job = self.pool.apply_async(render_labels, (out_f_path, \
+            np.asarray(lbl_slice), annotations))
+        self.pending.append((out_f_path, job))
+
+    def wait(self):
+        '''
+        Waits until every render submitted so far is written. Errors of the
+        renders are logged, not raised.
+        '''
+        for out_f_path, job in self.pending:
+            try:
+                job.get()
+            except Exception as error:
+                self.log.write_ctx("error", self.log_class_heading, "wait", \
+                    "Render of "+out_f_path+" failed: "+str(error))
+        self.pending = []
+
+    def close(self):
+        '''
+        Waits for the pending renders and stops the processes.
+        '''
+        self.wait()
+        self.pool.close()
+        self.pool.join()
+
+def render_labels(out_f_path, lbl_slice, annotations, cmap='nipy_spectral'):
+    '''
+    Writes 'lbl_slice' coloured with 'cmap' and its annotations to the file
+    'out_f_path'. All the texts are drawn as a single collection of paths. The
+    figure of the process is created by the first call and reused.
+
+    Parameters:
+                out_f_path:     <str>
+                                Output path of the plot.
+                lbl_slice:      <numpy.ndarray>
+                                2d image array to display.
+                annotations:    <list>
+                                List of (text, (x, y), color), with (x, y) in
+                                image coordinates.
+                cmap:           <str>
+                                Colormap of the image.
+    '''
+    if 'figure' not in render_state:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        render_state['figure'] = figure
+        render_state['axes'] = figure.add_subplot(111)
+    figure = render_state['figure']
+    axes = render_state['axes']
+
+    axes.clear()
+    axes.imshow(lbl_slice, cmap=cmap)
+    axes.axis('on')
+
+    if annotations:
+        # Text height in data units, similar to the default font size
+        size = max(lbl_slice.shape) / 30.0
+        paths = []
+        colors = []
+        for text, (x, y), color in annotations:
+            path = TextPath((0, 0), text, size=size)
+            # Image rows grow downwards, so glyphs are flipped vertically
+            paths.append(path.transformed(Affine2D().scale(1, -1)\
+                .translate(x, y)))
+            colors.append(color)
+        axes.add_collection(PathCollection(paths, facecolors=colors, \
+            edgecolors='none', transform=axes.transData), autolim=False)
+
+    figure.savefig(out_f_path)
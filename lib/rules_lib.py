@@ -0,0 +1,217 @@
+from collections import namedtuple
+import numpy as np
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+# Condition over a column of a blob feature table: 'column op value'. The
+# value is a number, a 'Column_ref' or, for op 'outside', a pair (low, high)
+# whose open interval is excluded.
+Predicate = namedtuple('Predicate', ['column', 'op', 'value'])
+
+# Value read from another column of the table, times 'factor'.
+Column_ref = namedtuple('Column_ref', ['column', 'factor'])
+
+comparisons = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+    'outside': lambda values, bounds: ~((values > bounds[0]) & \
+        (values < bounds[1])),
+    }
+
+# Columns computed from the feature table. Centroids are rounded as in
+# 'Blob.find_blob_centroid'.
+derived_columns = {
+    'row': lambda table: np.round(table['centroid'][:, 0]),
+    'col': lambda table: np.round(table['centroid'][:, 1]),
+    }
+
+# Acceptance rules of the candidate blobs of each type of image object.
+# Columns that are neither in the feature table nor derived from it are
+# provided by the characterization, and only for the blobs that pass the rest.
+type1_rules = [
+    Predicate('area', '>=', 3),
+    Predicate('area', '<=', 2000),
+    Predicate('row', '>=', 90),
+    Predicate('col', 'outside', (150, 200)),
+    # Inner region over no white matter blob nor other gray matter blob
+    Predicate('inner_overlap', '==', 0),
+    ]
+
+type2_rules = [
+    Predicate('area', '>=', 3),
+    Predicate('area', '<=', 2000),
+    Predicate('row', '>=', 90),
+    Predicate('col', 'outside', (150, 200)),
+    Predicate('hole_area', '>=', 3),
+    # Hole filled by a white matter blob
+    Predicate('wm_overlap', '>', 0),
+    ]
+
+type3_wm_rules = [
+    Predicate('area', '>=', 3),
+    Predicate('area', '<=', 2000),
+    Predicate('row', '>=', 95),
+    Predicate('col', 'outside', (150, 200)),
+    # Mostly over the main blob of the mixed mask
+    Predicate('main_overlap', '>', Column_ref('area', 0.8)),
+    ]
+
+type3_gm_rules = [
+    Predicate('area', '>=', 15),
+    Predicate('area', '<=', 3000),
+    Predicate('row', '>=', 95),
+    Predicate('col', 'outside', (150, 200)),
+    Predicate('main_overlap', '>', Column_ref('area', 0.8)),
+    ]
+
+class Blob_rules(object):
+    '''
+    Set of predicates over the columns of blob feature tables. Predicates over
+    the table columns are compiled into a single vectorized expression that
+    is evaluated first over all the rows; the rest need a column provided by
+    the caller, computed only for the rows that passed the previous ones.
+    Tables of a slice or of a whole volume are evaluated the same way.
+    '''
+    log_class_heading = log_file_heading+"Class: Blob_rules"
+    name = ''
+    cheap = []
+    costly = []
+
+    def __init__(self, log, name, predicates):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.name = name
+        # Cheap predicates first, in the given order
+        self.cheap = [predicate for predicate in predicates if \
+            is_table_column(predicate.column)]
+        self.costly = [predicate for predicate in predicates if not \
+            is_table_column(predicate.column)]
+        self.cheap_expression = compile_predicates(self.cheap)
+
+    def select(self, table, providers=None):
+        '''
+        Returns the mask of the rows of 'table' that satisfy all the
+        predicates.
+
+        Parameters:
+                    table:          <numpy.ndarray>
+                                    Structured array of
+                                    'lib.locate_blobs.blob_feature_dtype'.
+                    providers:      <dict>
+                                    For each column that is not in the table,
+                                    function that takes an array of row
+                                    indices and returns the column values of
+                                    those rows.
+
+        Returns:
+                    selected:       <numpy.ndarray>
+                                    Boolean array with a value per row.
+        '''
+        selected = self.cheap_expression(table)
+        values = {}
+        for predicate in self.costly:
+            survivors = np.flatnonzero(selected)
+            if len(survivors) == 0:
+                break
+            if predicate.column not in values:
+                values[predicate.column] = (survivors, np.asarray(\
+                    providers[predicate.column](survivors)))
+            rows, column = values[predicate.column]
+            # Rows already discarded by a previous predicate are skipped. Both
+            # arrays are sorted and the survivors are a subset of 'rows'
+            column = column[np.searchsorted(rows, survivors)]
+            selected[survivors] = evaluate(predicate, column, table, survivors)
+
+        return selected
+
+    def explain(self, table, providers=None):
+        '''
+        Returns the result of each predicate for every row of 'table',
+        computing the provided columns for all of them. Used to debug the
+        rules.
+
+        Parameters:
+                    table:          <numpy.ndarray>
+                                    Structured array of
+                                    'lib.locate_blobs.blob_feature_dtype'.
+                    providers:      <dict>
+                                    As in 'select'.
+
+        Returns:
+                    results:        <list>
+                                    Pairs of a text of the predicate and its
+                                    boolean array.
+        '''
+        rows = np.arange(len(table))
+        results = []
+        for predicate in self.cheap + self.costly:
+            if is_table_column(predicate.column):
+                column = table_column(table, predicate.column)
+            else:
+                column = np.asarray(providers[predicate.column](rows))
+            results.append(('{} {} {}'.format(*predicate), evaluate(\
+                predicate, column, table, rows)))
+
+        return results
+
+def is_table_column(column):
+    '''
+    Returns whether 'column' is read from the feature tables.
+    '''
+    return column in derived_columns or column in ['label', 'slice', \
+        'matter', 'area', 'hole_area']
+
+def table_column(table, column):
+    '''
+    Returns the values of 'column' for all the rows of 'table'.
+    '''
+    if column in derived_columns:
+        return derived_columns[column](table)
+
+    return table[column]
+
+def evaluate(predicate, column, table, rows):
+    '''
+    Returns the result of 'predicate' over the values 'column' of the rows
+    'rows' of 'table'.
+    '''
+    value = predicate.value
+    if isinstance(value, Column_ref):
+        value = table_column(table, value.column)[rows] * value.factor
+
+    return comparisons[predicate.op](column, value)
+
+def compile_predicates(predicates):
+    '''
+    Returns a function that evaluates the conjunction of 'predicates' over a
+    whole feature table. Each column used is computed once.
+
+    Parameters:
+                predicates:     <list>
+                                List of 'Predicate' over table columns.
+
+    Returns:
+                expression:     <function>
+                                Takes a table and returns the boolean mask of
+                                its rows that satisfy all the predicates.
+    '''
+    def expression(table):
+        selected = np.ones(len(table), dtype=np.bool_)
+        columns = {}
+        rows = np.arange(len(table))
+        for predicate in predicates:
+            if predicate.column not in columns:
+                columns[predicate.column] = table_column(table, \
+                    predicate.column)
+            selected &= evaluate(predicate, columns[predicate.column], table,\
+                rows)
+
+        return selected
+
+    return expression
@@ -1,34 +1,73 @@
-from inspect import stack                   # To write log
 from matplotlib import image as im      # Read images
-import locate_blobs as loc          # Locate blobs functions
+import bitvol_lib as bvl
 
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class Slice(object):
+    log_class_heading = log_file_heading+"Class: Slice"
 
-    slc_arr = None
+    slc_dense = None
+    slc_bits = None
+    slc_unpacked = None
     slc_name = ''
     slc_lbl = None
     lbls_num = 0
+    lbls_3d = None
     blobs_obj_list = []
+    blob_features = None
+    mask_store = None
     slc_number = None
     matter_kind = ''
     
     def __init__(self, log, slice_2d, slice_name, matter_name, stct):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
 
-        self.slc_arr = slice_2d
+        # Packed slices are only unpacked when the array is requested
+        if isinstance(slice_2d, bvl.Bit_slice):
+            self.slc_bits = slice_2d
+        else:
+            self.slc_dense = slice_2d
         self.slc_name = slice_name
         self.matter_kind = matter_name
         self.slc_number = int(slice_name[slice_name.find('slice')+5:])
         self.stct = stct
-        self.loc = loc.Locate_blobs(self.log)
+        self.loc = stct.loc
+
+    @property
+    def slc_arr(self):
+        '''
+        2d image of the slice. When the slice is kept packed it is unpacked the
+        first time it is requested and kept until 'release_unpacked'.
+
+        Returns:
+                    slc_arr:        <numpy.ndarray>
+                                    2d image of the slice.
+        '''
+        if self.slc_dense is None and self.slc_bits is not None:
+            if self.slc_unpacked is None:
+                self.slc_unpacked = self.slc_bits.dense()
+            return self.slc_unpacked
+
+        return self.slc_dense
+
+    @slc_arr.setter
+    def slc_arr(self, slice_2d):
+        self.slc_dense = slice_2d
+        self.slc_bits = None
+        self.slc_unpacked = None
+
+    def release_unpacked(self):
+        '''
+        Drops the 2d image unpacked from a packed slice, once a stage of its
+        processing is done. It is unpacked again if it is requested later.
+
+        Updates object atributes:
+                    slc_unpacked:   Set to None.
+        '''
+        self.slc_unpacked = None
 
     def save_slice(self, out_path, fext='.png'):
         '''
@@ -67,12 +106,43 @@ class Slice(object):
         if img_slice is None:
             img_slice = self.slc_arr
 
-        self.slc_lbl, self.lbls_num = self.loc.find_labels(img_slice)
+        with self.stct.timer.stage('find_labels', self.slc_number):
+            self.slc_lbl, self.lbls_num = self.loc.find_labels(img_slice)
+            self.stct.timer.count_bytes(self.slc_lbl)
 
-    def make_blob_objs(self, slice_labelled=None, slc_n=None, mat_knd=None):
+    def find_slice_labels_3d(self, stream, img_slice=None):
+        '''
+        Stores as attributes the labels of the 2d image pointed by 'img_slice',
+        as 'find_slice_labels' does, pushing it to a stream that labels the 
+        volume slice by slice.
+        By default takes self object attributes.
+
+        Parameters:
+                    stream:         <lib.label3d_lib.Labels_3d_stream>
+                                    Stream the previous slices of the volume
+                                    have been pushed to.
+                    img_slice:      <numpy.ndarray>
+                                    2d image to find labels from.
+
+        Updates object atributes:
+                    slc_lbl, lbls_num and
+                    lbls_3d:        <numpy.ndarray>
+                                    Provisional global id of each label, until
+                                    they are resolved with 'stream.global_ids'.
+        '''
+        if img_slice is None:
+            img_slice = self.slc_arr
+
+        with self.stct.timer.stage('find_labels_3d', self.slc_number):
+            self.slc_lbl, self.lbls_num, self.lbls_3d = stream.push(img_slice)
+            self.stct.timer.count_bytes(self.slc_lbl)
+
+    def make_blob_objs(self, slice_labelled=None, slc_n=None, mat_knd=None, \
+            features=None):
         '''
         Stores as an attribute the result of using the 2d array pointed by 
-        'slice_labelled' to create objects of class 'Blob'.
+        'slice_labelled' to create objects of class 'Blob', and the feature
+        table of the blobs, which they share their masks with.
         By default takes self object attributes.
 
         Parameters:
@@ -82,10 +152,21 @@ class Slice(object):
                                     Number of slice. 
                     mat_knd:         <str>
                                     Matter kind of the object
+                    features:        <tuple>
+                                    Feature table and mask store of the blobs
+                                    of the slice, if already known, as given 
+                                    by 'Locate_blobs.feature_table'. The 
+                                    offsets of the table may point into the
+                                    store of a whole volume.
 
         Updates object atributes:
                     blobs_obj_list:  <list>
                                     List of objects of class 'Blob'. 
+                    blob_features:   <numpy.ndarray>
+                                    Feature table of the blobs, as given by
+                                    'Locate_blobs.feature_table'.
+                    mask_store:      <numpy.ndarray>
+                                    Masks of the blobs of the table.
         '''
         if slice_labelled is None:
             slice_labelled = self.slc_lbl
@@ -96,9 +177,57 @@ class Slice(object):
 
         if self.lbls_num == 0:
             self.blobs_obj_list = []
+            self.blob_features, self.mask_store = self.loc.blobs_features([])
         else:
-            self.blobs_obj_list = self.stct.create_blob_objs(slice_labelled, slc_n,\
-                mat_knd)
+            with self.stct.timer.stage('create_blob_objs', slc_n):
+                if features is None:
+                    features = self.loc.feature_table(slice_labelled, slc_n, \
+                        mat_knd)
+                self.blob_features, self.mask_store = features
+                blob_records = self.loc.table_records(self.blob_features, \
+                    self.mask_store)
+                self.blobs_obj_list = self.stct.create_blob_objs(\
+                    slice_labelled, slc_n, mat_knd, blob_records)
+                self.stct.timer.count('blobs', len(self.blobs_obj_list))
+            # Relate each blob to its 3d component when labelled in 3d
+            if self.lbls_3d is not None:
+                for blob_obj in self.blobs_obj_list:
+                    blob_obj.blob_3d_id = self.lbls_3d[blob_obj.blob_num]
+
+    def find_blobs_inner_regions(self, slice_labelled=None, blob_objs=None):
+        '''
+        Stores in each blob of the slice the mask of its inner region. Holes 
+        are computed once for the whole labelled slice.
+        By default takes self object attributes.
+
+        Parameters:
+                    slice_labelled: <numpy.ndarray>
+                                    Array differently labelled for each blob. 
+                    blob_objs:      <list>
+                                    List of objects of class 'Blob'. 
+
+        Updates object atributes of each blob:
+                    inner_crop:     <numpy.ndarray>
+                                    Inner region with the shape of the blob
+                                    bounding box.
+
+        Updates object atributes:
+                    blob_features:  <numpy.ndarray>
+                                    Column 'hole_area' of the table.
+        '''
+        if slice_labelled is None:
+            slice_labelled = self.slc_lbl
+        if blob_objs is None:
+            blob_objs = self.blobs_obj_list
+
+        # Hole areas are set in the feature table of the slice blobs
+        table = None
+        if blob_objs is self.blobs_obj_list:
+            table = self.blob_features
+
+        if len(blob_objs) > 0:
+            with self.stct.timer.stage('find_inner_region', self.slc_number):
+                self.loc.find_inner_regions(slice_labelled, blob_objs, table)
 
     def plot_slice_labels(self, o_path, slic=None, blob_objs=None, f_ext='.png'):
         '''
@@ -123,11 +252,6 @@ class Slice(object):
         if blob_objs is None:
             blob_objs = self.blobs_obj_list
 
-        raw_input('o_path: type: {}'.format(type(o_path)))
-        raw_input('slic: type: {}'.format(type(slic)))
-        raw_input('blob_objs: type: {}'.format(type(blob_objs)))
-        raw_input('f_ext: type: {}'.format(type(f_ext)))
-
         self.loc.plot_labels(o_path+self.slc_name+f_ext, slic, blob_objs)
 
 
@@ -1,24 +1,26 @@
 from skimage import measure as msr          # To measure region props
-from inspect import stack                   # To write log
 import numpy as np
 import matter_lib as matt
 import slice_lib as slc
 import blob_lib as blb
 import imobj_lib as imobj
+import locate_blobs as loc
+import bitvol_lib as bvl
+import timing_lib as tmg
+import context_lib as ctx
 
 
 log_file_heading = 'File: '+__file__.split('/')[-1]+' '
 
 class Structure(object):
+    log_class_heading = log_file_heading+"Class: Structure"
+    timer = tmg.null_timer
     
     def __init__(self, log):
         self.log = log
-        self.log_class_heading = log_file_heading+"Class: "\
-            +self.__class__.__name__
-        log_method_heading = self.log_class_heading+" Method: "+stack()[0][3]\
-            +" ::: "
-        self.log.write_log("log",log_method_heading+"Initialization called")
-
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+        self.loc = loc.Locate_blobs(self.log)
 
     def create_matter_objs(self, fpath, fnames):
         '''
@@ -45,7 +47,7 @@ class Structure(object):
 
         return matters_list
 
-    def create_slice_objs(self, image_3d, mat_name):
+    def create_slice_objs(self, image_3d, mat_name, first_slice=0):
         '''
         Returns the list cointaining the result of creating objects of class 
         'Slice'. There is an object for each slice of the given 'image_3d' image.
@@ -53,9 +55,12 @@ class Structure(object):
         Parameters:
                     image_3d:       <numpy.ndarray>
                                     3d array image from whose slices are created
-                                    the 'Slice' class objects.
+                                    the 'Slice' class objects. Slices of a
+                                    'lib.bitvol_lib.Bit_volume' are kept packed.
                     mat_name:       <str>
                                     Name to be set as attribute of the object.
+                    first_slice:    <int>
+                                    Number of the first slice of 'image_3d'.
 
         Returns:
                     slices_list:    <list>
@@ -63,8 +68,11 @@ class Structure(object):
                                     'Matter'.
         '''
         slices_list = []
-        for i in range(image_3d.shape[2]):
-            slice_i = image_3d[...,i]
+        for i in range(first_slice, first_slice+image_3d.shape[2]):
+            if isinstance(image_3d, bvl.Bit_volume):
+                slice_i = image_3d.packed(i-first_slice)
+            else:
+                slice_i = image_3d[...,i-first_slice]
             fill = 4 - len(list(str(i)))
             slice_name = 'slice'+'0'*fill+str(i)
             slice_obj = slc.Slice(self.log, slice_i, slice_name, mat_name, self)
@@ -72,7 +80,8 @@ class Structure(object):
 
         return slices_list
 
-    def create_blob_objs(self, labelled_slice, slice_number, slice_kind):
+    def create_blob_objs(self, labelled_slice, slice_number, slice_kind, \
+            blob_records=None):
         '''
         Returns the list cointaining the result of creating objects of class 
         'Blob'. There is an object for each blob found in the given 
@@ -85,6 +94,10 @@ class Structure(object):
                                     Number of slice. 
                     slice_kind:           <str>
                                     Matter kind of the object
+                    blob_records:   <list>
+                                    Blob table of 'labelled_slice', as given
+                                    by 'Locate_blobs.blob_table'. Found if not
+                                    given.
 
         Returns:
                     blobs_list:           <list>
@@ -92,12 +105,13 @@ class Structure(object):
                                     'Blob'.
         '''
         blobs_list = []
-        blob_props_list = msr.regionprops(labelled_slice)# [1:]  Exclude background
-        for blob_props in blob_props_list:
-            mask = labelled_slice == blob_props.label
-            mask = mask.astype(np.int)
-            blob_obj = blb.Blob(self.log, mask, slice_number, blob_props,\
-                slice_kind)
+        # All the blobs are extracted in a single pass over 'labelled_slice'.
+        # Each blob only stores the mask of its bounding box.
+        if blob_records is None:
+            blob_records = self.loc.blob_table(labelled_slice)
+        for blob_props in blob_records:
+            blob_obj = blb.Blob(self.log, labelled_slice.shape, slice_number,\
+                blob_props, slice_kind, self.loc)
             blobs_list.append(blob_obj)
 
         return blobs_list
@@ -132,6 +146,43 @@ class Structure(object):
 
         return imobj_slices_list
 
+    def create_imobj_slice_obj(self, slices):
+        '''
+        Returns the object of class 'ImageObjectSlice' conformed by the aligned
+        slices of all matters given in 'slices'.
+
+        Parameters:
+                    slices:         <list>
+                                    List of objects of class 'Slice' ordered as
+                                    WM, GM, CSF and I3T.
+
+        Returns:
+                    imobj_slice_obj: <lib.imobj_lib.ImageObjectSlice>
+                                    Object created.
+        '''
+        wm_slc, gm_slc, csf_slc, i3t_slc = slices
+
+        return imobj.ImageObjectSlice(self.log, wm_slc, gm_slc, csf_slc, \
+            i3t_slc, self)
+
+    def create_slice_context(self, wm_slice, gm_slice):
+        '''
+        Returns the object of class 'Slice_context' of a pair of aligned 
+        slices, whose intermediate images and tables are shared by the 
+        findings of image objects of types 1, 2 and 3.
+
+        Parameters:
+                    wm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'wm'.
+                    gm_slice:       <lib.slice_lib.Slice>
+                                    Object 'Slice' of matter 'gm'.
+
+        Returns:
+                    context:        <lib.context_lib.Slice_context>
+                                    Object created.
+        '''
+        return ctx.Slice_context(self.log, wm_slice, gm_slice, self.loc)
+
     def create_imobj_objects_type1(self, blob1_list):
         '''
         Returns the list cointaining the result of creating objects of class 
@@ -0,0 +1,224 @@
+import json
+import time
+
+log_file_heading = 'File: '+__file__.split('/')[-1]+' '
+
+class Run_timer(object):
+    '''
+    Records the wall time of the stages of a run and the values of its
+    counters (blobs, overlap evaluations, bytes allocated...), in total and
+    per slice. Stages are timed with 'stage', used as a context manager;
+    counters incremented while a stage of a slice is running are also added
+    to that slice. Nested stages are timed independently, so the time of an
+    inner stage is also part of the outer one.
+    '''
+    log_class_heading = log_file_heading+"Class: Run_timer"
+    enabled = True
+    current_slice = None
+
+    def __init__(self, log):
+        self.log = log
+        self.log.write_ctx("log", self.log_class_heading, "__init__", \
+            "Initialization called")
+
+        self.start_time = time.time()
+        # Stage names in order of first use
+        self.stage_names = []
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.counters = {}
+        # Seconds per stage and counters of each slice number
+        self.slice_records = {}
+        self.current_slice = None
+
+    def stage(self, name, slice_num=None):
+        '''
+        Returns a context manager that adds the time spent inside it to the
+        stage 'name', and to the slice 'slice_num' if given.
+
+        Parameters:
+                    name:           <str>
+                                    Name of the stage.
+                    slice_num:      <int>
+                                    Number of the slice processed, if any.
+
+        Returns:
+                    span:           <lib.timing_lib.Stage_span>
+        '''
+        return Stage_span(self, name, slice_num)
+
+    def add_time(self, name, seconds, slice_num=None):
+        '''
+        Adds 'seconds' to the stage 'name' and to the slice 'slice_num'.
+        '''
+        if name not in self.stage_seconds:
+            self.stage_names.append(name)
+            self.stage_seconds[name] = 0.0
+            self.stage_calls[name] = 0
+        self.stage_seconds[name] += seconds
+        self.stage_calls[name] += 1
+        if slice_num is not None:
+            record = self.slice_records.setdefault(slice_num, {})
+            record[name] = record.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        '''
+        Adds 'amount' to the counter 'name', and to the one of the slice whose
+        stage is running.
+
+        Parameters:
+                    name:           <str>
+                                    Name of the counter.
+                    amount:         <int>
+                                    Value to add.
+        '''
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if self.current_slice is not None:
+            record = self.slice_records.setdefault(self.current_slice, {})
+            record[name] = record.get(name, 0) + amount
+
+    def count_bytes(self, array):
+        '''
+        Adds the size of 'array' to the counter 'bytes'. Objects without
+        'nbytes' are not counted.
+        '''
+        self.count('bytes', int(getattr(array, 'nbytes', 0)))
+
+    def report(self):
+        '''
+        Returns the times and counters recorded, as a dictionary that can be
+        written as JSON.
+
+        Returns:
+                    report:         <dict>
+                                    'seconds': wall time since the timer was
+                                    created, 'stages': name, calls and seconds
+                                    of each stage, 'counters' and 'slices':
+                                    seconds per stage and counters of each
+                                    slice.
+        '''
+        return {'seconds': time.time() - self.start_time,
+            'stages': [{'name': name, 'calls': self.stage_calls[name], \
+                'seconds': self.stage_seconds[name]} for name in \
+                self.stage_names],
+            'counters': dict(self.counters),
+            'slices': [dict(record, slice=slice_num) for slice_num, record in \
+                sorted(self.slice_records.items())]}
+
+    def write_report(self, out_f_path):
+        '''
+        Writes 'report' to the JSON file 'out_f_path'.
+        '''
+        with open(out_f_path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        self.log.write_ctx("log", self.log_class_heading, "write_report", \
+            "Timing report stored at "+out_f_path)
+
+    def summary(self, top=5):
+        '''
+        Returns a short text with the 'top' slowest stages and slices and the
+        counters.
+
+        Parameters:
+                    top:            <int>
+                                    Number of stages and slices listed.
+
+        Returns:
+                    text:           <str>
+        '''
+        lines = ['Run time: {:.2f} s'.format(time.time() - self.start_time)]
+        stages = sorted(self.stage_names, key=lambda name: \
+            self.stage_seconds[name], reverse=True)[:top]
+        lines.append('Slowest stages:')
+        for name in stages:
+            lines.append('  {:<28}{:>10.3f} s{:>8} calls'.format(name, \
+                self.stage_seconds[name], self.stage_calls[name]))
+
+        slice_seconds = {}
+        for slice_num, record in self.slice_records.items():
+            slice_seconds[slice_num] = sum([value for name, value in \
+                record.items() if name in self.stage_seconds])
+        slices = sorted(slice_seconds, key=lambda slice_num: \
+            slice_seconds[slice_num], reverse=True)[:top]
+        if slices:
+            lines.append('Slowest slices:')
+        for slice_num in slices:
+            record = self.slice_records[slice_num]
+            stage = max([name for name in record if name in \
+                self.stage_seconds], key=lambda name: record[name])
+            lines.append('  slice {:<22}{:>10.3f} s  mostly {}'.format(\
+                slice_num, slice_seconds[slice_num], stage))
+
+        if self.counters:
+            lines.append('Counters:')
+        for name in sorted(self.counters):
+            lines.append('  {:<28}{:>10}'.format(name, self.counters[name]))
+
+        return '\n'.join(lines)
+
+class Stage_span(object):
+    '''
+    Context manager returned by 'Run_timer.stage'. While it runs, the counters
+    of the timer are also added to its slice.
+    '''
+
+    def __init__(self, timer, name, slice_num):
+        self.timer = timer
+        self.name = name
+        self.slice_num = slice_num
+
+    def __enter__(self):
+        self.previous_slice = self.timer.current_slice
+        if self.slice_num is not None:
+            self.timer.current_slice = self.slice_num
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add_time(self.name, time.time() - self.start, \
+            self.timer.current_slice)
+        self.timer.current_slice = self.previous_slice
+        return False
+
+class Null_span(object):
+    '''
+    Context manager that does nothing, returned by 'Null_timer.stage'.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Null_timer(object):
+    '''
+    Timer that records nothing. Used when timing is disabled, so instrumented
+    code only pays a method call per stage.
+    '''
+    enabled = False
+    span = Null_span()
+
+    def stage(self, name, slice_num=None):
+        return self.span
+
+    def add_time(self, name, seconds, slice_num=None):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def count_bytes(self, array):
+        pass
+
+    def report(self):
+        return {}
+
+    def write_report(self, out_f_path):
+        pass
+
+    def summary(self, top=5):
+        return ''
+
+# Shared by the objects created while timing is disabled
+null_timer = Null_timer()
@@ -0,0 +1,89 @@
+import pytest
+import sys
+import os
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(tests_dir)
+# Modules of 'lib' import each other by their names, the phantoms of the
+# benchmarks are reused as test volumes and 'batch_inspect.py' is imported
+# from the root
+sys.path.insert(0, os.path.join(repo_dir, 'benchmarks'))
+sys.path.insert(0, os.path.join(repo_dir, 'lib'))
+sys.path.append(repo_dir)
+
+import logger_lib as logger
+import MRI_inspector as mri
+import structure as sct
+import phantoms
+
+
+@pytest.fixture
+def log():
+    return logger.NullLogger()
+
+
+@pytest.fixture
+def stct(log):
+    return sct.Structure(log)
+
+
+@pytest.fixture(scope='module')
+def phantom():
+    '''
+    White, gray matter and CSF volumes of a small synthetic brain.
+    '''
+    return phantoms.make_phantom((96, 128), 4, 20, seed=1)
+
+
+@pytest.fixture(scope='module')
+def phantom_dir(phantom, tmpdir_factory):
+    '''
+    Directory with the phantom written as the files of a scan.
+    '''
+    out_dir = str(tmpdir_factory.mktemp('phantom'))
+    phantoms.write_phantom(out_dir, phantom, seed=1)
+
+    return out_dir+'/'
+
+
+@pytest.fixture(scope='module')
+def scan_phantom():
+    '''
+    Synthetic brain with slices of the size of the scans, so that the
+    location rules accept objects of all the types.
+    '''
+    return phantoms.make_phantom((256, 256), 3, 80, seed=5)
+
+
+@pytest.fixture(scope='module')
+def scan_dir(scan_phantom, tmpdir_factory):
+    '''
+    Directory with 'scan_phantom' written as the files of a scan.
+    '''
+    out_dir = str(tmpdir_factory.mktemp('scan'))
+    phantoms.write_phantom(out_dir, scan_phantom, seed=5)
+
+    return out_dir+'/'
+
+
+def make_inspector(log, files_path):
+    '''
+    Returns an inspector of the scan files in 'files_path'.
+    '''
+    inspector = mri.MRI_inspect(log)
+    inspector.set_files_path(files_path)
+    inspector.set_files_names(phantoms.phantom_files)
+
+    return inspector
+
+
+def labelled_slices(stct, volume, name):
+    '''
+    Returns the slices of 'volume' with their labels and blobs made.
+    '''
+    slices = stct.create_slice_objs(volume, name)
+    for slice_obj in slices:
+        slice_obj.find_slice_labels()
+        slice_obj.make_blob_objs()
+
+    return slices
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from conftest import make_inspector
+
+
+def test_streamed_labels_3d_match_volume(log, phantom_dir):
+    inspector = make_inspector(log, phantom_dir)
+    inspector.inspect_volumes(labels3d=True)
+
+    streamed = make_inspector(log, phantom_dir)
+    streamed.make_matter_objs(lazy=True)
+    ids = []
+    for imobj_slice in streamed.iter_imobj_slices(labels3d=True):
+        ids.append([imobj_slice.wm_slice_obj.lbls_3d, \
+            imobj_slice.gm_slice_obj.lbls_3d])
+    for k, stream in enumerate(streamed.labels_3d_streams):
+        lookup = stream.global_ids()
+        slice_objs = inspector.matter_obj_list[k].slices_obj_list
+        assert len(ids) == len(slice_objs)
+        for slice_ids, slice_obj in zip(ids, slice_objs):
+            assert np.array_equal(lookup[slice_ids[k]], slice_obj.lbls_3d)
+
+
+@pytest.mark.parametrize('roi_margin', [None, 20])
+def test_batched_type3_matches_slices(log, phantom_dir, roi_margin):
+    summaries = []
+    for batched in (False, True):
+        inspector = make_inspector(log, phantom_dir)
+        inspector.set_type3_roi(roi_margin)
+        summaries.append(inspector.inspect_volumes(batched=batched))
+
+    assert summaries[0] == summaries[1]
+
+
+@pytest.mark.parametrize('roi_margin', [None, 20])
+@pytest.mark.parametrize('packed', [False, True])
+def test_workers_match_serial(log, scan_dir, roi_margin, packed):
+    summaries = []
+    for workers in (1, 2):
+        inspector = make_inspector(log, scan_dir)
+        inspector.set_type3_roi(roi_margin)
+        inspector.set_workers(workers)
+        summaries.append(inspector.inspect_volumes(packed=packed))
+
+    assert all([count > 0 for count in summaries[0]['imslices']])
+    assert summaries[0] == summaries[1]
+
+
+def test_type3_regions_are_kept_one_batch_at_a_time(log, phantom_dir):
+    inspector = make_inspector(log, phantom_dir)
+    inspector.inspect_volumes()
+    imobj_slices = inspector.imobj_slice_obj_list
+    for imobj_slice in inspector.iter_type3_regions(batch=2):
+        kept = [other for other in imobj_slices if other.type3_regions is not \
+            None]
+        assert len(kept) <= 2
+        imobj_slice.find_imobjs_type3()
+
+    assert all([other.type3_regions is None for other in imobj_slices])
@@ -0,0 +1,53 @@
+import json
+import os
+import pytest
+import batch_inspect as bti
+from conftest import make_inspector
+
+options = {'workers': 1, 'cache': None, 'packed': False, 'labels3d': False, \
+    'batched': False, 'roi': None}
+
+
+@pytest.fixture
+def subjects(phantom_dir, scan_dir, tmpdir):
+    '''
+    Manifest of two phantoms and a subject whose files do not exist.
+    '''
+    return [{'name': 'small', 'path': phantom_dir},
+        {'name': 'broken', 'path': str(tmpdir.join('missing'))},
+        {'name': 'large', 'path': scan_dir}]
+
+
+def read_summary(out_root, name):
+    with open(os.path.join(out_root, name, 'summary.json')) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('jobs, mem_cap', [(1, None), (3, 1)])
+def test_batch_runs_largest_first_and_survives_failure(subjects, tmpdir, \
+        jobs, mem_cap):
+    # A single job, or a memory cap below any subject, runs the subjects one
+    # at a time, so they finish in the order they are started
+    out_root = str(tmpdir.join('batch'))
+    results = bti.run_batch(subjects, out_root, jobs, mem_cap, options)
+
+    assert [result['name'] for result in results] == ['large', 'small', \
+        'broken']
+    assert [result['status'] for result in results] == ['ok', 'ok', 'failed']
+    assert results[2]['exitcode'] == 1
+    for result in results:
+        summary = read_summary(out_root, result['name'])
+        assert summary['status'] == result['status']
+        assert os.path.isfile(os.path.join(out_root, result['name'], \
+            'log.txt'))
+    assert 'error' in read_summary(out_root, 'broken')
+
+
+def test_batch_summary_matches_inspector(log, subjects, tmpdir):
+    out_root = str(tmpdir.join('batch'))
+    bti.run_batch(subjects[2:], out_root, options=options)
+    expected = make_inspector(log, subjects[2]['path']).inspect_volumes()
+    summary = read_summary(out_root, 'large')
+
+    assert summary['imslices'] == expected['imslices']
+    assert summary['objects'] == json.loads(json.dumps(expected['objects']))
@@ -0,0 +1,74 @@
+from skimage import measure as msr
+import numpy as np
+import pytest
+import bitvol_lib as bvl
+import locate_blobs as loc
+from conftest import labelled_slices
+
+
+def random_image(shape, seed):
+    rng = np.random.RandomState(seed)
+
+    return rng.uniform(0, 1, shape) < 0.5
+
+
+@pytest.mark.parametrize('width', [1, 8, 13, 64, 67])
+def test_overlap_crop_matches_correspondence(width):
+    mask = random_image((40, width), width)
+    bit_slice = bvl.pack_slice(mask)
+    rng = np.random.RandomState(width)
+    for seed in range(50):
+        rows = np.sort(rng.randint(0, 41, 2))
+        cols = np.sort(rng.randint(0, width+1, 2))
+        bbox = (rows[0], cols[0], rows[1]+1, cols[1]+1)
+        bbox = (bbox[0], bbox[1], min(bbox[2], 40), min(bbox[3], width))
+        crop = random_image((bbox[2]-bbox[0], bbox[3]-bbox[1]), seed)
+        expected = loc.correspondence(mask[bbox[0]:bbox[2], \
+            bbox[1]:bbox[3]], crop)
+
+        assert bit_slice.overlap_crop(crop, bbox) == expected
+
+
+def test_counts_match_dense(log):
+    volume_a = random_image((30, 45, 6), 0)
+    volume_b = random_image((30, 45, 6), 1)
+    bits_a = bvl.Bit_volume(log, volume_a, chunk=4)
+    bits_b = bvl.Bit_volume(log, volume_b, chunk=4)
+
+    assert bits_a.count() == np.sum(volume_a)
+    assert bits_a.overlap(bits_b) == np.sum(volume_a & volume_b)
+    assert np.array_equal((bits_a & bits_b).dense(), volume_a & volume_b)
+    assert np.array_equal((bits_a | bits_b).dense(), volume_a | volume_b)
+    for k in range(volume_a.shape[2]):
+        slice_a = bits_a.packed(k)
+        slice_b = bits_b.packed(k)
+        assert bits_a.count(k) == slice_a.count() == np.sum(volume_a[..., k])
+        assert bits_a.overlap(bits_b, k) == slice_a.overlap(slice_b) == \
+            np.sum(volume_a[..., k] & volume_b[..., k])
+        assert np.array_equal((slice_a & slice_b).dense(), \
+            volume_a[..., k] & volume_b[..., k])
+        assert np.array_equal((slice_a | slice_b).dense(), \
+            volume_a[..., k] | volume_b[..., k])
+
+
+def test_packed_main_mask_selects_same_type3(stct, scan_phantom):
+    wm, gm, csf = scan_phantom
+    wm_slices = labelled_slices(stct, wm, 'I3TWM')
+    gm_slices = labelled_slices(stct, gm, 'I3TGM')
+    found = 0
+    for wm_slice, gm_slice in zip(wm_slices, gm_slices):
+        mix_labels = msr.label(wm_slice.slc_arr | gm_slice.slc_arr)
+        main_mask = mix_labels == loc.main_blob_label(mix_labels)
+        main_bits = bvl.pack_slice(main_mask)
+        for slice_obj, select in [(wm_slice, \
+                stct.loc.characterize_blobs_type3_wm), (gm_slice, \
+                stct.loc.characterize_blobs_type3_gm)]:
+            for blob_obj in slice_obj.blobs_obj_list:
+                blob_obj.find_blob_centroid()
+            dense = select(slice_obj.blobs_obj_list, main_mask)
+            packed = select(slice_obj.blobs_obj_list, main_bits)
+            assert [blob.blob_num for blob in packed] == \
+                [blob.blob_num for blob in dense]
+            found += len(dense)
+
+    assert found > 0
@@ -0,0 +1,57 @@
+import SimpleITK as sitk
+import numpy as np
+import matter_lib as matt
+import cache_lib as cch
+from conftest import labelled_slices
+
+
+def cached_matter(log, stct, cache, volume):
+    matter_obj = matt.Matter(log, '', 'I3TGM.hdr', stct)
+    matter_obj.set_cache(cache)
+    matter_obj.volume_key = 'volume'
+    matter_obj.img3d = volume
+    matter_obj.make_slice_objs()
+
+    return matter_obj
+
+
+def test_blobs_round_trip(log, stct, phantom, tmpdir):
+    cache = cch.Stage_cache(log, str(tmpdir))
+    stored = cached_matter(log, stct, cache, phantom[1])
+    stored.slices_obj_list = labelled_slices(stct, phantom[1], 'I3TGM')
+    stored.store_blobs()
+
+    loaded = cached_matter(log, stct, cache, phantom[1])
+    assert loaded.load_blobs()
+    for stored_slice, loaded_slice in zip(stored.slices_obj_list, \
+            loaded.slices_obj_list):
+        assert np.array_equal(stored_slice.slc_lbl, loaded_slice.slc_lbl)
+        assert stored_slice.lbls_num == loaded_slice.lbls_num
+        stored_table = stored_slice.blob_features
+        loaded_table = loaded_slice.blob_features
+        for column in stored_table.dtype.names:
+            # Masks of the loaded tables stay in the store of the volume
+            if column != 'mask_offset':
+                assert np.array_equal(stored_table[column], \
+                    loaded_table[column])
+        for stored_blob, loaded_blob in zip(stored_slice.blobs_obj_list, \
+                loaded_slice.blobs_obj_list):
+            assert stored_blob.blob_num == loaded_blob.blob_num
+            assert stored_blob.blob_bbox == loaded_blob.blob_bbox
+            assert np.array_equal(stored_blob.blob_crop, loaded_blob.blob_crop)
+            assert stored_blob.props.centroid == loaded_blob.props.centroid
+
+
+def test_input_key_of_compressed_nifti(log, stct, phantom, tmpdir):
+    cache = cch.Stage_cache(log, str(tmpdir))
+    keys = []
+    for k in range(2):
+        f_name = 'I3TGM{}.nii.gz'.format(k)
+        image = sitk.GetImageFromArray(phantom[k].astype(np.int16))
+        sitk.WriteImage(image, str(tmpdir.join(f_name)))
+        matter_obj = matt.Matter(log, str(tmpdir)+'/', f_name, stct)
+        matter_obj.set_cache(cache)
+        keys.append(matter_obj.input_key())
+
+    assert keys[0] != keys[1]
+    assert keys[0] == matter_obj.input_key(f_name='I3TGM0.nii.gz')
@@ -0,0 +1,46 @@
+import pytest
+from conftest import labelled_slices
+
+
+def imobj_slices(stct, phantom):
+    '''
+    Returns the image object slices of the phantom, ready to find their image
+    objects. The CSF slices stand for the I3T ones, only used to plot.
+    '''
+    wm_slices, gm_slices = [labelled_slices(stct, volume, name) for \
+        volume, name in zip(phantom[:2], ['I3TWM', 'I3TGM'])]
+    for slice_obj in wm_slices+gm_slices:
+        for blob_obj in slice_obj.blobs_obj_list:
+            blob_obj.find_blob_centroid()
+        slice_obj.find_blobs_inner_regions()
+    csf_slices = stct.create_slice_objs(phantom[2], 'I3TCSF')
+
+    return [stct.create_imobj_slice_obj([wm, gm, csf, csf]) for wm, gm, csf \
+        in zip(wm_slices, gm_slices, csf_slices)]
+
+
+def found_blobs(imobj_slice):
+    '''
+    Finds the image objects of the three types and returns their blobs.
+    '''
+    imobj_slice.find_imobjs_type1()
+    imobj_slice.find_imobjs_type2()
+    imobj_slice.find_imobjs_type3()
+    blobs = [imobj_slice.type1_blobs, imobj_slice.type2_blobs_wm, \
+        imobj_slice.type2_blobs_gm, imobj_slice.type3_blobs_wm, \
+        imobj_slice.type3_blobs_gm]
+
+    return [[(blob.blob_num, tuple(blob.blob_bbox)) for blob in type_blobs] \
+        for type_blobs in blobs]
+
+
+@pytest.mark.parametrize('roi_margin', [None, 20])
+def test_context_does_not_change_imobjs(stct, scan_phantom, roi_margin):
+    stct.loc.roi_margin = roi_margin
+    for imobj_slice in imobj_slices(stct, scan_phantom):
+        shared = found_blobs(imobj_slice)
+        assert all(len(type_blobs) > 0 for type_blobs in shared)
+        assert imobj_slice.context is None
+        # Without a context every stage computes its intermediates again
+        imobj_slice.slice_context = lambda wm_slice=None, gm_slice=None: None
+        assert found_blobs(imobj_slice) == shared
@@ -0,0 +1,48 @@
+from skimage import measure as msr
+import numpy as np
+import pytest
+import phantoms
+from conftest import labelled_slices
+
+
+def test_feature_table_matches_regionprops(stct, phantom):
+    for volume, name in zip(phantom, ['I3TWM', 'I3TGM', 'I3TCSF']):
+        for slice_obj in labelled_slices(stct, volume, name):
+            table = slice_obj.blob_features
+            props = msr.regionprops(slice_obj.slc_lbl)
+            assert len(table) == len(props) == len(slice_obj.blobs_obj_list)
+            for row, prop, blob in zip(table, props, slice_obj.blobs_obj_list):
+                assert row['label'] == prop.label == blob.blob_num
+                assert row['area'] == prop.area
+                assert tuple(row['bbox']) == tuple(prop.bbox)
+                assert np.allclose(row['centroid'], prop.centroid)
+                assert np.array_equal(blob.blob_crop, prop.image)
+                assert np.array_equal(np.round(row['centroid']), \
+                    np.round(prop.centroid))
+
+
+def test_inner_regions_match_regionprops(stct, phantom):
+    for slice_obj in labelled_slices(stct, phantom[0], 'I3TWM'):
+        slice_obj.find_blobs_inner_regions()
+        props = msr.regionprops(slice_obj.slc_lbl)
+        for row, prop, blob in zip(slice_obj.blob_features, props, \
+                slice_obj.blobs_obj_list):
+            inner = prop.filled_image & ~prop.image
+            assert np.array_equal(blob.inner_crop, inner)
+            assert row['hole_area'] == np.sum(inner)
+
+
+@pytest.mark.parametrize('roi_margin', [None, 20])
+def test_stacked_regions_type3_match_slices(stct, roi_margin):
+    # Main blobs of different sizes give windows of different shapes
+    wm, gm, csf = phantoms.make_phantom((160, 256), 10, seed=3)
+    wm_slices = stct.create_slice_objs(wm, 'I3TWM')
+    gm_slices = stct.create_slice_objs(gm, 'I3TGM')
+    stct.loc.roi_margin = roi_margin
+    stacked = stct.loc.find_candidate_regions_type3_stack(wm_slices, gm_slices)
+
+    assert len(stacked) == len(gm_slices)
+    for wm_slice, gm_slice, regions in zip(wm_slices, gm_slices, stacked):
+        alone = stct.loc.find_candidate_regions_type3(wm_slice, gm_slice)
+        assert np.array_equal(regions[0], alone[0])
+        assert np.array_equal(regions[1], alone[1])
@@ -0,0 +1,51 @@
+import threading
+import logger_lib as logger
+
+
+class Failing_file(object):
+    def write(self, text):
+        raise IOError('No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_messages_are_written(tmpdir):
+    log_file = str(tmpdir.join('log.txt'))
+    log = logger.Logger(log_file, level='warn')
+    log.write_log('log', 'discarded')
+    log.write_ctx('warn', 'File: a.py Class: A', 'run', 'kept')
+    log.flush()
+    log.close()
+
+    lines = open(log_file).read().splitlines()
+    assert len(lines) == 2
+    assert lines[1].endswith('[warn]<<File: a.py Class: A Method: run ::: kept>>')
+
+
+def test_write_error_does_not_block(tmpdir):
+    log = logger.Logger(str(tmpdir.join('log.txt')))
+    log.container = Failing_file()
+    log.write_log('log', 'lost')
+    log.flush()
+    log.write_log('log', 'discarded')
+    log.flush()
+    log.close()
+
+    assert isinstance(log.error, IOError)
+    assert not log.writer.is_alive()
+
+
+def test_flush_returns_when_writer_is_stopped(tmpdir):
+    log = logger.Logger(str(tmpdir.join('log.txt')))
+    log.records.put(None)
+    log.writer.join()
+    flusher = threading.Thread(target=log.flush)
+    flusher.start()
+    flusher.join(5)
+
+    assert not flusher.is_alive()
+    log.close()
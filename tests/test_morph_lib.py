@@ -0,0 +1,94 @@
+from skimage import morphology as mph
+from scipy import ndimage as ndi
+import numpy as np
+import pytest
+import morph_lib as mrp
+import locate_blobs as loc
+
+# Elements of the type 3 search, full squares and asymmetric ones, some of
+# them of even dimensions
+struct_elems = [
+    loc.struct_elem_A,
+    loc.struct_elem_B,
+    np.ones((3,3)),
+    np.ones((5,5)),
+    np.ones((1,4)),
+    np.ones((2,1)),
+    np.array([[1,1,0],
+              [0,1,1]]),
+    np.array([[1,0],
+              [1,1]]),
+    np.array([[0,1,0,0],
+              [1,1,1,1],
+              [0,0,1,0]]),
+    ]
+
+# Slices of several shapes, including 1 pixel wide ones
+shapes = [(40, 60), (1, 30), (30, 1), (1, 1), (7, 3)]
+
+
+def random_image(shape, seed):
+    rng = np.random.RandomState(seed)
+
+    return rng.uniform(0, 1, shape) < 0.6
+
+
+@pytest.mark.parametrize('shape', shapes)
+@pytest.mark.parametrize('k', range(len(struct_elems)))
+def test_erosion_matches_ndimage(shape, k):
+    struct_elem = struct_elems[k]
+    image = random_image(shape, k)
+    expected = ndi.grey_erosion(image.astype(np.uint8), \
+        footprint=struct_elem) > 0
+
+    assert np.array_equal(mrp.binary_erosion(image, struct_elem), expected)
+
+
+@pytest.mark.parametrize('shape', shapes)
+@pytest.mark.parametrize('k', range(len(struct_elems)))
+def test_dilation_matches_ndimage(shape, k):
+    struct_elem = struct_elems[k]
+    image = random_image(shape, k)
+    expected = ndi.grey_dilation(image.astype(np.uint8), \
+        footprint=struct_elem) > 0
+
+    assert np.array_equal(mrp.binary_dilation(image, struct_elem), expected)
+
+
+@pytest.mark.parametrize('shape', shapes)
+@pytest.mark.parametrize('k', range(len(struct_elems)))
+def test_morphology_matches_skimage(shape, k):
+    # skimage only agrees with ndimage for symmetric elements of odd
+    # dimensions, the ones used with it before
+    struct_elem = struct_elems[k]
+    if struct_elem.shape[0] % 2 == 0 or struct_elem.shape[1] % 2 == 0 or \
+            not np.array_equal(struct_elem, struct_elem[::-1, ::-1]):
+        pytest.skip('skimage shifts even or asymmetric elements')
+    image = random_image(shape, k).astype(np.uint8)
+
+    assert np.array_equal(mrp.binary_erosion(image, struct_elem), \
+        mph.erosion(image, struct_elem) > 0)
+    assert np.array_equal(mrp.binary_dilation(image, struct_elem), \
+        mph.dilation(image, struct_elem) > 0)
+
+
+def test_stack_is_processed_slice_by_slice():
+    stack = np.stack([random_image((30, 50), seed) for seed in range(4)])
+    for struct_elem in struct_elems:
+        eroded = mrp.binary_erosion(stack, struct_elem)
+        dilated = mrp.binary_dilation(stack, struct_elem)
+        for k in range(len(stack)):
+            assert np.array_equal(eroded[k], mrp.binary_erosion(stack[k], \
+                struct_elem))
+            assert np.array_equal(dilated[k], mrp.binary_dilation(stack[k], \
+                struct_elem))
+
+
+def test_line_segments_cover_element():
+    for struct_elem in struct_elems:
+        covered = np.zeros(struct_elem.shape, dtype=np.bool_)
+        for segment in mrp.line_segments(struct_elem):
+            pixels = mrp.segment_pixels(segment)
+            assert np.all(struct_elem[pixels])
+            covered[pixels] = True
+        assert np.array_equal(covered, struct_elem != 0)
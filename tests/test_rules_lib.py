@@ -0,0 +1,108 @@
+from skimage import measure as msr
+import numpy as np
+import phantoms
+import locate_blobs as loc
+from conftest import labelled_slices
+
+# Per blob checks of the characterizations before the rules, as references
+
+
+def old_location(blob, min_row):
+    return not ((blob.blob_ctrd[0] < min_row) or \
+        (200 > blob.blob_ctrd[1] > 150))
+
+
+def old_type1(wm_blobs, gm_blobs):
+    type1_blobs = []
+    for i, gm_blob in enumerate(gm_blobs):
+        is_something = 0
+        for wm_blob in wm_blobs:
+            is_something += loc.correspondence(gm_blob.inner_mask, \
+                wm_blob.blob_mask)
+        for j, gm_blob2 in enumerate(gm_blobs):
+            self_corr = loc.correspondence(gm_blob.inner_mask, \
+                gm_blob2.blob_mask)
+            if j != i and self_corr > 5:
+                is_something += self_corr
+        if 3 <= gm_blob.props.area <= 2000 and old_location(gm_blob, 90) \
+                and is_something == 0:
+            type1_blobs.append(gm_blob)
+
+    return type1_blobs
+
+
+def old_type2(wm_blobs, gm_blobs):
+    type2_blobs = []
+    for gm_blob in gm_blobs:
+        wm_candidate = None
+        min_corr = 0
+        for wm_blob in wm_blobs:
+            wm_corr = loc.correspondence(gm_blob.inner_mask, wm_blob.blob_mask)
+            if wm_corr > min_corr:
+                min_corr = wm_corr
+                wm_candidate = wm_blob
+        if 3 <= gm_blob.props.area <= 2000 and old_location(gm_blob, 90) \
+                and np.sum(gm_blob.inner_mask) >= 3 and min_corr > 0:
+            type2_blobs.append((wm_candidate, gm_blob))
+
+    return type2_blobs
+
+
+def old_type3(blobs, main_mask, min_area, max_area):
+    return [blob for blob in blobs if \
+        min_area <= blob.props.area <= max_area and old_location(blob, 95) \
+        and loc.correspondence(main_mask, blob.blob_mask) > \
+        blob.props.area*0.8]
+
+
+def main_mask(wm_slice, gm_slice):
+    '''
+    Returns the biggest blob of the mix of both slices.
+    '''
+    mix_lbl = msr.label(wm_slice.slc_arr | gm_slice.slc_arr)
+    areas = np.bincount(mix_lbl.ravel())
+    areas[0] = 0
+
+    return mix_lbl == np.argmax(areas)
+
+
+def numbers(blobs):
+    return [blob.blob_num for blob in blobs]
+
+
+def test_rules_match_old_characterization(stct):
+    # Slices of the size of the scans, so that all the types are found,
+    # without noise to keep the references fast
+    wm, gm, csf = phantoms.make_phantom((256, 256), 3, 80, noise=0, seed=5)
+    wm_slices = labelled_slices(stct, wm, 'I3TWM')
+    gm_slices = labelled_slices(stct, gm, 'I3TGM')
+    found = np.zeros(4, dtype=np.int64)
+    for wm_slice, gm_slice in zip(wm_slices, gm_slices):
+        for slice_obj in [wm_slice, gm_slice]:
+            for blob_obj in slice_obj.blobs_obj_list:
+                blob_obj.find_blob_centroid()
+            slice_obj.find_blobs_inner_regions()
+        wm_blobs = wm_slice.blobs_obj_list
+        gm_blobs = gm_slice.blobs_obj_list
+
+        type1_blobs = stct.loc.characterize_blobs_type1(wm_blobs, gm_blobs)
+        assert numbers(type1_blobs) == numbers(old_type1(wm_blobs, gm_blobs))
+
+        type2_blobs = [(numbers([wm_blob]), numbers([gm_blob])) for \
+            wm_blob, gm_blob in zip(*stct.loc.characterize_blobs_type2(\
+            wm_blobs, gm_blobs))]
+        assert type2_blobs == [(numbers([wm_blob]), numbers([gm_blob])) for \
+            wm_blob, gm_blob in old_type2(wm_blobs, gm_blobs)]
+
+        mask = main_mask(wm_slice, gm_slice)
+        type3_wm = stct.loc.characterize_blobs_type3_wm(wm_blobs, mask)
+        assert numbers(type3_wm) == numbers(old_type3(wm_blobs, mask, 3, \
+            2000))
+        type3_gm = stct.loc.characterize_blobs_type3_gm(gm_blobs, mask)
+        assert numbers(type3_gm) == numbers(old_type3(gm_blobs, mask, 15, \
+            3000))
+
+        found += [len(type1_blobs), len(type2_blobs), len(type3_wm), \
+            len(type3_gm)]
+
+    assert np.all(found > 0)